@@ -1,12 +1,25 @@
 import streamlit as st
+import hashlib
 import os
+import secrets
 from dotenv import load_dotenv
+from cache_warmer import get_cache_warmer
+from cancellation import submit_request
 from chatbot import PapuyChatbot
+from conversation_store import get_conversation_store
+from credentials import credential_status, load_keys
+from memory_report import format_bytes, get_session_tracker, process_rss
+from providers import get_search_engine
+from settings import get_int_setting, get_setting
+from shared_state import get_state_backend, get_json, set_json
 import time
 
 # Load environment variables
 load_dotenv()
 
+# Background cache warmer (once per process; off unless PAPUY_WARMER_INTERVAL is set)
+get_cache_warmer()
+
 # Initialize session state
 if 'authenticated' not in st.session_state:
     st.session_state.authenticated = False
@@ -14,27 +27,190 @@ if 'chatbot' not in st.session_state:
     st.session_state.chatbot = None
 if 'messages' not in st.session_state:
     st.session_state.messages = []
+if 'conversation_id' not in st.session_state:
+    st.session_state.conversation_id = None
 if 'show_love' not in st.session_state:
     st.session_state.show_love = False
+if 'active_request' not in st.session_state:
+    st.session_state.active_request = None
+if 'memory_handle' not in st.session_state:
+    st.session_state.memory_handle = get_session_tracker().register()
 
 def login(username, password):
     return username == st.secrets["APP_USERNAME"] and password == st.secrets["APP_PASSWORD"]
 
 def initialize_chatbot():
     try:
-        if not st.secrets["OPENAI_API_KEY"]:
+        if not load_keys("OPENAI_API_KEY"):
             st.error("OpenAI API key not found. Please add it to your .env file.")
             return False
-        st.session_state.chatbot = PapuyChatbot()
+        store = get_conversation_store()
+        owner = st.secrets["APP_USERNAME"]
+        # Resume the last conversation so history survives server restarts
+        conversation_id = st.session_state.conversation_id or store.latest_conversation(owner)
+        st.session_state.chatbot = PapuyChatbot(store=store, conversation_id=conversation_id, owner=owner)
+        st.session_state.conversation_id = st.session_state.chatbot.conversation_id
+        load_recent_messages()
         return True
     except Exception as e:
         st.error(f"Error initializing chatbot: {str(e)}")
         return False
 
+# Only this many displayed messages are kept in session_state; older ones load on demand
+DISPLAY_WINDOW = get_int_setting("PAPUY_DISPLAY_WINDOW", 30)
+
+def load_recent_messages():
+    st.session_state.messages = st.session_state.chatbot.load_history(DISPLAY_WINDOW)
+
+def refresh_messages():
+    # New turns are appended to what is displayed, so older messages the user loaded stay
+    if not st.session_state.messages:
+        load_recent_messages()
+        return
+    first_seq = st.session_state.messages[0]["seq"]
+    recent = st.session_state.chatbot.load_history(len(st.session_state.messages) + DISPLAY_WINDOW)
+    st.session_state.messages = [message for message in recent if message["seq"] >= first_seq]
+
+def load_older_messages():
+    if not st.session_state.messages:
+        return
+    older = st.session_state.chatbot.load_history(DISPLAY_WINDOW, before=st.session_state.messages[0]["seq"])
+    st.session_state.messages = older + st.session_state.messages
+
+def has_older_messages():
+    if not st.session_state.messages or st.session_state.chatbot is None:
+        return False
+    return bool(st.session_state.chatbot.load_history(1, before=st.session_state.messages[0]["seq"]))
+
+# Sessions are recorded in the shared state backend, so a reconnect routed to
+# another replica can re-attach without sticky sessions
+SESSION_TTL = get_int_setting("PAPUY_SESSION_TTL", 12 * 3600)
+
+def session_key(token):
+    # Only a digest is stored, so the backend never holds a usable token
+    return f"session:{hashlib.sha256(token.encode()).hexdigest()}"
+
+def session_binding():
+    # A token only restores for the same credentials and browser; changing the password logs everyone out
+    user_agent = st.context.headers.get("User-Agent", "") if hasattr(st, "context") else ""
+    fingerprint = "\x1f".join((st.secrets["APP_USERNAME"], st.secrets["APP_PASSWORD"], user_agent))
+    return hashlib.sha256(fingerprint.encode()).hexdigest()
+
+def save_session():
+    # Every save issues a new token and drops the old one, so links copied earlier stop working
+    end_session()
+    token = secrets.token_urlsafe(24)
+    set_json(
+        session_key(token),
+        {"conversation_id": st.session_state.conversation_id, "binding": session_binding()},
+        ttl=SESSION_TTL
+    )
+    st.query_params["session"] = token
+
+def restore_session():
+    token = st.query_params.get("session")
+    if not token:
+        return False
+    session = get_json(session_key(token))
+    if not session or not secrets.compare_digest(session.get("binding", ""), session_binding()):
+        end_session()
+        return False
+    st.session_state.conversation_id = session["conversation_id"]
+    if not initialize_chatbot():
+        return False
+    st.session_state.authenticated = True
+    save_session()
+    return True
+
+def end_session():
+    token = st.query_params.get("session")
+    if token:
+        get_state_backend().delete(session_key(token))
+        del st.query_params["session"]
+
+def answer(chatbot, prompt, token):
+    # Runs on a request worker and never touches st: an error becomes the recorded answer.
+    # The turn lock waits for a cancelled answer still unwinding on another worker.
+    with chatbot.turn_lock:
+        try:
+            return chatbot.get_response(prompt, token=token)
+        except Exception as e:
+            error_message = f"Lo siento, pero encontré un error: {str(e)}"
+            chatbot.record_turn(prompt, error_message, context=False)
+            return error_message
+
+def cancel_active_request(reason):
+    # Reruns share session_state, so a newer run can stop the answer a worker is still computing
+    request = st.session_state.active_request
+    if request is not None:
+        request["token"].cancel(reason)
+        st.session_state.active_request = None
+
+def show_active_request():
+    # Polling keeps st.* calls flowing, so a new prompt, a new conversation or logout
+    # interrupts this run right away and the next run cancels the token
+    request = st.session_state.active_request
+    if request is None:
+        return
+    with st.chat_message("user", avatar="👩‍⚕️"):
+        st.markdown(request["prompt"])
+    with st.chat_message("assistant", avatar="🤖"):
+        status = st.empty()
+        while not request["future"].done():
+            status.markdown(f"⏳ Pensando... {time.monotonic() - request['started']:.0f} s")
+            time.sleep(0.25)
+        status.empty()
+    if st.session_state.active_request is request:
+        st.session_state.active_request = None
+    # The chatbot has recorded the turn (or nothing, if it was cancelled)
+    refresh_messages()
+    st.rerun()
+
+def track_session():
+    # The handle must point at the current objects: messages is reassigned on every reload
+    st.session_state.memory_handle.update(
+        chatbot=st.session_state.chatbot, messages=st.session_state.messages
+    )
+
+def show_memory_report():
+    tracker = get_session_tracker()
+    if st.button("Fijar línea base", use_container_width=True):
+        tracker.set_baseline()
+    if not st.button("Medir memoria", use_container_width=True):
+        return
+    with st.spinner("Midiendo..."):
+        sessions = tracker.report(limit=10)
+        caches = tracker.cache_report()
+        orphaned = tracker.orphaned_chatbots()
+        allocations = tracker.top_allocations(limit=10)
+    st.markdown(f"**Proceso (RSS):** {format_bytes(process_rss())} · **sesiones:** {len(tracker.sessions())}")
+    if orphaned:
+        st.warning(f"{orphaned} chatbot(s) sin sesión siguen en memoria")
+    st.markdown("**Sesiones más grandes**")
+    for row in sessions:
+        detail = " · ".join(f"{name} {format_bytes(size)}" for name, size in row["parts"].items())
+        st.markdown(
+            f"`{row['session']}` **{format_bytes(row['total'])}** "
+            f"(inactiva {row['idle_seconds'] / 60:.0f} min)  \n{detail}"
+        )
+    if caches is not None:
+        st.markdown("**Caché compartida**")
+        for namespace, size in caches[:10]:
+            st.markdown(f"{namespace}: {format_bytes(size)}")
+    if allocations:
+        st.markdown("**Principales asignaciones (tracemalloc)**")
+        for stat in allocations:
+            growth = f" ({format_bytes(stat['size_diff'])} desde la línea base)" if stat["size_diff"] is not None else ""
+            st.markdown(f"`{stat['location']}` {format_bytes(stat['size'])}{growth}")
+
 def clear_conversation():
+    cancel_active_request("nueva_conversacion")
     st.session_state.messages = []
     if st.session_state.chatbot:
-        st.session_state.chatbot.messages = []
+        with st.session_state.chatbot.turn_lock:
+            st.session_state.chatbot.start_new_conversation(st.secrets["APP_USERNAME"])
+        st.session_state.conversation_id = st.session_state.chatbot.conversation_id
+        save_session()
     st.rerun()
 
 def toggle_love():
@@ -427,6 +603,10 @@ def main():
     
     local_css()
 
+    if not st.session_state.authenticated:
+        restore_session()
+    track_session()
+
     if not st.session_state.authenticated:
         # Center the login form
         _, login_col, _ = st.columns([1, 2, 1])
@@ -444,6 +624,7 @@ def main():
                     if login(username, password):
                         if initialize_chatbot():
                             st.session_state.authenticated = True
+                            save_session()
                             st.success("¡Inicio de sesión exitoso!")
                             st.rerun()
                     else:
@@ -477,11 +658,31 @@ def main():
             with st.expander("Cuenta"):
                 st.markdown(f"**Usuario:** Emily")
                 if st.button("Cerrar Sesión", use_container_width=True):
+                    cancel_active_request("cierre_sesion")
+                    end_session()
                     st.session_state.authenticated = False
                     st.session_state.chatbot = None
                     st.session_state.messages = []
+                    st.session_state.conversation_id = None
                     st.rerun()
-            
+            with st.expander("📊 Estado de proveedores"):
+                states = {"closed": "🟢", "half_open": "🟡", "open": "🔴"}
+                for status in get_search_engine().status():
+                    p90 = f"{status['p90']:.1f}s" if status['p90'] is not None else "-"
+                    st.markdown(
+                        f"{states[status['state']]} **{status['provider']}** · "
+                        f"errores {status['error_rate']:.0%} · p90 {p90}"
+                    )
+                for status in credential_status():
+                    state = f"⏸️ {status['cooldown']:.0f}s" if status['cooldown'] else "▶️"
+                    remaining = f" · quedan {status['remaining']}" if status['remaining'] is not None else ""
+                    st.markdown(
+                        f"{state} {status['pool']} `{status['key']}` · {status['requests']} peticiones{remaining}"
+                    )
+            if get_setting("PAPUY_MEMORY_VIEW") == "1":
+                with st.expander("🧠 Memoria"):
+                    show_memory_report()
+
             # Push content to bottom
             st.markdown("<div style='flex-grow: 1;'></div>", unsafe_allow_html=True)
             
@@ -511,6 +712,12 @@ def main():
         # Messages container
         st.markdown('<div class="messages-container">', unsafe_allow_html=True)
         
+        # Older messages stay in the conversation store until requested
+        if has_older_messages():
+            if st.button("⬆️ Cargar mensajes anteriores", key="load_older"):
+                load_older_messages()
+                st.rerun()
+        
         # Display chat messages
         for message in st.session_state.messages:
             icon = "👩‍⚕️" if message["role"] == "user" else "🤖"
@@ -524,7 +731,7 @@ def main():
         prompt = st.chat_input("Pregúntame sobre investigación médica...", key="chat_input")
         
         # Welcome message only if no messages and no current input
-        if not st.session_state.messages and not prompt:
+        if not st.session_state.messages and not prompt and st.session_state.active_request is None:
             st.markdown("""
             <div class='welcome-container'>
                 <h1>👩‍⚕️ Bienvenida a Papuy</h1>
@@ -541,29 +748,20 @@ def main():
             """, unsafe_allow_html=True)
         
         if prompt:
-            # Add user message
-            st.session_state.messages.append({"role": "user", "content": prompt})
-            with st.chat_message("user", avatar="👩‍⚕️"):
-                st.markdown(prompt)
-            
-            # Get bot response
-            with st.chat_message("assistant", avatar="🤖"):
-                with st.spinner("Pensando..."):
-                    try:
-                        if st.session_state.chatbot is None:
-                            if not initialize_chatbot():
-                                st.error("Error al inicializar el chatbot. Por favor, intenta iniciar sesión nuevamente.")
-                                return
-                        response = st.session_state.chatbot.get_response(prompt)
-                        st.markdown(response)
-                        st.session_state.messages.append({"role": "assistant", "content": response})
-                    except Exception as e:
-                        error_message = f"Lo siento, pero encontré un error: {str(e)}"
-                        st.error(error_message)
-                        st.session_state.messages.append({"role": "assistant", "content": error_message})
+            cancel_active_request("nuevo_mensaje")
+            if st.session_state.chatbot is None and not initialize_chatbot():
+                st.error("Error al inicializar el chatbot. Por favor, intenta iniciar sesión nuevamente.")
+                return
+            # The answer is computed off the script thread, so this run stays responsive
+            token, future = submit_request(answer, st.session_state.chatbot, prompt)
+            st.session_state.active_request = {
+                "token": token, "future": future, "prompt": prompt, "started": time.monotonic()
+            }
+        show_active_request()
         st.markdown('</div>', unsafe_allow_html=True)  # Close input-container
         
         st.markdown('</div>', unsafe_allow_html=True)  # Close chat-layout
+        track_session()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
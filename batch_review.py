@@ -0,0 +1,233 @@
+"""Batch literature review: search and summarize many topics from a file.
+
+Usage:
+    python batch_review.py temas.txt --output-dir revision --workers 4
+
+One topic per line (blank lines and lines starting with # are ignored).
+Progress is checkpointed after every topic, so re-running the same command
+resumes an interrupted run.
+"""
+import argparse
+import functools
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+import httpx
+from chatbot import PapuyChatbot
+from credentials import PooledTransport, get_credential_pool
+from providers import build_search_engine
+from reranker import rank_papers, fold_accents
+from shared_state import set_job_status
+
+
+class RateLimiter:
+    """Spaces calls evenly so a provider never sees more than ``per_minute`` requests a minute"""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def wrap(self, func):
+        @functools.wraps(func)
+        def limited(*args, **kwargs):
+            self.acquire()
+            return func(*args, **kwargs)
+        return limited
+
+
+class Checkpoint:
+    """Per-topic progress saved atomically after every update"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.topics = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.topics = json.load(f)
+
+    def is_done(self, topic):
+        return self.topics.get(topic, {}).get("status") == "done"
+
+    def update(self, topic, **fields):
+        with self._lock:
+            self.topics.setdefault(topic, {}).update(fields)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.topics, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+def read_topics(path):
+    with open(path, encoding="utf-8") as f:
+        topics = [line.strip() for line in f if line.strip() and not line.strip().startswith("#")]
+    return list(dict.fromkeys(topics))
+
+
+def slugify(topic):
+    slug = re.sub(r"[^a-z0-9]+", "-", fold_accents(topic.lower())).strip("-")[:60]
+    digest = hashlib.sha1(topic.encode()).hexdigest()[:6]
+    return f"{slug}-{digest}"
+
+
+class BatchReview:
+    def __init__(self, output_dir, language="en", workers=4, summaries=3,
+                 scholar_rpm=30, pubmed_rpm=180, llm_rpm=60, job_id=None):
+        self.output_dir = output_dir
+        self.language = language
+        self.workers = workers
+        self.summaries = summaries
+        self.job_id = job_id or f"batch:{os.path.abspath(output_dir)}"
+        os.makedirs(output_dir, exist_ok=True)
+        self.checkpoint = Checkpoint(os.path.join(output_dir, "checkpoint.json"))
+        # Limiters are shared by all workers: the provider limits are per deployment
+        self.scholar_limiter = RateLimiter(scholar_rpm)
+        self.pubmed_limiter = RateLimiter(pubmed_rpm)
+        self.llm_limiter = RateLimiter(llm_rpm)
+        # A private engine, so the limits never slow down the app's users; hedged retries are limited too
+        self.search_engine = build_search_engine()
+        providers = self.search_engine.providers
+        if "scholar" in providers:
+            providers["scholar"].search = self.scholar_limiter.wrap(providers["scholar"].search)
+        if "pubmed" in providers:
+            # Per NCBI request, not per search: each search is an esearch plus an efetch
+            providers["pubmed"]._get = self.pubmed_limiter.wrap(providers["pubmed"]._get)
+        # Every HTTP request to the model API takes a slot: each map, collapse and reduce step
+        # of a summary counts, while translations answered from the cache never reach it
+        self.llm_client = httpx.Client(
+            transport=PooledTransport(get_credential_pool("openai")),
+            event_hooks={"request": [lambda request: self.llm_limiter.acquire()]}
+        )
+        self._local = threading.local()
+        self._chatbots = []
+        self._chatbots_lock = threading.Lock()
+
+    def _chatbot(self):
+        # One chatbot per worker thread: each keeps its own conversation window
+        chatbot = getattr(self._local, "chatbot", None)
+        if chatbot is None:
+            chatbot = PapuyChatbot(owner="batch", search_engine=self.search_engine, http_client=self.llm_client)
+            self._local.chatbot = chatbot
+            with self._chatbots_lock:
+                self._chatbots.append(chatbot)
+        return chatbot
+
+    def _delete_conversations(self):
+        # The workers' hidden summary turns are not a conversation anyone reads
+        with self._chatbots_lock:
+            chatbots, self._chatbots = self._chatbots, []
+        for chatbot in chatbots:
+            try:
+                chatbot.store.delete(chatbot.conversation_id)
+            except Exception:
+                pass
+
+    def process_topic(self, topic):
+        chatbot = self._chatbot()
+        started = time.monotonic()
+        papers = chatbot.search_papers(topic, self.language)
+        if isinstance(papers, str):  # Error occurred
+            raise RuntimeError(papers)
+        papers = [ranked.paper for ranked in rank_papers(topic, papers)]
+
+        report = f"# {topic}\n\n"
+        report += f"_Generado el {datetime.now():%Y-%m-%d %H:%M}_\n\n"
+        report += chatbot.format_article_response(papers) if papers else "No se encontraron artículos.\n\n"
+        if papers and self.summaries:
+            report += "## 🧾 Resúmenes\n\n"
+            for i, paper in enumerate(papers[:self.summaries], 1):
+                summary = chatbot.summarize_paper(paper['abstract'], paper.get('url'))
+                if isinstance(summary, str) and summary.startswith("Error"):
+                    # Failed, not done: a re-run retries the topic instead of keeping the error in its report
+                    raise RuntimeError(summary)
+                report += f"### {i}. {paper['title']}\n\n{summary}\n\n"
+
+        report_name = f"{slugify(topic)}.md"
+        with open(os.path.join(self.output_dir, report_name), "w", encoding="utf-8") as f:
+            f.write(report)
+        return {"report": report_name, "papers": len(papers), "seconds": round(time.monotonic() - started, 1)}
+
+    def write_index(self, topics):
+        index = "# 📚 Revisión de Literatura\n\n"
+        index += "| Tema | Estado | Artículos | Reporte |\n"
+        index += "|------|--------|-----------|---------|\n"
+        for topic in topics:
+            entry = self.checkpoint.topics.get(topic, {})
+            status = "✅" if entry.get("status") == "done" else f"⚠️ {entry.get('error', 'pendiente')}"
+            report = f"[{entry['report']}]({entry['report']})" if entry.get("report") else "-"
+            index += f"| {topic} | {status} | {entry.get('papers', '-')} | {report} |\n"
+        with open(os.path.join(self.output_dir, "index.md"), "w", encoding="utf-8") as f:
+            f.write(index)
+
+    def run(self, topics, retry_failed=True):
+        pending = [topic for topic in topics if not self.checkpoint.is_done(topic)]
+        if not retry_failed:
+            pending = [topic for topic in pending if topic not in self.checkpoint.topics]
+        done = len(topics) - len(pending)
+        set_job_status(self.job_id, state="running", total=len(topics), done=done, failed=0)
+        print(f"{len(topics)} temas, {done} ya completados, {len(pending)} pendientes")
+
+        failed = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = {executor.submit(self.process_topic, topic): topic for topic in pending}
+                for future in as_completed(futures):
+                    topic = futures[future]
+                    try:
+                        result = future.result()
+                        self.checkpoint.update(topic, status="done", error=None, **result)
+                        done += 1
+                        print(f"[{done}/{len(topics)}] ✅ {topic} ({result['papers']} artículos, {result['seconds']}s)")
+                    except Exception as e:
+                        self.checkpoint.update(topic, status="failed", error=str(e))
+                        failed += 1
+                        print(f"[{done}/{len(topics)}] ⚠️ {topic}: {e}")
+                    set_job_status(self.job_id, state="running", total=len(topics), done=done, failed=failed)
+        finally:
+            self._delete_conversations()
+
+        self.write_index(topics)
+        set_job_status(self.job_id, state="finished", total=len(topics), done=done, failed=failed)
+        return done, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Busca y resume artículos para muchos temas en paralelo.")
+    parser.add_argument("topics_file", help="Archivo con un tema por línea")
+    parser.add_argument("--output-dir", default="revision", help="Directorio de reportes y checkpoint")
+    parser.add_argument("--language", choices=["en", "es"], default="en", help="Idioma de búsqueda")
+    parser.add_argument("--workers", type=int, default=4, help="Temas procesados en paralelo")
+    parser.add_argument("--summaries", type=int, default=3, help="Artículos resumidos por tema (0 para ninguno)")
+    parser.add_argument("--scholar-rpm", type=float, default=30, help="Máximo de búsquedas por minuto en SerpAPI")
+    parser.add_argument("--pubmed-rpm", type=float, default=180, help="Máximo de peticiones por minuto a NCBI (dos por búsqueda; 180 = 3/s, el límite sin API key)")
+    parser.add_argument("--llm-rpm", type=float, default=60, help="Máximo de llamadas al modelo por minuto")
+    parser.add_argument("--skip-failed", action="store_true", help="No reintentar temas que fallaron antes")
+    parser.add_argument("--job-id", help="Identificador del trabajo en el estado compartido")
+    args = parser.parse_args()
+
+    review = BatchReview(
+        args.output_dir, language=args.language, workers=args.workers, summaries=args.summaries,
+        scholar_rpm=args.scholar_rpm, pubmed_rpm=args.pubmed_rpm, llm_rpm=args.llm_rpm, job_id=args.job_id
+    )
+    done, failed = review.run(read_topics(args.topics_file), retry_failed=not args.skip_failed)
+    print(f"Completados: {done}, fallidos: {failed}. Índice en {os.path.join(args.output_dir, 'index.md')}")
+
+
+if __name__ == "__main__":
+    main()
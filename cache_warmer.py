@@ -0,0 +1,148 @@
+"""Cache warmer: keeps the most searched topics hot in the shared caches.
+
+Usage:
+    python cache_warmer.py --once --top-n 20 --budget 600
+
+The app runs the warmer in a background thread every PAPUY_WARMER_INTERVAL
+seconds (0 disables it). The run slot is claimed in the shared state, so only
+one replica warms per interval; ``--once`` suits an external cron instead.
+"""
+import argparse
+import threading
+import time
+from cancellation import CancellationToken, Cancelled, use_token
+from chatbot import PapuyChatbot
+from intent_router import use_route
+from metrics import get_metrics
+from prefetch import get_prefetcher
+from settings import get_int_setting
+from shared_state import get_state_backend, refresh_ahead
+
+
+class CacheWarmer:
+    """Re-runs the full search pipeline for the top-N popular queries within a time budget
+
+    Queries whose assembled results are still cached past the next run are
+    skipped; the rest rebuild their response. Rebuilding runs under
+    ``refresh_ahead``, so cached translations, pages and PDFs that would expire
+    before the next run are fetched again too, not just missing ones.
+    """
+
+    def __init__(self, interval=21600, top_n=20, budget_seconds=600, backend=None, chatbot_factory=None):
+        self.interval = interval
+        self.top_n = top_n
+        self.budget_seconds = budget_seconds
+        self.backend = backend or get_state_backend()
+        self.chatbot_factory = chatbot_factory or (lambda: PapuyChatbot(owner="warmer"))
+        self.metrics = get_metrics()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _claim_slot(self):
+        key = f"warmer:slot:{int(time.time() // self.interval)}"
+        if self.backend.incr(key) != 1:
+            return False
+        self.backend.expire(key, self.interval * 2)
+        return True
+
+    def run_once(self):
+        """Warm the popular queries; returns (warmed, skipped, failed)"""
+        started = time.monotonic()
+        warmed = skipped = failed = 0
+        chatbot = self.chatbot_factory()
+        # The budget cancels the pipeline mid-topic, not just between topics
+        token = CancellationToken()
+        timer = threading.Timer(self.budget_seconds, token.cancel, args=("presupuesto",))
+        timer.daemon = True
+        timer.start()
+        try:
+            # Only what would expire before the next run: anything longer re-downloads fresh entries every run
+            with use_token(token), use_route("warmer"), refresh_ahead(self.interval):
+                for query, language, count in chatbot.popularity.top(self.top_n):
+                    token.check()
+                    if chatbot.query_cache.fresh_until(query, language) > time.time() + self.interval:
+                        skipped += 1
+                        continue
+                    # Users first: wait for in-flight responses to finish before each topic
+                    get_prefetcher().wait_for_idle(timeout=60)
+                    result = chatbot.build_search_response(query, language)
+                    if isinstance(result, str):  # Error occurred
+                        failed += 1
+                        continue
+                    # Inline rather than on the prefetch pool, so the PDFs are refreshed ahead too
+                    for key, task in chatbot.prefetch_tasks(result[0]):
+                        task()
+                    warmed += 1
+        except Cancelled:
+            pass
+        finally:
+            timer.cancel()
+            # The warmer's hidden summary turns are not a conversation anyone reads
+            chatbot.store.delete(chatbot.conversation_id)
+        self.metrics.incr("warmer_queries_total", warmed, outcome="warmed")
+        self.metrics.incr("warmer_queries_total", skipped, outcome="fresh")
+        self.metrics.incr("warmer_queries_total", failed, outcome="error")
+        self.metrics.observe("warmer_run_seconds", time.monotonic() - started)
+        return warmed, skipped, failed
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if self._claim_slot():
+                    self.run_once()
+            except Exception:
+                self.metrics.incr("warmer_runs_failed_total")
+            # Sleep to the next slot boundary so replicas compete for the same slot
+            self._stop.wait(self.interval - time.time() % self.interval + 1)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="papuy-warmer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+_warmer = None
+_warmer_lock = threading.Lock()
+
+
+def get_cache_warmer():
+    """Process-wide warmer, started on first use when PAPUY_WARMER_INTERVAL is set"""
+    global _warmer
+    with _warmer_lock:
+        if _warmer is None:
+            _warmer = CacheWarmer(
+                interval=get_int_setting("PAPUY_WARMER_INTERVAL", 0) or 21600,
+                top_n=get_int_setting("PAPUY_WARMER_TOP_N", 20),
+                budget_seconds=get_int_setting("PAPUY_WARMER_BUDGET", 600)
+            )
+            if get_int_setting("PAPUY_WARMER_INTERVAL", 0):
+                _warmer.start()
+        return _warmer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precalienta las cachés con las búsquedas más populares.")
+    parser.add_argument("--once", action="store_true", help="Ejecuta una sola pasada y termina")
+    parser.add_argument("--top-n", type=int, default=get_int_setting("PAPUY_WARMER_TOP_N", 20), help="Búsquedas populares a precalentar")
+    parser.add_argument("--budget", type=int, default=get_int_setting("PAPUY_WARMER_BUDGET", 600), help="Tiempo máximo por pasada (segundos)")
+    parser.add_argument("--interval", type=int, default=get_int_setting("PAPUY_WARMER_INTERVAL", 0) or 21600, help="Segundos entre pasadas")
+    args = parser.parse_args()
+
+    warmer = CacheWarmer(interval=args.interval, top_n=args.top_n, budget_seconds=args.budget)
+    if args.once:
+        warmed, skipped, failed = warmer.run_once()
+        print(f"Precalentadas: {warmed}, vigentes: {skipped}, con error: {failed}")
+        return
+    warmer.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        warmer.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import contextvars
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from settings import get_int_setting
+
+
+class Cancelled(BaseException):
+    """Raised when a request's token is cancelled
+
+    A BaseException, like asyncio.CancelledError, so the pipeline's
+    ``except Exception`` handlers do not turn it into an error message.
+    """
+
+    def __init__(self, reason=None):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class CancellationToken:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._future = None
+        self.cancelled = False
+        self.reason = None
+
+    def cancel(self, reason=None):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled(self.reason)
+
+    def on_cancel(self, callback):
+        """Run ``callback`` on cancellation (immediately if already cancelled); returns an unregister function"""
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def as_future(self):
+        """A future that completes on cancellation, to pass to concurrent.futures.wait"""
+        with self._lock:
+            if self._future is None:
+                self._future = Future()
+                if not self.cancelled:
+                    self._callbacks.append(lambda: self._future.set_result(self.reason))
+                    return self._future
+                self._future.set_result(self.reason)
+            return self._future
+
+
+_current = contextvars.ContextVar("papuy_cancellation_token", default=None)
+
+
+def current_token():
+    return _current.get()
+
+
+@contextmanager
+def use_token(token):
+    """Make ``token`` the current request's token for this thread (and context-copying pools)"""
+    reset = _current.set(token)
+    try:
+        yield token
+    finally:
+        _current.reset(reset)
+
+
+def check_cancelled():
+    token = current_token()
+    if token is not None:
+        token.check()
+
+
+_executor = None
+_request_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=get_int_setting("PAPUY_CANCELLABLE_WORKERS", 32), thread_name_prefix="papuy-call"
+            )
+        return _executor
+
+
+def _get_request_executor():
+    global _request_executor
+    with _executor_lock:
+        if _request_executor is None:
+            _request_executor = ThreadPoolExecutor(
+                max_workers=get_int_setting("PAPUY_REQUEST_WORKERS", 16), thread_name_prefix="papuy-request"
+            )
+        return _request_executor
+
+
+def submit_request(func, *args, **kwargs):
+    """Run a whole request off the caller's thread under a new token; returns (token, future)
+
+    Streamlit only handles reruns between ``st.*`` calls on the script thread,
+    so the script polls the future and a new run can cancel the token.
+    ``func`` is called with ``token=`` added to its arguments.
+    """
+    token = CancellationToken()
+    return token, _get_request_executor().submit(func, *args, token=token, **kwargs)
+
+
+def result_or_cancel(future, timeout=None):
+    """``future.result(timeout)`` that gives up as soon as the current token is cancelled"""
+    token = current_token()
+    if token is None:
+        return future.result(timeout)
+    cancelled = token.as_future()
+    wait([future, cancelled], timeout=timeout, return_when=FIRST_COMPLETED)
+    if not future.done() and cancelled.done():
+        future.cancel()
+        token.check()
+    return future.result(0)
+
+
+def run_cancellable(func, *args, **kwargs):
+    """Run a blocking call so the caller returns as soon as the current token is cancelled
+
+    Without a current token the call runs inline. The call keeps the token in
+    its context, so an abandoned call stops at its next check: before each
+    model request (``credentials.PooledTransport``) and between body chunks
+    (``read_content``, ``pdf_extractor.save_pdf``).
+    """
+    token = current_token()
+    if token is None:
+        return func(*args, **kwargs)
+    token.check()
+    context = contextvars.copy_context()
+    return result_or_cancel(_get_executor().submit(context.run, func, *args, **kwargs))
+
+
+def read_content(response, chunk_size=64 * 1024):
+    """Body bytes of a ``stream=True`` requests response, abandoned between chunks once the token is cancelled"""
+    try:
+        chunks = []
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            check_cancelled()
+            chunks.append(chunk)
+        return b"".join(chunks)
+    finally:
+        response.close()
@@ -1,4 +1,7 @@
+import functools
 import os
+import sys
+import threading
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import StrOutputParser
@@ -8,15 +11,46 @@ import requests
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 import time
-import xml.etree.ElementTree as ET
 import re
 from urllib.parse import urlparse
 from openai import OpenAI
-import streamlit as st
+from conversation_store import get_conversation_store
+from credentials import get_credential_pool
+from settings import get_setting, get_int_setting, get_float_setting, parse_mapping
+from shared_state import cache_key, cached, set_json
+from section_segmenter import SegmentedArticle, segment_html, segment_text
+from summarizer import ChunkedSummarizer
+from reranker import rank_papers, parse_year
+from query_cache import QueryCache, QueryPopularity, ResponseCache, fold_inflection, normalize_query, source_version
+from paper_index import PaperIndex
+from prefetch import get_prefetcher
+from corpus import get_corpus_store
+from providers import get_search_engine
+from pubmed_parser import parse_efetch
+from pdf_extractor import get_pdf_extractor, is_pdf_response, save_pdf
+from prompt_compactor import PromptCompactor
+from cancellation import CancellationToken, Cancelled, use_token, check_cancelled, read_content, run_cancellable
+from metrics import get_metrics
+from intent_router import (
+    SEARCH, DOWNLOAD, SUMMARIZE, MEDICAL, CASUAL, RouteUsageCallback, get_intent_classifier,
+    load_model_prices, load_model_tiers, load_route_tiers, use_route
+)
 load_dotenv()
 
+CASUAL_SYSTEM_MESSAGE = """Eres Papuy, el asistente de Emily. Este mensaje es una conversación casual, no una consulta médica.
+- Responde en español, de forma breve, cálida y natural; llama a la usuaria "Emily"
+- Puedes usar emojis y un lenguaje relajado
+- No incluyas citas ni referencias
+- Si surge una pregunta médica, sugiere amablemente que la formule para responderla con fuentes"""
+
 class PapuyChatbot:
-    def __init__(self):
+    # Process-wide services; memory reports do not charge them to the session
+    SHARED_ATTRIBUTES = (
+        "store", "metrics", "classifier", "search_engine", "prefetcher", "corpus",
+        "pdf_extractor", "query_cache", "response_cache", "popularity"
+    )
+
+    def __init__(self, store=None, conversation_id=None, owner=None, search_engine=None, http_client=None):
         self.messages = [
             {
                 "role": "system",
@@ -43,11 +77,37 @@ class PapuyChatbot:
                 - Prioriza la seguridad y el bienestar de Emily"""
             }
         ]
-        self.openai = ChatOpenAI(
-            model="gpt-4",
-            temperature=0.7,
-            api_key=st.secrets["OPENAI_API_KEY"]
-        )
+        
+        # Conversation history lives in the store; only a small window stays in memory
+        self.store = store or get_conversation_store()
+        self.conversation_id = conversation_id or self.store.create_conversation(owner)
+        self.history_window = get_int_setting("PAPUY_HISTORY_WINDOW", 20)
+        self.persona_message = self.messages[0]
+        self.messages.extend(self._load_context_window())
+        # Held for a whole turn by callers that answer on worker threads: a cancelled answer may
+        # still be unwinding when the next one starts, and the history and paper index are not thread-safe
+        self.turn_lock = threading.Lock()
+        # Model tiers: each route uses the tier set in PAPUY_ROUTE_TIERS (research by default)
+        self.metrics = get_metrics()
+        self.classifier = get_intent_classifier()
+        self.route_tiers = load_route_tiers()
+        prices = load_model_prices()
+        # Every request takes its key from the shared pool, so throughput grows with OPENAI_API_KEYS
+        credentials = get_credential_pool("openai")
+        self.models = {
+            tier: ChatOpenAI(
+                model=model,
+                temperature=0.7,
+                api_key=next(iter(credentials.keys), None),
+                base_url=get_setting("OPENAI_BASE_URL"),
+                http_client=http_client or credentials.http_client(),
+                # Bounds how long an abandoned call can hold a worker after its request is cancelled
+                timeout=get_float_setting("PAPUY_LLM_TIMEOUT", 120),
+                callbacks=[RouteUsageCallback(model, self.metrics, prices)]
+            )
+            for tier, model in load_model_tiers().items()
+        }
+        self.openai = self.models["research"]
         
         # Update system message to include APA citation requirements
         self.system_message = """Eres Papuy, un asistente de investigación médica muy útil. Ayudas a estudiantes de medicina a encontrar y entender artículos médicos. 
@@ -69,292 +129,327 @@ class PapuyChatbot:
            - Conclusiones
            - Limitaciones (si las hay)
         """
+        # Long displayed responses, bilingual copies and page boilerplate are trimmed before LLM calls
+        self.compactor = PromptCompactor(
+            enabled=get_setting("PAPUY_PROMPT_COMPACTION", "1") != "0",
+            title_tokens=get_int_setting("PAPUY_COMPACT_TITLE_TOKENS", 60),
+            abstract_tokens=get_int_setting("PAPUY_COMPACT_ABSTRACT_TOKENS", 300),
+            section_tokens=get_int_setting("PAPUY_COMPACT_SECTION_TOKENS", 1500),
+            history_tokens=get_int_setting("PAPUY_COMPACT_HISTORY_TOKENS", 1500),
+            metrics=self.metrics
+        )
         self.prompt = ChatPromptTemplate.from_messages([
             ("system", self.system_message),
             MessagesPlaceholder(variable_name="chat_history"),
             ("human", "{input}")
         ])
-        self.chain = (
+        history = lambda x: self.compactor.compact_history(self.messages)
+        self.chain = self._build_chain(self.prompt, self.openai, history)
+        self.medical_chain = self._build_chain(self.prompt, self.model_for(MEDICAL), history)
+        # Translations are cached by text alone, so the conversation is never sent with them
+        self.translation_chain = self._build_chain(self.prompt, self.openai, lambda x: [])
+        
+        # Casual chat gets a light prompt, a short history and the fast tier
+        self.casual_history = get_int_setting("PAPUY_CASUAL_HISTORY", 6)
+        self.casual_prompt = ChatPromptTemplate.from_messages([
+            ("system", CASUAL_SYSTEM_MESSAGE),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("human", "{input}")
+        ])
+        self.casual_chain = self._build_chain(
+            self.casual_prompt, self.model_for(CASUAL), lambda x: self.compactor.compact_history(self.messages[1:][-self.casual_history:])
+        )
+        self.search_engine = search_engine or get_search_engine()
+        self.search_first_k = get_int_setting("PAPUY_SEARCH_FIRST_K", 0) or None
+        # HTTP/LLM caches live in the shared state backend so every replica reuses them
+        self.llm_cache_ttl = get_int_setting("PAPUY_LLM_CACHE_TTL", 7 * 86400)
+        self.http_cache_ttl = get_int_setting("PAPUY_HTTP_CACHE_TTL", 86400)
+        self.justify_top_n = get_int_setting("PAPUY_JUSTIFY_TOP_N", 3)
+        self.prefetcher = get_prefetcher()
+        self.corpus = get_corpus_store()
+        self.prefetch_top_n = get_int_setting("PAPUY_PREFETCH_TOP_N", 3)
+        self.paper_index = PaperIndex(max_papers=get_int_setting("PAPUY_PAPER_INDEX_SIZE", 500))
+        versions = pipeline_versions()
+        self.query_cache = QueryCache(
+            threshold=get_float_setting("PAPUY_QUERY_CACHE_THRESHOLD", 0.8),
+            ttl=get_int_setting("PAPUY_QUERY_CACHE_TTL", 86400),
+            max_entries=get_int_setting("PAPUY_QUERY_CACHE_SIZE", 1000),
+            version=versions[SEARCH]
+        )
+        # Found download links replay their whole rendered response (TTL in seconds per command)
+        ttls = parse_mapping(get_setting("PAPUY_RESPONSE_TTLS", "download=86400"))
+        self.response_cache = ResponseCache(
+            versions, {command: int(ttl) for command, ttl in ttls.items() if ttl.isdigit()}, metrics=self.metrics
+        )
+        self.popularity = QueryPopularity(days=get_int_setting("PAPUY_POPULARITY_DAYS", 7))
+        self.pdf_extractor = get_pdf_extractor()
+        self.pdf_max_bytes = get_int_setting("PAPUY_PDF_MAX_MB", 25) * 1024 * 1024
+        self.summarizer = ChunkedSummarizer(
+            self.openai,
+            max_chunk_tokens=get_int_setting("PAPUY_SUMMARY_CHUNK_TOKENS", 3000),
+            max_concurrency=get_int_setting("PAPUY_SUMMARY_CONCURRENCY", 4)
+        )
+        
+    def _build_chain(self, prompt, model, chat_history):
+        return (
             {
                 "input": RunnablePassthrough(),
-                "chat_history": lambda x: self.messages
+                "chat_history": chat_history
             }
-            | self.prompt
-            | self.openai
+            | prompt
+            | model
             | StrOutputParser()
         )
-        self.pubmed_api_key = st.secrets["PUBMED_API_KEY"]
-        self.serp_api_key = st.secrets["SERP_API_KEY"]
-        self.base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
-        self.serp_url = "https://serpapi.com/search.json"
-        
+    
+    def model_for(self, route):
+        return self.models.get(self.route_tiers.get(route, "research"), self.openai)
+    
+    def _load_context_window(self):
+        history = self.store.load(self.conversation_id, limit=self.history_window, context_only=True)
+        return [
+            HumanMessage(content=message["content"]) if message["role"] == "user" else AIMessage(content=message["content"])
+            for message in history
+        ]
+    
+    def record_turn(self, user_input, response, display=True, context=True, context_response=None):
+        """Persist a conversation turn and keep only the recent window in memory
+
+        With ``context_response`` the LLM's history gets that compact stand-in
+        instead of the (displayed) full response; long responses get a
+        truncated one, computed once here rather than on every chain call.
+        """
+        if context and context_response is None:
+            context_response = self.compactor.compact_turn(response)
+        self.store.append(self.conversation_id, "user", user_input, display, context)
+        if context and context_response is not None:
+            self.store.append(self.conversation_id, "assistant", response, display, False)
+            self.store.append(self.conversation_id, "assistant", context_response, False, True)
+        else:
+            self.store.append(self.conversation_id, "assistant", response, display, context)
+        if context:
+            self.messages.append(HumanMessage(content=user_input))
+            self.messages.append(AIMessage(content=context_response or response))
+            head = self.messages[:1] if self.messages and isinstance(self.messages[0], dict) else []
+            self.messages = head + self.messages[len(head):][-self.history_window:]
+    
+    def load_history(self, limit, before=None):
+        """Load displayable messages, oldest first, older than the ``before`` seq"""
+        return self.store.load(self.conversation_id, limit=limit, before=before, display_only=True)
+    
+    def start_new_conversation(self, owner=None):
+        self.conversation_id = self.store.create_conversation(owner)
+        self.messages = [self.persona_message]
+    
     def translate_text(self, text):
         try:
             prompt = f"Traduce el siguiente texto al español, manteniendo el formato y la estructura:\n\n{text}"
-            response = self.chain.invoke(prompt)
-            return response
+            return cached("translation", [prompt], lambda: run_cancellable(self.translation_chain.invoke, prompt), ttl=self.llm_cache_ttl)
         except Exception as e:
             return f"Error en la traducción: {str(e)}"
         
+    def _translate_papers(self, papers, language):
+        for paper in papers:
+            paper['title_es'] = self.translate_text(paper['title']) if language == "en" else paper['title']
+            paper['abstract_es'] = self.translate_text(paper['abstract']) if language == "en" else paper['abstract']
+        return papers
+    
     def search_google_scholar(self, query, language="en"):
         try:
-            params = {
-                "engine": "google_scholar",
-                "q": query,
-                "api_key": self.serp_api_key,
-                "num": 3,
-                "hl": language  # Set language parameter
-            }
-            
-            response = requests.get(self.serp_url, params=params)
-            data = response.json()
-            
-            if "error" in data:
-                return f"Error en la búsqueda de Google Scholar: {data['error']}"
-            
-            papers = []
-            for result in data.get("organic_results", []):
-                paper = {
-                    'title': result.get('title', 'Sin título'),
-                    'title_es': self.translate_text(result.get('title', 'Sin título')) if language == "en" else result.get('title', 'Sin título'),
-                    'authors': [author.get('name', '') for author in result.get('publication_info', {}).get('authors', [])],
-                    'year': result.get('publication_info', {}).get('summary', '').split('-')[-1].strip() if result.get('publication_info', {}).get('summary') else 'Sin año',
-                    'url': result.get('link', 'URL no disponible'),
-                    'abstract': result.get('snippet', 'Resumen no disponible'),
-                    'abstract_es': self.translate_text(result.get('snippet', 'Resumen no disponible')) if language == "en" else result.get('snippet', 'Resumen no disponible'),
-                    'source': 'Google Scholar',
-                    'cited_by': result.get('inline_links', {}).get('cited_by', {}).get('total', 0),
-                    'pdf_link': next((resource.get('link') for resource in result.get('resources', []) 
-                                   if resource.get('file_format') == 'PDF'), None)
-                }
-                papers.append(paper)
-            
-            return papers
+            papers = run_cancellable(self.search_engine.providers["scholar"].search, query, 3, language)
+            return self._translate_papers(papers, language)
+        except KeyError:
+            return "Error al buscar en Google Scholar: proveedor no habilitado"
         except Exception as e:
             return f"Error al buscar en Google Scholar: {str(e)}"
     
     def search_pubmed(self, query, language="en"):
         try:
-            # First, search for articles
-            search_url = f"{self.base_url}/esearch.fcgi"
-            params = {
-                "db": "pubmed",
-                "term": query,
-                "retmode": "json",
-                "retmax": "3"
-            }
-            if self.pubmed_api_key:
-                params["api_key"] = self.pubmed_api_key
-                
-            response = requests.get(search_url, params=params)
-            search_data = response.json()
-            
-            if "esearchresult" not in search_data or "idlist" not in search_data["esearchresult"]:
-                return []
-            
-            # Get article details
-            ids = ",".join(search_data["esearchresult"]["idlist"])
-            fetch_url = f"{self.base_url}/efetch.fcgi"
-            params = {
-                "db": "pubmed",
-                "id": ids,
-                "retmode": "xml"
-            }
-            if self.pubmed_api_key:
-                params["api_key"] = self.pubmed_api_key
-                
-            response = requests.get(fetch_url, params=params)
-            root = ET.fromstring(response.content)
-            
-            papers = []
-            for article in root.findall(".//PubmedArticle"):
-                title = article.find(".//ArticleTitle")
-                authors = article.findall(".//Author")
-                year = article.find(".//PubDate/Year")
-                abstract = article.find(".//Abstract/AbstractText")
-                
-                title_text = title.text if title is not None else 'Sin título'
-                abstract_text = abstract.text if abstract is not None else 'Resumen no disponible'
-                
-                paper = {
-                    'title': title_text,
-                    'title_es': self.translate_text(title_text) if language == "en" else title_text,
-                    'authors': [f"{author.find('LastName').text}, {author.find('ForeName').text}" 
-                              for author in authors if author.find('LastName') is not None and author.find('ForeName') is not None],
-                    'year': year.text if year is not None else 'Sin año',
-                    'url': f"https://pubmed.ncbi.nlm.nih.gov/{article.find('.//PMID').text}/",
-                    'abstract': abstract_text,
-                    'abstract_es': self.translate_text(abstract_text) if language == "en" else abstract_text,
-                    'source': 'PubMed'
-                }
-                papers.append(paper)
-            
-            return papers
+            # The local mirror, when enabled, answers without a round trip to NCBI
+            provider = self.search_engine.providers.get("pubmed_local") or self.search_engine.providers["pubmed"]
+            return self._translate_papers(run_cancellable(provider.search, query, 3, language), language)
+        except KeyError:
+            return "Error al buscar en PubMed: proveedor no habilitado"
         except Exception as e:
             return f"Error al buscar en PubMed: {str(e)}"
     
     def search_papers(self, query, language="en"):
         try:
-            # Search both Google Scholar and PubMed
-            scholar_papers = self.search_google_scholar(query, language)
-            if isinstance(scholar_papers, str):  # Error occurred
-                scholar_papers = []
-            
-            pubmed_papers = self.search_pubmed(query, language)
-            if isinstance(pubmed_papers, str):  # Error occurred
-                pubmed_papers = []
-            
-            return scholar_papers + pubmed_papers
+            # All enabled providers run in parallel; slow ones get a hedged backup request
+            papers, errors = self.search_engine.search(query, language, limit=3, first_k=self.search_first_k)
+            if not papers and errors:
+                return "Error al buscar artículos: " + "; ".join(f"{name}: {error}" for name, error in errors.items())
+            return self._translate_papers(papers, language)
         except Exception as e:
             return f"Error al buscar artículos: {str(e)}"
     
     def get_download_link(self, paper_url):
         try:
+            # Papers from this session's searches are indexed by URL, DOI and PMID
+            paper = self.paper_index.lookup(paper_url)
+            if paper and paper.get('pdf_link'):
+                return paper['pdf_link']
+            
             if "pubmed.ncbi.nlm.nih.gov" in paper_url:
                 return "Para descargar el artículo completo de PubMed, por favor visita el enlace y busca el botón 'Full Text Links' o 'PDF' en la página del artículo."
             
-            # Check if we already have a PDF link from SerpAPI
-            for paper in self.messages[-2].content.split('\n\n'):
-                if paper_url in paper and 'PDF' in paper:
-                    return paper.split('PDF: ')[-1].strip()
-            
-            response = requests.get(paper_url)
-            soup = BeautifulSoup(response.text, 'html.parser')
-            pdf_link = soup.find('a', {'class': 'pdf-link'})
+            pdf_link = self._scrape_pdf_link(paper_url)
             if pdf_link:
-                return pdf_link['href']
+                # Remember the scraped link so the next request is a lookup
+                if paper:
+                    paper['pdf_link'] = pdf_link
+                else:
+                    self.paper_index.add({'url': paper_url, 'pdf_link': pdf_link})
+                return pdf_link
             return "No se encontró un enlace de descarga directo. Por favor, visita el sitio web del artículo."
         except Exception as e:
             return f"Error al obtener el enlace de descarga: {str(e)}"
     
-    def analyze_papers(self, papers):
+    def _scrape_pdf_link(self, paper_url):
+        def scrape():
+            response = run_cancellable(requests.get, paper_url, timeout=10, stream=True)
+            soup = BeautifulSoup(run_cancellable(read_content, response), 'html.parser')
+            pdf_link = soup.find('a', {'class': 'pdf-link'})
+            return {"pdf_link": pdf_link['href'] if pdf_link else None}
+        return cached("pdflink", [paper_url], scrape, ttl=self.http_cache_ttl)["pdf_link"]
+    
+    def prefetch_tasks(self, papers):
+        """(key, task) pairs fetching the PDFs behind the top papers, the one thing a follow-up needs that the search did not
+
+        Building the response already fetched each page (or its known PDF) and
+        recorded the page's PDF link, so resolving the link is a cache read.
+        """
+        for paper in papers[:self.prefetch_top_n]:
+            url = paper.get('url')
+            if not url or not url.startswith("http") or paper.get('pdf_link') or "pubmed.ncbi.nlm.nih.gov" in url:
+                continue
+            def fetch_pdf(paper=paper, url=url):
+                pdf_link = self._scrape_pdf_link(url)
+                if pdf_link:
+                    paper['pdf_link'] = pdf_link
+                    self.fetch_article(pdf_link)
+            yield ("pdf", url), fetch_pdf
+    
+    def prefetch_papers(self, papers):
+        for key, task in self.prefetch_tasks(papers):
+            self.prefetcher.submit(key, task)
+    
+    def analyze_papers(self, papers, query="", ranking=None):
         try:
-            analysis_prompt = "Analiza los siguientes artículos y recomienda el mejor basado en su contenido y relevancia:\n\n"
-            for i, paper in enumerate(papers, 1):
-                analysis_prompt += f"Artículo {i}:\n"
-                analysis_prompt += f"Título (Original): {paper['title']}\n"
-                analysis_prompt += f"Título (Español): {paper['title_es']}\n"
-                analysis_prompt += f"Autores: {', '.join(paper['authors'])}\n"
-                analysis_prompt += f"Año: {paper['year']}\n"
-                analysis_prompt += f"Fuente: {paper.get('source', 'Desconocida')}\n"
+            # Ranking is local and deterministic; the LLM only justifies the top papers
+            if ranking is None:
+                ranking = rank_papers(query, papers)
+            if not ranking:
+                return "No se encontraron artículos para analizar."
+            
+            analysis = "| # | Título | Puntuación | Relevancia | Actualidad | Citaciones |\n"
+            analysis += "|---|--------|------------|------------|------------|------------|\n"
+            for i, ranked in enumerate(ranking, 1):
+                paper = ranked.paper
+                analysis += f"| {i} | [{paper['title']}]({paper['url']}) | {ranked.score:.2f} | {ranked.relevance:.2f} | {ranked.recency:.2f} | {ranked.citations:.2f} |\n"
+            
+            top = ranking[:self.justify_top_n]
+            justification_prompt = f"Estos son los artículos mejor clasificados para la búsqueda \"{query}\". Explica brevemente (2-3 frases por artículo) por qué cada uno es relevante y recomienda el primero:\n\n"
+            for i, ranked in enumerate(top, 1):
+                paper = ranked.paper
+                title, abstract = self.compactor.paper_fields(paper)
+                justification_prompt += f"Artículo {i}: {title} ({paper['year']})\n"
                 if paper.get('cited_by'):
-                    analysis_prompt += f"Citado por: {paper['cited_by']} veces\n"
-                analysis_prompt += f"Resumen (Original): {paper['abstract']}\n"
-                analysis_prompt += f"Resumen (Español): {paper['abstract_es']}\n\n"
+                    justification_prompt += f"Citado por: {paper['cited_by']} veces\n"
+                justification_prompt += f"Resumen: {abstract}\n\n"
             
-            analysis_prompt += "\nPor favor, proporciona un análisis detallado y recomienda el mejor artículo, explicando por qué es el más relevante."
-            
-            response = self.chain.invoke(analysis_prompt)
-            return response
+            response = run_cancellable(self.chain.invoke, justification_prompt)
+            return analysis + "\n" + response
         except Exception as e:
             return f"Error al analizar los artículos: {str(e)}"
     
     def fetch_full_text(self, url):
+        article = self.fetch_article(url)
+        if isinstance(article, str):  # Error occurred
+            return article
+        return article.text
+    
+    def fetch_article(self, url):
+        """Fetch a page or PDF and segment it by its headings (cached as text plus section offsets)"""
+        article = cached("article", [url], lambda: self._download_article(url), ttl=self.http_cache_ttl)
+        if isinstance(article, str):  # Error occurred
+            return article
+        return SegmentedArticle.from_dict(article)
+    
+    def _download_article(self, url):
         try:
             # Add headers to mimic a browser request
             headers = {
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
             }
             
-            response = requests.get(url, headers=headers, timeout=10)
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Remove script and style elements
-            for script in soup(["script", "style"]):
-                script.decompose()
-            
-            # Get text content
-            text = soup.get_text()
-            
-            # Clean up text
-            lines = (line.strip() for line in text.splitlines())
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            text = ' '.join(chunk for chunk in chunks if chunk)
+            response = run_cancellable(requests.get, url, headers=headers, timeout=10, stream=True)
+            # PDFs (pdf_link or pages served as PDF) go to the process-pool extractor
+            if is_pdf_response(response) or urlparse(url).path.lower().endswith(".pdf"):
+                return segment_text(self._extract_pdf_text(response)).to_dict()
+            soup = BeautifulSoup(run_cancellable(read_content, response), 'html.parser')
+            # Record the page's PDF link now, so downloads and prefetch need no second fetch of the page
+            pdf_link = soup.find('a', {'class': 'pdf-link'})
+            try:
+                set_json(cache_key("pdflink", url), {"pdf_link": pdf_link['href'] if pdf_link else None}, self.http_cache_ttl)
+            except Exception:
+                pass
             
             # Extract main content based on common article containers
-            main_content = None
+            root = None
             for container in ['article', 'main', 'div[class*="content"]', 'div[class*="article"]']:
-                content = soup.select_one(container)
-                if content:
-                    main_content = content.get_text()
+                root = soup.select_one(container)
+                if root:
                     break
             
-            if main_content:
-                return main_content
-            return text
+            return segment_html(root or soup.body or soup).to_dict()
             
         except Exception as e:
             return f"Error al obtener el texto completo: {str(e)}"
     
+    def _extract_pdf_text(self, response):
+        path, digest = save_pdf(response, self.pdf_max_bytes)
+        try:
+            # Keyed by content hash: the same PDF behind different URLs is parsed once
+            return cached("pdftext", [digest], lambda: self.pdf_extractor.extract(path), ttl=self.http_cache_ttl)
+        finally:
+            os.remove(path)
+    
     def extract_article_sections(self, text):
+        """Return a SegmentedArticle; fetched articles are already segmented from their HTML headings"""
         try:
-            # Common section headers in medical papers
-            sections = {
-                'introducción': [],
-                'métodos': [],
-                'resultados': [],
-                'discusión': [],
-                'conclusión': []
-            }
-            
-            # Split text into paragraphs
-            paragraphs = text.split('\n\n')
-            current_section = None
-            
-            for para in paragraphs:
-                para = para.strip()
-                if not para:
-                    continue
-                    
-                # Check if paragraph is a section header
-                lower_para = para.lower()
-                for section in sections.keys():
-                    if section in lower_para and len(para) < 100:  # Likely a header
-                        current_section = section
-                        break
-                
-                if current_section and current_section in sections:
-                    sections[current_section].append(para)
-            
-            return sections
+            if isinstance(text, SegmentedArticle):
+                return text
+            return segment_text(text)
         except Exception as e:
             return f"Error al extraer secciones: {str(e)}"
     
     def summarize_paper(self, paper_text, url=None):
         try:
             # If URL is provided, try to fetch full text
-            full_text = None
+            article = None
             if url:
-                full_text = self.fetch_full_text(url)
+                # Publisher pages often show only the abstract, so a known PDF is read first
+                paper = self.paper_index.lookup(url)
+                if paper and paper.get('pdf_link'):
+                    article = self.fetch_article(paper['pdf_link'])
+                if article is None or isinstance(article, str) or not article.text.strip():
+                    article = self.fetch_article(url)
             
             # Extract sections if we have full text
             sections = None
-            if full_text:
-                sections = self.extract_article_sections(full_text)
-            
-            # Create a comprehensive prompt for summarization
-            prompt = "Por favor, proporciona un resumen detallado de este artículo médico:\n\n"
+            if article and not isinstance(article, str) and article.text.strip():
+                sections = self.extract_article_sections(article)
             
-            if sections:
-                prompt += "Secciones del artículo:\n"
-                for section, content in sections.items():
-                    if content:
-                        prompt += f"\n{section.upper()}:\n"
-                        prompt += "\n".join(content[:3])  # Include first 3 paragraphs of each section
-                        if len(content) > 3:
-                            prompt += "\n..."
+            # Whole sections are chunked and summarized concurrently; without them, the abstract
+            if sections and not isinstance(sections, str):
+                response = self.summarizer.summarize(self.compactor.compact_article(sections))
             else:
-                prompt += paper_text
+                response = self.summarizer.summarize(
+                    self.compactor.compact_text(paper_text, self.compactor.section_tokens, "summary")
+                )
             
-            prompt += "\n\nPor favor, proporciona:\n"
-            prompt += "1. Un resumen general del artículo\n"
-            prompt += "2. Los puntos clave de cada sección\n"
-            prompt += "3. Las conclusiones principales\n"
-            prompt += "4. La relevancia clínica del estudio"
-            
-            response = self.chain.invoke(prompt)
-            self.messages.append(HumanMessage(content=prompt))
-            self.messages.append(AIMessage(content=response))
+            prompt = f"Por favor, proporciona un resumen detallado de este artículo médico: {url or paper_text[:200]}"
+            self.record_turn(prompt, response, display=False)
             return response
         except Exception as e:
             return f"Error al resumir el artículo: {str(e)}"
@@ -376,10 +471,10 @@ class PapuyChatbot:
         
         # Add articles with inline citations
         for i, article in enumerate(articles, 1):
-            authors = article.get('authors', ['Sin autor'])
+            authors = article.get('authors') or ['Sin autor']
             year = article.get('year', 'n.d.')
             title = article.get('title', '')
-            journal = article.get('journal', '')
+            journal = article.get('journal') or article.get('source', '')
             url = article.get('url', '')
             
             # Create citation key (first author's lastname et al., year)
@@ -412,7 +507,7 @@ class PapuyChatbot:
                 quality_factors.append("✅ **Alto impacto académico** - Citado frecuentemente en la literatura")
             if article.get('source') == 'PubMed':
                 quality_factors.append("✅ **Indexado en PubMed** - Revisado por pares")
-            if int(article.get('year', 0)) > 2020:
+            if (parse_year(article.get('year')) or 0) > 2020:
                 quality_factors.append("✅ **Investigación reciente** - Datos actualizados")
             if not quality_factors:
                 quality_factors.append("⚠️ **Requiere evaluación adicional** - Revisar metodología")
@@ -423,14 +518,14 @@ class PapuyChatbot:
         # Add References section
         response += "## 📚 Referencias\n\n"
         for article in articles:
-            authors = article.get('authors', ['Sin autor'])
+            authors = article.get('authors') or ['Sin autor']
             year = article.get('year', 'n.d.')
             title = article.get('title', '')
-            journal = article.get('journal', '')
-            volume = article.get('volume', '')
-            issue = article.get('issue', '')
-            pages = article.get('pages', '')
-            doi = article.get('doi', '')
+            journal = article.get('journal') or ''
+            volume = article.get('volume') or ''
+            issue = article.get('issue') or ''
+            pages = article.get('pages') or ''
+            doi = article.get('doi') or ''
             url = article.get('url', '')
             
             # Format authors
@@ -441,7 +536,8 @@ class PapuyChatbot:
             
             # Create APA reference
             reference = f"- {authors_str} ({year}). **{title}**. "
-            reference += f"_{journal}_"
+            if journal:
+                reference += f"_{journal}_"
             if volume:
                 reference += f", *{volume}*"
                 if issue:
@@ -474,7 +570,7 @@ class PapuyChatbot:
         response += f"- **Título:** {metadata.get('title', 'No disponible')}\n"
         response += f"- **Autores:** {', '.join(metadata.get('authors', ['No disponible']))}\n"
         response += f"- **Año:** {metadata.get('year', 'No disponible')}\n"
-        response += f"- **Revista:** {metadata.get('journal', 'No disponible')}\n\n"
+        response += f"- **Revista:** {metadata.get('journal') or 'No disponible'}\n\n"
         
         # Add analysis sections
         response += "## 📊 Análisis Detallado\n\n"
@@ -494,11 +590,11 @@ class PapuyChatbot:
         # Add reference
         response += "## 📚 Referencias\n\n"
         title = metadata.get('title', 'Sin título')
-        journal = metadata.get('journal', '')
-        volume = metadata.get('volume', '')
-        issue = metadata.get('issue', '')
-        pages = metadata.get('pages', '')
-        doi = metadata.get('doi', '')
+        journal = metadata.get('journal') or ''
+        volume = metadata.get('volume') or ''
+        issue = metadata.get('issue') or ''
+        pages = metadata.get('pages') or ''
+        doi = metadata.get('doi') or ''
         url = metadata.get('url', '')
         
         # Format authors for reference
@@ -509,7 +605,8 @@ class PapuyChatbot:
         
         # Create APA reference
         reference = f"- {authors_str} ({year}). **{title}**. "
-        reference += f"_{journal}_"
+        if journal:
+            reference += f"_{journal}_"
         if volume:
             reference += f", *{volume}*"
             if issue:
@@ -525,109 +622,209 @@ class PapuyChatbot:
         
         return response
 
-    def get_response(self, user_input):
-        # Check if the input is a paper search request
-        if "buscar artículos sobre" in user_input.lower():
-            query = user_input.replace("buscar artículos sobre", "").strip()
-            
-            # Check if the user wants English results
-            language = "en" if "en inglés" in user_input.lower() else "es"
-            papers = self.search_papers(query, language)
-            
-            if isinstance(papers, str):  # Error occurred
-                return papers
-            
-            response = self.format_article_response(papers)
-            
-            # Add a summary table at the top
-            response += "### Resumen de Resultados\n"
-            response += "| Título | Año | Citaciones | Relevancia |\n"
-            response += "|--------|-----|------------|------------|\n"
-            for paper in papers:
-                citations = paper.get('cited_by', 0)
-                relevance = "Alta" if citations > 50 else "Media" if citations > 10 else "Por evaluar"
-                response += f"| [{paper['title']}]({paper['url']}) | {paper['year']} | {citations} | {relevance} |\n"
-            
-            response += "\n### Análisis Detallado de los Artículos\n\n"
+    def build_search_response(self, query, language):
+        """Run the full search pipeline; returns (papers, response) or an error string"""
+        papers = self.search_papers(query, language)
+        
+        if isinstance(papers, str):  # Error occurred
+            return papers
+        
+        check_cancelled()
+        # Rank locally so the most relevant papers are listed (and summarized) first
+        ranking = rank_papers(query, papers)
+        papers = [ranked.paper for ranked in ranking]
+        self.paper_index.add_all(papers)
+        
+        response = self.format_article_response(papers)
+        
+        # Add a summary table at the top
+        response += "### Resumen de Resultados\n"
+        response += "| Título | Año | Citaciones | Relevancia |\n"
+        response += "|--------|-----|------------|------------|\n"
+        for paper in papers:
+            citations = paper.get('cited_by', 0)
+            relevance = "Alta" if citations > 50 else "Media" if citations > 10 else "Por evaluar"
+            response += f"| [{paper['title']}]({paper['url']}) | {paper['year']} | {citations} | {relevance} |\n"
+        
+        response += "\n### Análisis Detallado de los Artículos\n\n"
+        
+        for i, paper in enumerate(papers, 1):
+            check_cancelled()
+            response += f"#### {i}. {paper['title']}\n"
+            if paper['title'] != paper['title_es']:
+                response += f"**Traducción:** {paper['title_es']}\n"
+            response += f"**Autores:** {', '.join(paper['authors'])}\n"
+            response += f"**Año:** {paper['year']}\n"
+            response += f"**Fuente:** {paper.get('source', 'Desconocida')}\n"
+            if paper.get('cited_by'):
+                response += f"**Citado por:** {paper['cited_by']} veces\n"
+            response += f"**URL:** [{paper['url']}]({paper['url']})\n"
+            if paper.get('pdf_link'):
+                response += f"**PDF:** [Descargar PDF]({paper['pdf_link']})\n"
+            
+            response += "\n**Resumen Original:**\n"
+            response += f"{paper['abstract']}\n\n"
+            if paper['abstract'] != paper['abstract_es']:
+                response += "**Resumen en Español:**\n"
+                response += f"{paper['abstract_es']}\n\n"
+            
+            # Add detailed summary
+            response += "**Análisis Detallado:**\n"
+            if paper.get('url'):
+                summary = self.summarize_paper(paper['abstract'], paper['url'])
+                paper['summary'] = summary
+                response += f"{summary}\n\n"
             
-            for i, paper in enumerate(papers, 1):
-                response += f"#### {i}. {paper['title']}\n"
-                if paper['title'] != paper['title_es']:
-                    response += f"**Traducción:** {paper['title_es']}\n"
-                response += f"**Autores:** {', '.join(paper['authors'])}\n"
-                response += f"**Año:** {paper['year']}\n"
-                response += f"**Fuente:** {paper.get('source', 'Desconocida')}\n"
-                if paper.get('cited_by'):
-                    response += f"**Citado por:** {paper['cited_by']} veces\n"
-                response += f"**URL:** [{paper['url']}]({paper['url']})\n"
-                if paper.get('pdf_link'):
-                    response += f"**PDF:** [Descargar PDF]({paper['pdf_link']})\n"
-                
-                response += "\n**Resumen Original:**\n"
-                response += f"{paper['abstract']}\n\n"
-                if paper['abstract'] != paper['abstract_es']:
-                    response += "**Resumen en Español:**\n"
-                    response += f"{paper['abstract_es']}\n\n"
-                
-                # Add detailed summary
-                response += "**Análisis Detallado:**\n"
-                if paper.get('url'):
-                    summary = self.summarize_paper(paper['abstract'], paper['url'])
-                    response += f"{summary}\n\n"
-                
-                # Add quality assessment
-                response += "**Evaluación de Calidad:**\n"
-                quality_factors = []
-                if paper.get('cited_by', 0) > 50:
-                    quality_factors.append("✓ Alto impacto académico")
-                if paper.get('source') == 'PubMed':
-                    quality_factors.append("✓ Indexado en PubMed")
-                if int(paper.get('year', 0)) > 2020:
-                    quality_factors.append("✓ Investigación reciente")
-                if not quality_factors:
-                    quality_factors.append("⚠ Requiere evaluación adicional")
-                response += "\n".join(quality_factors) + "\n\n"
-                
-                response += "---\n\n"
+            # Add quality assessment
+            response += "**Evaluación de Calidad:**\n"
+            quality_factors = []
+            if paper.get('cited_by', 0) > 50:
+                quality_factors.append("✓ Alto impacto académico")
+            if paper.get('source') == 'PubMed':
+                quality_factors.append("✓ Indexado en PubMed")
+            if (parse_year(paper.get('year')) or 0) > 2020:
+                quality_factors.append("✓ Investigación reciente")
+            if not quality_factors:
+                quality_factors.append("⚠ Requiere evaluación adicional")
+            response += "\n".join(quality_factors) + "\n\n"
             
-            # Add final recommendations
-            response += "### Recomendaciones Finales\n"
-            analysis = self.analyze_papers(papers)
-            response += analysis + "\n\n"
+            response += "---\n\n"
+        
+        # Add final recommendations
+        response += "### Recomendaciones Finales\n"
+        analysis = self.analyze_papers(papers, query, ranking)
+        response += analysis + "\n\n"
+        
+        # Add references section
+        response += "### Referencias\n"
+        for i, paper in enumerate(papers, 1):
+            response += f"{i}. {', '.join(paper['authors'])} ({paper['year']}). [{paper['title']}]({paper['url']}). {paper.get('source', 'Fuente no especificada')}.\n"
+        
+        check_cancelled()
+        if papers:
+            self.query_cache.store(query, language, papers, response)
+            # Keep metadata, translations and summaries for analytics exports
+            self.corpus.record_papers(papers, query=query)
+        return papers, response
+    
+    def get_response(self, user_input, token=None):
+        """Answer a prompt; returns None if ``token`` is cancelled before the answer is ready"""
+        intent = self.classifier.classify(user_input)
+        started = time.monotonic()
+        # Background prefetching pauses while a user is waiting on a response
+        with self.prefetcher.foreground(), use_token(token or CancellationToken()), use_route(intent.name):
+            try:
+                response = self._respond(user_input, intent)
+            except Cancelled as e:
+                # Nothing is recorded: the user has moved on and will not see this answer
+                self.metrics.incr("requests_cancelled_total", reason=e.reason or "desconocido")
+                return None
+        self.metrics.incr("route_requests_total", route=intent.name)
+        self.metrics.observe("route_latency_seconds", time.monotonic() - started, route=intent.name)
+        return response
+    
+    def _respond(self, user_input, intent):
+        # Paper search request
+        if intent.name == SEARCH:
+            query = intent.argument
             
-            # Add references section
-            response += "### Referencias\n"
-            for i, paper in enumerate(papers, 1):
-                response += f"{i}. {', '.join(paper['authors'])} ({paper['year']}). [{paper['title']}]({paper['url']}). {paper.get('source', 'Fuente no especificada')}.\n"
+            # Check if the user wants English results
+            language = "en" if "en inglés" in user_input.lower() else "es"
+            self.popularity.record(query, language)
+            
+            # Near-duplicate searches reuse the results already assembled for an earlier phrasing
+            hit = self.query_cache.lookup(query, language)
+            if hit:
+                self.paper_index.add_all(hit.papers)
+                self.prefetch_papers(hit.papers)
+                response = hit.response
+                response += f"\n\n_⚡ Resultados reutilizados de la búsqueda \"{hit.query}\" (similitud {hit.score:.2f})._\n"
+                self.record_turn(
+                    user_input, response, context_response=self.compactor.compact_search_turn(query, hit.papers, response)
+                )
+                return response
             
-            self.messages.append(HumanMessage(content=user_input))
-            self.messages.append(AIMessage(content=response))
+            result = self.build_search_response(query, language)
+            if isinstance(result, str):  # Error occurred
+                self.record_turn(user_input, result, context=False)
+                return result
+            papers, response = result
+            self.record_turn(
+                user_input, response, context_response=self.compactor.compact_search_turn(query, papers, response)
+            )
+            self.prefetch_papers(papers)
             return response
         
-        # Check if the input is a request for a download link
-        elif "obtener enlace de descarga para" in user_input.lower():
-            url = user_input.replace("obtener enlace de descarga para", "").strip()
-            response = self.get_download_link(url)
-            self.messages.append(HumanMessage(content=user_input))
-            self.messages.append(AIMessage(content=response))
+        # Request for a download link
+        elif intent.name == DOWNLOAD:
+            url = intent.argument
+            # A link this session already knows beats any cached answer
+            paper = self.paper_index.lookup(url)
+            cached_response = None if paper and paper.get('pdf_link') else self.response_cache.get(DOWNLOAD, url)
+            if cached_response:
+                response = cached_response["response"]
+                self.paper_index.add({'url': url, 'pdf_link': response})
+            else:
+                response = self.get_download_link(url)
+                # Only found links are worth replaying; "not found" may change once a search indexes the paper
+                if response.startswith("http"):
+                    self.response_cache.store(DOWNLOAD, url, response)
+            self.record_turn(user_input, response)
             return response
         
-        # Check if the input is a request for paper summarization
-        elif "resumir este artículo" in user_input.lower():
-            paper_text = user_input.replace("resumir este artículo", "").strip()
-            response = self.format_summary_response(paper_text)
-            self.messages.append(HumanMessage(content=user_input))
-            self.messages.append(AIMessage(content=response))
+        # Request for paper summarization
+        elif intent.name == SUMMARIZE:
+            response = self.format_summary_response(intent.argument)
+            self.record_turn(user_input, response)
             return response
         
-        # General conversation
+        # Casual chat: no citations needed, so no research prompt or source request
+        elif intent.name == CASUAL:
+            try:
+                response = run_cancellable(self.casual_chain.invoke, user_input)
+                self.record_turn(user_input, response)
+                return response
+            except Exception as e:
+                response = f"Lo siento, pero encontré un error: {str(e)}"
+                self.record_turn(user_input, response, context=False)
+                return response
+        
+        # Medical question
         else:
             try:
                 # Modify the input to force citation of sources
                 enhanced_input = f"{user_input}\n\nPor favor, respalda tu respuesta con fuentes académicas relevantes y proporciona enlaces a los artículos citados."
-                response = self.chain.invoke(enhanced_input)
-                self.messages.append(HumanMessage(content=user_input))
-                self.messages.append(AIMessage(content=response))
+                response = run_cancellable(self.medical_chain.invoke, enhanced_input)
+                self.record_turn(user_input, response)
                 return response
             except Exception as e:
-                return f"Lo siento, pero encontré un error: {str(e)}" 
\ No newline at end of file
+                response = f"Lo siento, pero encontré un error: {str(e)}"
+                self.record_turn(user_input, response, context=False)
+                return response
+
+
+@functools.lru_cache(maxsize=1)
+def pipeline_versions():
+    """Version stamp per cached command, derived from the code and prompts that render its response
+
+    Editing any of them (or bumping PAPUY_PIPELINE_VERSION, e.g. after a model
+    change) changes the stamp, so stale cached responses are never replayed.
+    Computed once per process: code only changes with a restart.
+    """
+    search_modules = [
+        sys.modules[obj.__module__] for obj in (
+            ChunkedSummarizer, PromptCompactor, rank_papers, get_search_engine, parse_efetch, segment_html,
+            get_pdf_extractor
+        )
+    ]
+    manual = get_setting("PAPUY_PIPELINE_VERSION", "")
+    return {
+        SEARCH: source_version(
+            manual, ",".join(sorted(load_model_tiers().values())), PapuyChatbot.__init__,
+            PapuyChatbot.build_search_response, PapuyChatbot.format_article_response, PapuyChatbot.analyze_papers,
+            PapuyChatbot.summarize_paper, PapuyChatbot.translate_text, PapuyChatbot._translate_papers, normalize_query,
+            fold_inflection, PapuyChatbot.fetch_article, PapuyChatbot._download_article, PapuyChatbot._extract_pdf_text,
+            *search_modules
+        ),
+        DOWNLOAD: source_version(manual, PapuyChatbot.get_download_link, PapuyChatbot._scrape_pdf_link),
+    }
@@ -0,0 +1,243 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+from settings import get_setting
+from shared_state import InProcessBackend, RedisBackend
+
+
+class ConversationStore:
+    """Base interface for persistent conversation history
+
+    Messages are plain dicts with ``seq``, ``role`` ("user" / "assistant"),
+    ``content``, ``display`` (shown in the chat UI) and ``context`` (sent to
+    the LLM as chat history).
+    """
+
+    def create_conversation(self, owner=None):
+        raise NotImplementedError
+
+    def latest_conversation(self, owner=None):
+        raise NotImplementedError
+
+    def append(self, conversation_id, role, content, display=True, context=True):
+        raise NotImplementedError
+
+    def load(self, conversation_id, limit=None, before=None, display_only=False, context_only=False):
+        """Return up to ``limit`` messages older than ``before`` (a seq), oldest first"""
+        raise NotImplementedError
+
+    def count(self, conversation_id, display_only=False):
+        raise NotImplementedError
+
+    def delete(self, conversation_id):
+        raise NotImplementedError
+
+
+class SQLiteConversationStore(ConversationStore):
+    def __init__(self, path="papuy_conversations.db"):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # One shared connection guarded by a lock: Streamlit runs every session on its own thread
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id TEXT PRIMARY KEY,
+                owner TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS conversations_owner ON conversations (owner, updated_at);
+            CREATE TABLE IF NOT EXISTS messages (
+                conversation_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                display INTEGER NOT NULL DEFAULT 1,
+                context INTEGER NOT NULL DEFAULT 1,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (conversation_id, seq)
+            );
+        """)
+        self._conn.commit()
+
+    def create_conversation(self, owner=None):
+        conversation_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO conversations (id, owner, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (conversation_id, owner, now, now)
+            )
+            self._conn.commit()
+        return conversation_id
+
+    def latest_conversation(self, owner=None):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM conversations WHERE owner IS ? ORDER BY updated_at DESC LIMIT 1",
+                (owner,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def append(self, conversation_id, role, content, display=True, context=True):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM messages WHERE conversation_id = ?",
+                (conversation_id,)
+            ).fetchone()
+            seq = row[0] + 1
+            self._conn.execute(
+                "INSERT INTO messages (conversation_id, seq, role, content, display, context, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (conversation_id, seq, role, content, int(display), int(context), now)
+            )
+            self._conn.execute(
+                "UPDATE conversations SET updated_at = ? WHERE id = ?",
+                (now, conversation_id)
+            )
+            self._conn.commit()
+        return seq
+
+    def load(self, conversation_id, limit=None, before=None, display_only=False, context_only=False):
+        query = "SELECT seq, role, content, display, context FROM messages WHERE conversation_id = ?"
+        params = [conversation_id]
+        if before is not None:
+            query += " AND seq < ?"
+            params.append(before)
+        if display_only:
+            query += " AND display = 1"
+        if context_only:
+            query += " AND context = 1"
+        query += " ORDER BY seq DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [
+            {"seq": seq, "role": role, "content": content, "display": bool(display), "context": bool(context)}
+            for seq, role, content, display, context in reversed(rows)
+        ]
+
+    def count(self, conversation_id, display_only=False):
+        query = "SELECT COUNT(*) FROM messages WHERE conversation_id = ?"
+        if display_only:
+            query += " AND display = 1"
+        with self._lock:
+            return self._conn.execute(query, (conversation_id,)).fetchone()[0]
+
+    def delete(self, conversation_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            self._conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+            self._conn.commit()
+
+
+class SharedStateConversationStore(ConversationStore):
+    """Conversation history kept in a StateBackend so every replica sees the same sessions
+
+    Each conversation is a list of JSON messages; a message's seq is its list position + 1.
+    """
+
+    PAGE_SIZE = 100
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def create_conversation(self, owner=None):
+        conversation_id = uuid.uuid4().hex
+        self._touch(conversation_id, owner)
+        return conversation_id
+
+    def _touch(self, conversation_id, owner):
+        self.backend.set(f"conversation:{conversation_id}:owner", json.dumps(owner).encode())
+        self.backend.set(f"conversation-owner:{owner}:latest", conversation_id.encode())
+
+    def latest_conversation(self, owner=None):
+        value = self.backend.get(f"conversation-owner:{owner}:latest")
+        return value.decode() if value is not None else None
+
+    def append(self, conversation_id, role, content, display=True, context=True):
+        message = {"role": role, "content": content, "display": bool(display), "context": bool(context)}
+        seq = self.backend.rpush(f"conversation:{conversation_id}:messages", json.dumps(message, ensure_ascii=False).encode())
+        owner = self.backend.get(f"conversation:{conversation_id}:owner")
+        if owner is not None:
+            self.backend.set(f"conversation-owner:{json.loads(owner)}:latest", conversation_id.encode())
+        return seq
+
+    def load(self, conversation_id, limit=None, before=None, display_only=False, context_only=False):
+        key = f"conversation:{conversation_id}:messages"
+        end = (before - 1 if before is not None else self.backend.llen(key))
+        messages = []
+        # Walk backwards page by page so only the requested window is transferred
+        while end > 0 and (limit is None or len(messages) < limit):
+            start = max(end - self.PAGE_SIZE, 0)
+            page = self.backend.lrange(key, start, end - 1)
+            for offset in range(len(page) - 1, -1, -1):
+                message = json.loads(page[offset])
+                if (display_only and not message["display"]) or (context_only and not message["context"]):
+                    continue
+                message["seq"] = start + offset + 1
+                messages.append(message)
+                if limit is not None and len(messages) >= limit:
+                    break
+            end = start
+        return list(reversed(messages))
+
+    def count(self, conversation_id, display_only=False):
+        if not display_only:
+            return self.backend.llen(f"conversation:{conversation_id}:messages")
+        return len(self.load(conversation_id, display_only=True))
+
+    def delete(self, conversation_id):
+        owner = self.backend.get(f"conversation:{conversation_id}:owner")
+        self.backend.delete(f"conversation:{conversation_id}:messages")
+        self.backend.delete(f"conversation:{conversation_id}:owner")
+        if owner is not None:
+            # Never resume a deleted conversation; a newer one keeps the pointer
+            latest_key = f"conversation-owner:{json.loads(owner)}:latest"
+            latest = self.backend.get(latest_key)
+            if latest is not None and latest.decode() == conversation_id:
+                self.backend.delete(latest_key)
+
+
+def _sqlite_store_from_url(url):
+    # sqlite:///relative.db -> relative.db, sqlite:////abs/path.db -> /abs/path.db
+    return SQLiteConversationStore(url.path[1:] or "papuy_conversations.db")
+
+
+# Store backends by URL scheme, e.g. "sqlite:///data/papuy.db" or "redis://localhost:6379/0"
+STORE_BACKENDS = {
+    "sqlite": _sqlite_store_from_url,
+    "redis": lambda url: SharedStateConversationStore(RedisBackend.from_url(url)),
+    "memory": lambda url: SharedStateConversationStore(InProcessBackend(max_entries=100000)),
+}
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def register_store_backend(scheme, factory):
+    """Register a factory taking the parsed store URL and returning a ConversationStore"""
+    STORE_BACKENDS[scheme] = factory
+
+
+def get_conversation_store():
+    """Return the process-wide conversation store configured by CONVERSATION_STORE_URL"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            url = urlparse(get_setting("CONVERSATION_STORE_URL", "sqlite:///papuy_conversations.db"))
+            if url.scheme not in STORE_BACKENDS:
+                raise ValueError(f"Backend de conversaciones no soportado: {url.scheme}")
+            _store = STORE_BACKENDS[url.scheme](url)
+        return _store
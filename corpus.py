@@ -0,0 +1,261 @@
+"""Paper corpus: every paper the system has seen, exportable to Parquet/Arrow.
+
+Usage:
+    python corpus.py export --out corpus_export [--format parquet|arrow]
+    python corpus.py compact --out corpus_export
+"""
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from paper_index import canonical_url, extract_doi, extract_pmid
+from reranker import parse_year
+from settings import get_setting
+
+TEXT_FIELDS = [
+    "doi", "pmid", "title", "title_es", "journal", "volume", "issue", "pages", "url", "pdf_link",
+    "abstract", "abstract_es", "summary", "source",
+]
+SCHEMA = pa.schema(
+    [("key", pa.string())]
+    + [(field, pa.string()) for field in TEXT_FIELDS]
+    + [
+        ("authors", pa.list_(pa.string())),
+        ("year", pa.int32()),
+        ("cited_by", pa.int64()),
+        ("queries", pa.list_(pa.string())),
+        ("first_seen", pa.timestamp("s")),
+        ("updated_at", pa.timestamp("s")),
+    ]
+)
+EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow"}
+STATE_FILE = "_export_state.json"
+
+
+def dedup_key(paper):
+    """DOI first, then PMID, then canonical URL"""
+    doi = paper.get('doi') or extract_doi(paper.get('url'))
+    if doi:
+        return f"doi:{doi.lower()}"
+    pmid = paper.get('pmid') or extract_pmid(paper.get('url'))
+    if pmid:
+        return f"pmid:{pmid}"
+    url = canonical_url(paper['url']) if paper.get('url') else None
+    return f"url:{url}" if url else None
+
+
+def is_error(value):
+    # Failed translations and summaries are stored as "Error ..." strings (the repo's error convention)
+    return isinstance(value, str) and value.startswith("Error")
+
+
+class CorpusStore:
+    """SQLite staging table of papers, merged on their DOI/PMID/URL key
+
+    Every write takes the next ``seq`` inside its own write transaction, so
+    sequence order is commit order and exports can resume from the last one seen.
+    """
+
+    def __init__(self, path="papuy_corpus.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS papers (
+                key TEXT PRIMARY KEY,
+                record TEXT NOT NULL,
+                first_seen REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                seq INTEGER
+            )
+        """)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(papers)")]
+        if "seq" not in columns:
+            # Databases from before the sequence column: number existing rows by insertion
+            self._conn.execute("ALTER TABLE papers ADD COLUMN seq INTEGER")
+            self._conn.execute("UPDATE papers SET seq = rowid")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS papers_updated ON papers (updated_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS papers_seq ON papers (seq)")
+        self._conn.commit()
+
+    def record_papers(self, papers, query=None):
+        now = time.time()
+        with self._lock:
+            for paper in papers:
+                key = dedup_key(paper)
+                if not key:
+                    continue
+                row = self._conn.execute("SELECT record, first_seen FROM papers WHERE key = ?", (key,)).fetchone()
+                record, first_seen = (json.loads(row[0]), row[1]) if row else ({}, now)
+                # New non-empty values win; a later search (or a failed call) never erases a summary or translation
+                for field, value in paper.items():
+                    if value not in (None, "", []) and not is_error(value):
+                        record[field] = value
+                if query and query not in record.setdefault("queries", []):
+                    record["queries"].append(query)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO papers (key, record, first_seen, updated_at, seq) "
+                    "VALUES (?, ?, ?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM papers))",
+                    (key, json.dumps(record, ensure_ascii=False), first_seen, now)
+                )
+            self._conn.commit()
+
+    def iter_changed(self, since=0, batch_size=10000):
+        """Yield lists of (key, record, first_seen, updated_at, seq) written after sequence ``since``"""
+        # A separate read connection: WAL lets the export run while searches keep recording
+        conn = sqlite3.connect(self.path)
+        try:
+            rows = conn.execute(
+                "SELECT key, record, first_seen, updated_at, seq FROM papers WHERE seq > ? ORDER BY seq",
+                (since,)
+            )
+            while True:
+                batch = rows.fetchmany(batch_size)
+                if not batch:
+                    break
+                yield [(key, json.loads(record), first_seen, updated_at, seq) for key, record, first_seen, updated_at, seq in batch]
+        finally:
+            conn.close()
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def records_to_table(rows):
+    """Typed Arrow table from staged corpus rows"""
+    data = []
+    for key, record, first_seen, updated_at, _seq in rows:
+        item = {"key": key}
+        for field in TEXT_FIELDS:
+            value = record.get(field)
+            item[field] = str(value) if value not in (None, "") and not is_error(value) else None
+        item["pmid"] = item["pmid"] or extract_pmid(record.get('url'))
+        item["doi"] = item["doi"] or extract_doi(record.get('url'))
+        item["authors"] = [str(author) for author in record.get('authors') or []]
+        item["year"] = parse_year(record.get('year'))
+        item["cited_by"] = _to_int(record.get('cited_by'))
+        item["queries"] = list(record.get('queries') or [])
+        item["first_seen"] = int(first_seen)
+        item["updated_at"] = int(updated_at)
+        data.append(item)
+    frame = pd.DataFrame(data, columns=SCHEMA.names)
+    frame["first_seen"] = pd.to_datetime(frame["first_seen"], unit="s")
+    frame["updated_at"] = pd.to_datetime(frame["updated_at"], unit="s")
+    frame["year"] = frame["year"].astype("Int32")
+    frame["cited_by"] = frame["cited_by"].astype("Int64")
+    return pa.Table.from_pandas(frame, schema=SCHEMA, preserve_index=False)
+
+
+def _write_table(table, path, fmt):
+    if fmt == "arrow":
+        feather.write_feather(table, path, compression="zstd")
+    else:
+        pq.write_table(table, path, compression="zstd")
+
+
+def _read_table(path):
+    return feather.read_table(path) if path.endswith(".arrow") else pq.read_table(path)
+
+
+def _parts(output_dir):
+    return sorted(glob.glob(os.path.join(output_dir, "part-*.parquet")) + glob.glob(os.path.join(output_dir, "part-*.arrow")))
+
+
+def load_corpus(output_dir):
+    """Load an exported corpus as a DataFrame, keeping the latest version of each paper"""
+    parts = _parts(output_dir)
+    if not parts:
+        return pd.DataFrame(columns=SCHEMA.names)
+    table = pa.concat_tables([_read_table(path) for path in parts])
+    frame = table.to_pandas(types_mapper={pa.int32(): pd.Int32Dtype(), pa.int64(): pd.Int64Dtype()}.get)
+    # Parts are read oldest first, so a stable sort keeps the newest version last on ties
+    return frame.sort_values("updated_at", kind="stable").drop_duplicates("key", keep="last").reset_index(drop=True)
+
+
+def export_corpus(store, output_dir, fmt="parquet", max_parts=20):
+    """Append papers changed since the last export as a new part file
+
+    Re-exported papers are deduplicated on read (latest version wins) and
+    physically when the number of parts exceeds ``max_parts``.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    state_path = os.path.join(output_dir, STATE_FILE)
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path, encoding="utf-8") as f:
+            state = json.load(f)
+
+    exported = 0
+    # A write sequence, not a timestamp: a row committed during the export gets a higher
+    # sequence than every row read, so the next export picks it up. States from the old
+    # timestamp watermark start over once (re-exported papers are deduplicated on read).
+    sequence = state.get("sequence", 0)
+    for rows in store.iter_changed(since=sequence):
+        table = records_to_table(rows)
+        path = os.path.join(output_dir, f"part-{time.time_ns()}{EXTENSIONS[fmt]}")
+        _write_table(table, path, fmt)
+        exported += len(rows)
+        sequence = max(sequence, rows[-1][4])
+
+    state = {"sequence": sequence}
+    with open(state_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    if len(_parts(output_dir)) > max_parts:
+        compact_corpus(output_dir, fmt)
+    return exported
+
+
+def compact_corpus(output_dir, fmt="parquet"):
+    """Rewrite all parts as a single deduplicated file"""
+    parts = _parts(output_dir)
+    if len(parts) <= 1:
+        return len(parts)
+    table = pa.Table.from_pandas(load_corpus(output_dir), schema=SCHEMA, preserve_index=False)
+    path = os.path.join(output_dir, f"part-{time.time_ns()}{EXTENSIONS[fmt]}")
+    _write_table(table, path, fmt)
+    for old_path in parts:
+        os.remove(old_path)
+    return table.num_rows
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_corpus_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = CorpusStore(get_setting("CORPUS_DB_PATH", "papuy_corpus.db"))
+        return _store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta el corpus de artículos a Parquet/Arrow.")
+    parser.add_argument("command", choices=["export", "compact"])
+    parser.add_argument("--out", default="corpus_export", help="Directorio del dataset")
+    parser.add_argument("--format", choices=list(EXTENSIONS), default="parquet")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        exported = export_corpus(get_corpus_store(), args.out, args.format)
+        print(f"{exported} artículos nuevos o actualizados exportados a {args.out}")
+    else:
+        rows = compact_corpus(args.out, args.format)
+        print(f"Corpus compactado: {rows} artículos")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+import re
+import threading
+import time
+import httpx
+from cancellation import check_cancelled
+from metrics import get_metrics
+from settings import get_float_setting, get_list_setting, get_setting, parse_mapping
+
+# Pool name -> setting holding its single key; "<setting>S" holds several
+CREDENTIAL_SETTINGS = {
+    "openai": "OPENAI_API_KEY",
+    "serpapi": "SERP_API_KEY",
+    "ncbi": "PUBMED_API_KEY",
+    "semanticscholar": "SEMANTIC_SCHOLAR_API_KEY",
+}
+# Documented per-key request rates, used while a provider has not reported its own headroom
+DEFAULT_KEY_RATES = "ncbi=10,semanticscholar=1"
+
+THROTTLED_STATUS = 429
+# Payment required / unauthorized: the key itself is out of quota or revoked
+QUOTA_STATUS = (401, 402)
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def load_keys(setting):
+    """Keys from ``<setting>S`` (list or comma-separated), else the single ``<setting>``"""
+    return get_list_setting(f"{setting}S") or get_list_setting(setting)
+
+
+def parse_reset(value):
+    """Seconds until a rate-limit reset: "6m0s"/"250ms" durations, plain seconds or an epoch timestamp"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        seconds = float(value)
+        return seconds - time.time() if seconds > 1e9 else seconds
+    except ValueError:
+        parts = _DURATION.findall(value)
+        return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts) if parts else None
+
+
+class Credential:
+    def __init__(self, key, rate=None):
+        self.key = key
+        self.label = f"…{key[-4:]}" if key else "sin clave"
+        self.rate = rate
+        self.tokens = rate or 0.0
+        self.refilled_at = time.monotonic()
+        self.remaining = None
+        self.limit = None
+        self.remaining_until = 0.0
+        self.cooldown_until = 0.0
+        self.throttles = 0
+        self.in_flight = 0
+        self.requests = 0
+
+    def headroom(self, now):
+        """Share of this key's capacity still free right now, as far as we know
+
+        Fractions keep keys with different limits comparable. A key that has
+        reported nothing is assumed free, discounted by its requests in flight,
+        so every key gets probed instead of one draining while others idle.
+        """
+        # Both counters are decremented on acquire, so requests in flight are already accounted for
+        if self.remaining is not None and now < self.remaining_until:
+            return self.remaining / max(self.limit or 1, 1)
+        if self.rate:
+            self.tokens = min(self.rate, self.tokens + (now - self.refilled_at) * self.rate)
+            self.refilled_at = now
+            return self.tokens / self.rate
+        return 1.0 / (1 + self.in_flight)
+
+
+class CredentialPool:
+    """Spreads requests across a provider's API keys by remaining rate-limit headroom
+
+    Keys answering 429 sit out for Retry-After (or an exponential cooldown);
+    keys out of quota (401/402) sit out for ``max_cooldown``. Usage per key is
+    counted in ``credential_requests_total{pool, key, outcome}``.
+    """
+
+    def __init__(self, name, keys, rate=None, cooldown=60, max_cooldown=3600, metrics=None):
+        self.name = name
+        # Without keys the provider is called anonymously, still through the pool's accounting
+        self.credentials = [Credential(key, rate) for key in keys] or [Credential(None, rate)]
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.metrics = metrics or get_metrics()
+        self._lock = threading.Lock()
+        self._http_client = None
+
+    def __len__(self):
+        return len(self.credentials)
+
+    @property
+    def keys(self):
+        return [credential.key for credential in self.credentials if credential.key]
+
+    def acquire(self, exclude=()):
+        """The available key with the most headroom (the one back soonest if all are cooling down)"""
+        with self._lock:
+            now = time.monotonic()
+            candidates = [credential for credential in self.credentials if credential not in exclude] or self.credentials
+            available = [credential for credential in candidates if credential.cooldown_until <= now]
+            if available:
+                # Ties go to the key with fewest requests in flight, then the least used one
+                credential = max(
+                    available,
+                    key=lambda credential: (credential.headroom(now), -credential.in_flight, -credential.requests)
+                )
+            else:
+                credential = min(candidates, key=lambda credential: credential.cooldown_until)
+            credential.in_flight += 1
+            credential.requests += 1
+            if credential.rate:
+                credential.tokens -= 1
+            if credential.remaining is not None:
+                credential.remaining -= 1
+            return credential
+
+    def release(self, credential, status=None, headers=None):
+        """Return a key after a request, learning its headroom and throttling from the response"""
+        headers = headers or {}
+        with self._lock:
+            now = time.monotonic()
+            credential.in_flight -= 1
+            remaining = headers.get("x-ratelimit-remaining-requests") or headers.get("x-ratelimit-remaining")
+            if remaining is not None and remaining.strip().lstrip("-").isdigit():
+                reset = parse_reset(headers.get("x-ratelimit-reset-requests") or headers.get("x-ratelimit-reset"))
+                limit = headers.get("x-ratelimit-limit-requests") or headers.get("x-ratelimit-limit")
+                credential.remaining = int(remaining)
+                # Without a limit header, the most ever remaining stands in for the key's capacity
+                credential.limit = int(limit) if limit and limit.strip().isdigit() else max(credential.limit or 0, int(remaining))
+                credential.remaining_until = now + (reset if reset is not None and reset > 0 else 60)
+            if status == THROTTLED_STATUS:
+                credential.throttles += 1
+                retry_after = parse_reset(headers.get("retry-after"))
+                delay = retry_after if retry_after and retry_after > 0 else self.cooldown * 2 ** (credential.throttles - 1)
+                credential.cooldown_until = now + min(delay, self.max_cooldown)
+                outcome = "throttled"
+            elif status in QUOTA_STATUS:
+                credential.cooldown_until = now + self.max_cooldown
+                outcome = "quota"
+            elif status is None or status >= 500:
+                outcome = "error"
+            else:
+                credential.throttles = 0
+                outcome = "ok"
+        self.metrics.incr("credential_requests_total", pool=self.name, key=credential.label, outcome=outcome)
+
+    def has_available(self):
+        with self._lock:
+            now = time.monotonic()
+            return any(credential.cooldown_until <= now for credential in self.credentials)
+
+    def call(self, send):
+        """``send(key)`` -> requests.Response, retried on the next key while keys answer 429 or quota errors"""
+        tried = []
+        while True:
+            credential = self.acquire(exclude=tried)
+            try:
+                response = send(credential.key)
+            except Exception:
+                self.release(credential)
+                raise
+            self.release(credential, response.status_code, {k.lower(): v for k, v in response.headers.items()})
+            tried.append(credential)
+            if response.status_code not in (THROTTLED_STATUS,) + QUOTA_STATUS or len(tried) >= len(self.credentials):
+                return response
+
+    def http_client(self, timeout=None):
+        """Shared httpx client whose requests each carry a pooled key (for the OpenAI SDK)"""
+        with self._lock:
+            if self._http_client is None:
+                self._http_client = httpx.Client(transport=PooledTransport(self), timeout=timeout)
+            return self._http_client
+
+    def status(self):
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "pool": self.name,
+                    "key": credential.label,
+                    "requests": credential.requests,
+                    "in_flight": credential.in_flight,
+                    "remaining": credential.remaining if now < credential.remaining_until else None,
+                    "cooldown": max(0.0, credential.cooldown_until - now),
+                }
+                for credential in self.credentials
+            ]
+
+
+class PooledTransport(httpx.BaseTransport):
+    """Sets each request's bearer token from the pool; the SDK's own retries land on another key after a 429"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._transport = httpx.HTTPTransport()
+
+    def handle_request(self, request):
+        # A cancelled request sends nothing more: no SDK retry, map step or reduce after it
+        check_cancelled()
+        credential = self.pool.acquire()
+        if credential.key:
+            request.headers["Authorization"] = f"Bearer {credential.key}"
+        try:
+            response = self._transport.handle_request(request)
+        except Exception:
+            self.pool.release(credential)
+            raise
+        self.pool.release(credential, response.status_code, response.headers)
+        if response.status_code == THROTTLED_STATUS and self.pool.has_available():
+            # The retry will use another key, so the SDK need not wait out this key's Retry-After
+            response.headers.pop("retry-after", None)
+            response.headers["retry-after-ms"] = "1"
+        return response
+
+    def close(self):
+        self._transport.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_credential_pool(name):
+    """Process-wide pool for a provider, configured from its key settings"""
+    with _pools_lock:
+        if name not in _pools:
+            rates = parse_mapping(get_setting("PAPUY_KEY_RATES", DEFAULT_KEY_RATES))
+            _pools[name] = CredentialPool(
+                name,
+                load_keys(CREDENTIAL_SETTINGS[name]),
+                rate=float(rates[name]) if name in rates else None,
+                cooldown=get_float_setting("PAPUY_KEY_COOLDOWN", 60)
+            )
+        return _pools[name]
+
+
+def credential_status():
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [row for pool in pools for row in pool.status()]
@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class ProviderHealth:
+    """Rolling error-rate/latency window and circuit breaker for one provider
+
+    The breaker opens after ``max_consecutive_failures`` failures in a row, or
+    when the error rate over the last ``window_seconds`` reaches
+    ``error_threshold`` with at least ``min_calls`` calls. Once ``cooldown``
+    has passed a single probe is allowed (half-open): success closes the
+    breaker, failure reopens it with a doubled cooldown up to ``max_cooldown``.
+    """
+
+    def __init__(self, name, window_seconds=60, min_calls=5, error_threshold=0.5,
+                 max_consecutive_failures=3, cooldown=30, max_cooldown=300, metrics=None):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_threshold = error_threshold
+        self.max_consecutive_failures = max_consecutive_failures
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.metrics = metrics
+        self.state = CLOSED
+        self.cooldown = cooldown
+        self.opened_at = 0.0
+        self.consecutive_failures = 0
+        self._calls = deque()  # (timestamp, ok, latency)
+        self._lock = threading.Lock()
+        self._publish()
+
+    def _trim(self, now):
+        while self._calls and self._calls[0][0] < now - self.window_seconds:
+            self._calls.popleft()
+
+    def _publish(self):
+        if self.metrics is None:
+            return
+        self.metrics.set_gauge("provider_circuit_state", STATE_VALUES[self.state], provider=self.name)
+        self.metrics.set_gauge("provider_error_rate", round(self._error_rate(), 3), provider=self.name)
+
+    def _error_rate(self):
+        if not self._calls:
+            return 0.0
+        return sum(1 for _, ok, _ in self._calls if not ok) / len(self._calls)
+
+    def _transition(self, state, now):
+        if state == OPEN:
+            self.opened_at = now
+        self.state = state
+        if self.metrics is not None:
+            self.metrics.incr("provider_circuit_transitions_total", provider=self.name, state=state)
+
+    def record(self, ok, latency=None):
+        now = time.monotonic()
+        with self._lock:
+            self._calls.append((now, ok, latency))
+            self._trim(now)
+            if ok:
+                self.consecutive_failures = 0
+                if self.state != CLOSED:
+                    self.cooldown = self.base_cooldown
+                    self._transition(CLOSED, now)
+            else:
+                self.consecutive_failures += 1
+                if self.state == HALF_OPEN:
+                    # Failed probe: back off further before the next one
+                    self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                    self._transition(OPEN, now)
+                elif self.state == CLOSED and (
+                    self.consecutive_failures >= self.max_consecutive_failures
+                    or (len(self._calls) >= self.min_calls and self._error_rate() >= self.error_threshold)
+                ):
+                    self._transition(OPEN, now)
+            self._publish()
+        if self.metrics is not None:
+            self.metrics.incr("provider_requests_total", provider=self.name, outcome="ok" if ok else "error")
+            if ok and latency is not None:
+                self.metrics.observe("provider_latency_seconds", latency, provider=self.name)
+
+    def allow_request(self):
+        """Whether a search may use this provider now (always true while closed)"""
+        with self._lock:
+            return self.state == CLOSED
+
+    def try_probe(self):
+        """Claim the single half-open probe once the cooldown has passed"""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN and now - self.opened_at >= self.cooldown:
+                self._transition(HALF_OPEN, now)
+                self._publish()
+                return True
+            return False
+
+    def _percentile(self, fraction):
+        latencies = sorted(latency for _, ok, latency in self._calls if ok and latency is not None)
+        if not latencies:
+            return None
+        return latencies[min(int(fraction * len(latencies)), len(latencies) - 1)]
+
+    def percentile(self, fraction):
+        with self._lock:
+            return self._percentile(fraction)
+
+    def successes(self):
+        with self._lock:
+            return sum(1 for _, ok, _ in self._calls if ok)
+
+    def status(self):
+        with self._lock:
+            self._trim(time.monotonic())
+            return {
+                "provider": self.name,
+                "state": self.state,
+                "calls": len(self._calls),
+                "error_rate": round(self._error_rate(), 3),
+                "p90": self._percentile(0.9),
+            }
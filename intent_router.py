@@ -0,0 +1,207 @@
+import contextvars
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler
+from query_cache import normalize_query
+from settings import get_setting, parse_mapping
+
+Intent = namedtuple("Intent", ["name", "confidence", "argument"])
+
+SEARCH, DOWNLOAD, SUMMARIZE, MEDICAL, CASUAL = "search", "download", "summarize", "medical", "casual"
+
+# Command phrases, matched anywhere in the accent-folded lowercase message
+COMMAND_PATTERNS = [
+    (SEARCH, re.compile(r"busca(?:r|me)?\s+(?:articulos|papers|estudios|publicaciones)\s+(?:sobre|acerca de|de)\b")),
+    (DOWNLOAD, re.compile(r"(?:obtener|obten|dame)\s+(?:el\s+|un\s+)?enlace de descarga (?:para|de)\b|descargar\s+(?:el\s+)?(?:articulo|pdf)\s+(?:de\s+)?")),
+    (SUMMARIZE, re.compile(r"(?:resumir|resume|resumeme)\s+(?:este|el siguiente)\s+articulo\b")),
+]
+_URL_RE = re.compile(r"https?://\S+")
+
+# Seed examples for the casual/medical naive Bayes model
+TRAINING_EXAMPLES = {
+    CASUAL: [
+        "hola", "hola papuy", "buenos días", "buenas tardes", "buenas noches", "qué tal", "cómo estás",
+        "cómo te llamas", "quién eres", "gracias", "muchas gracias por tu ayuda", "te quiero",
+        "estoy cansada", "estoy muy estresada con los exámenes", "tengo sueño", "cuéntame un chiste",
+        "qué hora es", "qué día es hoy", "me siento feliz", "adiós", "nos vemos mañana", "jaja qué gracioso",
+        "qué opinas de la música", "recomiéndame una película", "qué puedo cocinar hoy", "me aburro",
+        "dime algo bonito", "estoy triste", "qué haces", "eres genial", "buen trabajo", "ok perfecto",
+        "ok", "vale", "sí", "perfecto", "de nada", "hello", "thanks", "how are you", "good morning", "tell me a joke",
+    ],
+    MEDICAL: [
+        "cuál es el tratamiento de la diabetes tipo 2", "síntomas de la apendicitis",
+        "dosis de amoxicilina en niños", "qué es la hipertensión arterial", "diagnóstico diferencial de dolor torácico",
+        "fisiopatología de la insuficiencia cardiaca", "efectos adversos de la metformina",
+        "criterios diagnósticos de sepsis", "manejo del asma en urgencias", "cómo se trata la neumonía",
+        "factores de riesgo del cáncer de mama", "interpretación de gases arteriales",
+        "qué antibiótico usar en infección urinaria", "complicaciones de la preeclampsia",
+        "mecanismo de acción de los betabloqueadores", "valores normales de hemoglobina",
+        "cuándo está indicada una tomografía", "guías de manejo de la EPOC", "vacunas en el embarazo",
+        "pronóstico del infarto agudo de miocardio", "etiología de la anemia ferropénica",
+        "cómo se diagnostica la tuberculosis", "contraindicaciones de los AINEs",
+        "clasificación de las quemaduras", "tratamiento de la migraña crónica", "signos de deshidratación",
+        "evidencia sobre estatinas en prevención primaria", "qué dice la literatura sobre el dengue grave",
+        "me duele la cabeza qué puede ser", "tengo fiebre y tos desde ayer", "me duele el pecho al respirar",
+        "qué puede causar mareos y náuseas", "dolor abdominal en el lado derecho", "tengo una erupción en la piel",
+        "treatment of heart failure", "side effects of ibuprofen", "diagnosis of pulmonary embolism",
+    ],
+}
+
+
+def fold_for_matching(text):
+    """Lowercase and strip accents one character at a time, so match offsets map back to the original"""
+    return "".join(
+        ("".join(c for c in unicodedata.normalize("NFKD", char) if not unicodedata.combining(c)) or char)[:1]
+        for char in text.lower()
+    )
+
+
+# Messages with the route they must take, checked by ``python intent_router.py``
+ROUTING_CASES = [
+    ("hola papuy", CASUAL),
+    ("muchas gracias por tu ayuda", CASUAL),
+    ("buenas noches", CASUAL),
+    ("estoy cansada", CASUAL),
+    ("estoy muy estresada y me duele el pecho", MEDICAL),
+    ("buenos días Papuy, cómo se trata el lupus?", MEDICAL),
+    ("me siento cansada y mareada", MEDICAL),
+    ("hola, tengo fiebre", MEDICAL),
+    ("gracias, y qué dosis de paracetamol le doy?", MEDICAL),
+    ("lupus", MEDICAL),
+    ("buscar artículos sobre asma", SEARCH),
+]
+
+
+class IntentClassifier:
+    """Regex command detection plus a multinomial naive Bayes for casual vs. medical messages
+
+    Messages the model is unsure about go to the medical route: a casual reply
+    to a clinical question costs more than a research reply to small talk. So
+    only messages made entirely of words seen in casual examples can be casual:
+    a single unknown word (a disease, a drug) or a word seen only in medical
+    examples sends the message to the medical route.
+    """
+
+    def __init__(self, examples=None, casual_threshold=0.7):
+        self.casual_threshold = casual_threshold
+        self.classes = [CASUAL, MEDICAL]
+        self.counts = {label: Counter() for label in self.classes}
+        for label, texts in (examples or TRAINING_EXAMPLES).items():
+            for text in texts:
+                self.counts[label].update(normalize_query(text))
+        self.vocabulary = set().union(*self.counts.values())
+        self.totals = {label: sum(counts.values()) for label, counts in self.counts.items()}
+
+    def _casual_probability(self, text):
+        tokens = normalize_query(text)
+        # Casual needs positive evidence for every word; an unseen word counts as medical
+        if not tokens or any(not self.counts[CASUAL][token] for token in tokens):
+            return 0.0
+        scores = {}
+        for label in self.classes:
+            denominator = self.totals[label] + len(self.vocabulary)
+            scores[label] = sum(math.log((self.counts[label][token] + 1) / denominator) for token in tokens)
+        top = max(scores.values())
+        weights = {label: math.exp(score - top) for label, score in scores.items()}
+        return weights[CASUAL] / sum(weights.values())
+
+    def classify(self, text):
+        folded = fold_for_matching(text)
+        for name, pattern in COMMAND_PATTERNS:
+            match = pattern.search(folded)
+            if match:
+                argument = (text[:match.start()] + text[match.end():]).strip()
+                if name == DOWNLOAD:
+                    url = _URL_RE.search(argument)
+                    argument = url.group(0) if url else argument
+                return Intent(name, 1.0, argument)
+        casual = self._casual_probability(text)
+        if casual >= self.casual_threshold:
+            return Intent(CASUAL, casual, text)
+        return Intent(MEDICAL, 1 - casual, text)
+
+
+def load_model_tiers():
+    tiers = parse_mapping(get_setting("PAPUY_MODEL_TIERS", "fast=gpt-4o-mini,research=gpt-4"))
+    tiers.setdefault("research", "gpt-4")
+    return tiers
+
+
+def load_route_tiers():
+    """Model tier per route; routes not listed use the research tier"""
+    return parse_mapping(get_setting("PAPUY_ROUTE_TIERS", "casual=fast"))
+
+
+def load_model_prices():
+    """USD per 1K prompt/completion tokens, from ``model=prompt/completion`` pairs"""
+    prices = {}
+    raw = get_setting("PAPUY_MODEL_PRICES", "gpt-4=0.03/0.06,gpt-4o-mini=0.00015/0.0006")
+    for model, pair in parse_mapping(raw).items():
+        prompt_price, _, completion_price = pair.partition("/")
+        prices[model] = (float(prompt_price), float(completion_price or prompt_price))
+    return prices
+
+
+_route = contextvars.ContextVar("papuy_route", default="other")
+
+
+@contextmanager
+def use_route(route):
+    reset = _route.set(route)
+    try:
+        yield
+    finally:
+        _route.reset(reset)
+
+
+class RouteUsageCallback(BaseCallbackHandler):
+    """Counts tokens and estimated cost of every LLM call under the current route"""
+
+    def __init__(self, model, metrics, prices=None):
+        self.model = model
+        self.metrics = metrics
+        self.prices = prices or {}
+
+    def on_llm_end(self, response, **kwargs):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        route = _route.get()
+        self.metrics.incr("llm_tokens_total", prompt_tokens, route=route, model=self.model, kind="prompt")
+        self.metrics.incr("llm_tokens_total", completion_tokens, route=route, model=self.model, kind="completion")
+        if self.model in self.prices:
+            prompt_price, completion_price = self.prices[self.model]
+            cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+            self.metrics.incr("llm_cost_usd_total", cost, route=route, model=self.model)
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_intent_classifier():
+    global _classifier
+    with _classifier_lock:
+        if _classifier is None:
+            _classifier = IntentClassifier()
+        return _classifier
+
+
+def main():
+    # Routing regression check: exits non-zero when a case takes the wrong route
+    classifier = get_intent_classifier()
+    failures = 0
+    for text, expected in ROUTING_CASES:
+        intent = classifier.classify(text)
+        ok = intent.name == expected
+        failures += not ok
+        print(f"{'✓' if ok else '✗'} {intent.name:<9} {intent.confidence:.2f}  {text}" + ("" if ok else f"  (esperado: {expected})"))
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
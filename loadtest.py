@@ -0,0 +1,347 @@
+"""Concurrent-session load test against local stub providers.
+
+Usage:
+    python loadtest.py --levels 1,5,10,25 --duration 30
+    python loadtest.py --mode app --levels 1,4,8 --duration 20
+
+Every virtual user logs in (``--mode app`` drives app.py headless through
+Streamlit's AppTest, ``--mode chatbot`` drives PapuyChatbot directly) and
+sends a weighted mix of search, summarize, download and chat prompts. SerpAPI,
+NCBI, article pages and the OpenAI API are served by an in-process stub
+server with configurable latency, so no real quota is used.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+TOPICS = [
+    "diabetes tipo 2", "hipertensión arterial", "asma infantil", "insuficiencia cardiaca", "sepsis",
+    "depresión posparto", "cáncer de mama", "enfermedad renal crónica", "migraña", "obesidad",
+    "artritis reumatoide", "EPOC", "tuberculosis", "VIH", "dengue", "anemia ferropénica",
+]
+CHAT_PROMPTS = [
+    "¡Hola Papuy! ¿Cómo estás?", "¿Qué es la fibrilación auricular?", "Gracias por tu ayuda",
+    "¿Cuál es el tratamiento de primera línea para la hipertensión?", "Explícame qué es un metaanálisis",
+]
+DEFAULT_MIX = "search=4,summarize=2,download=2,chat=2"
+
+
+def build_stub_pdf(pages):
+    """Smallest valid PDF with one line of Helvetica text per page"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+        kids.append(f"{len(objects) + 1} 0 R")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> "
+                       f"/Contents {len(objects) + 2} 0 R >>".encode())
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(pages)} >>".encode()
+    pdf, offsets = b"%PDF-1.4\n", []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, obj)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF" % (len(objects) + 1, xref)
+    return pdf
+
+
+STUB_PDF = build_stub_pdf(
+    [section for name in ["Introduction", "Methods", "Results", "Discussion"]
+     for section in [name] + ["Lorem ipsum dolor sit amet."] * 3]
+)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """SerpAPI, NCBI E-utilities, article pages and an OpenAI-compatible chat endpoint"""
+
+    latency = 0.2
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, content_type="application/json", status=200):
+        data = body.encode() if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        query = params.get("q", params.get("term", ["tema"]))[0]
+        host = f"http://{self.headers['Host']}"
+        if url.path == "/serpapi/search.json":
+            results = [{
+                "title": f"{query}: study {i}",
+                "link": f"{host}/article/{abs(hash((query, i))) % 100000}",
+                "snippet": f"We studied {query} in {100 * i} patients.",
+                "publication_info": {"summary": f"A Author - Journal, {2015 + i} - stub", "authors": [{"name": "A Author"}]},
+                "inline_links": {"cited_by": {"total": 10 * i}},
+                "resources": [{"file_format": "PDF", "link": f"{host}/pdf/{i}.pdf"}] if i % 2 else [],
+            } for i in range(1, 4)]
+            self._send(json.dumps({"organic_results": results}))
+        elif url.path == "/eutils/esearch.fcgi":
+            ids = [str(abs(hash((query, i))) % 10000000) for i in range(3)]
+            self._send(json.dumps({"esearchresult": {"idlist": ids}}))
+        elif url.path == "/eutils/efetch.fcgi":
+            articles = "".join(
+                f"<PubmedArticle><MedlineCitation><PMID>{pmid}</PMID><Article><ArticleTitle>Trial {pmid}</ArticleTitle>"
+                f"<Abstract><AbstractText>Background text.</AbstractText></Abstract><AuthorList><Author>"
+                f"<LastName>Perez</LastName><ForeName>Ana</ForeName></Author></AuthorList>"
+                f"<Journal><JournalIssue><PubDate><Year>2021</Year></PubDate></JournalIssue></Journal>"
+                f"</Article></MedlineCitation></PubmedArticle>"
+                for pmid in params.get("id", [""])[0].split(",") if pmid
+            )
+            self._send(f"<PubmedArticleSet>{articles}</PubmedArticleSet>", "text/xml")
+        elif url.path.startswith("/article/"):
+            body = "".join(f"<h2>{name}</h2>" + "<p>Lorem ipsum dolor sit amet. </p>" * 20
+                           for name in ["Introduction", "Methods", "Results", "Discussion"])
+            self._send(f"<html><body><article><h1>Stub</h1>{body}<a class='pdf-link' href='{host}/pdf/x.pdf'>PDF</a>"
+                       f"</article></body></html>", "text/html")
+        else:
+            self._send(STUB_PDF, "application/pdf")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        time.sleep(self.latency)
+        content = "Respuesta simulada. " * 20
+        if request.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for word in content.split(" "):
+                chunk = {"id": "stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": request.get("model", "stub"),
+                         "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+            return
+        self._send(json.dumps({
+            "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": request.get("model", "stub"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 100, "total_tokens": 200},
+        }))
+
+
+def start_stub_server(latency):
+    StubHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def configure_environment(stub_url, workdir):
+    """Point every provider at the stubs and keep state in throwaway locations"""
+    os.environ.update({
+        "OPENAI_API_KEY": "stub", "SERP_API_KEY": "stub", "PUBMED_API_KEY": "",
+        "APP_USERNAME": "loadtest", "APP_PASSWORD": "loadtest",
+        "OPENAI_BASE_URL": f"{stub_url}/v1",
+        "SERPAPI_URL": f"{stub_url}/serpapi/search.json",
+        "NCBI_EUTILS_URL": f"{stub_url}/eutils",
+        "SHARED_STATE_URL": "memory://",
+        "CONVERSATION_STORE_URL": f"sqlite:///{os.path.join(workdir, 'conversations.db')}",
+        "CORPUS_DB_PATH": os.path.join(workdir, "corpus.db"),
+    })
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            match = re.search(r"VmRSS:\s+(\d+) kB", f.read())
+            return int(match.group(1)) / 1024
+    except OSError:
+        # Not Linux: peak RSS is the closest portable figure (bytes on macOS, kB elsewhere)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        kind, weight = item.split("=")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+class VirtualUser:
+    def __init__(self, mode, stub_url, rng):
+        self.mode = mode
+        self.stub_url = stub_url
+        self.rng = rng
+        self.seen_urls = []
+
+    def login(self):
+        if self.mode == "app":
+            from streamlit.testing.v1 import AppTest
+            self.app = AppTest.from_file("app.py", default_timeout=300)
+            for name in ("OPENAI_API_KEY", "SERP_API_KEY", "APP_USERNAME", "APP_PASSWORD"):
+                self.app.secrets[name] = os.environ[name]
+            self.app.run()
+            self.app.text_input[0].input("loadtest")
+            self.app.text_input[1].input("loadtest")
+            self.app.button[0].click().run()
+            if not self.app.session_state["authenticated"]:
+                raise RuntimeError("Inicio de sesión fallido")
+        else:
+            from chatbot import PapuyChatbot
+            self.chatbot = PapuyChatbot(owner="loadtest")
+
+    def prompt(self, kind):
+        if kind == "search":
+            return f"buscar artículos sobre {self.rng.choice(TOPICS)}"
+        if kind == "summarize":
+            return f"resumir este artículo {self.rng.choice(CHAT_PROMPTS)}"
+        if kind == "download":
+            url = self.rng.choice(self.seen_urls) if self.seen_urls else f"{self.stub_url}/article/{self.rng.randint(1, 1000)}"
+            return f"obtener enlace de descarga para {url}"
+        return self.rng.choice(CHAT_PROMPTS)
+
+    def send(self, prompt):
+        if self.mode == "app":
+            self.app.chat_input[0].set_value(prompt).run()
+            if self.app.exception:
+                raise RuntimeError(str(self.app.exception[0].message))
+            response = self.app.session_state["messages"][-1]["content"] if self.app.session_state["messages"] else ""
+        else:
+            response = self.chatbot.get_response(prompt)
+        self.seen_urls.extend(re.findall(rf"{re.escape(self.stub_url)}/article/\d+", response)[:5])
+        self.seen_urls = self.seen_urls[-20:]
+        if response.startswith("Error") or response.startswith("Lo siento"):
+            raise RuntimeError(response[:200])
+        return response
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def run_level(concurrency, duration, mode, stub_url, mix, think_time, seed, users):
+    """Ramp to ``concurrency`` users (reusing already logged-in ones) and drive them for ``duration`` seconds"""
+    rss_before = current_rss_mb()
+    sessions_before = len(users)
+    login_errors = 0
+    while len(users) < concurrency:
+        user = VirtualUser(mode, stub_url, random.Random(seed + len(users)))
+        try:
+            user.login()
+            users.append(user)
+        except Exception as e:
+            login_errors += 1
+            print(f"  error de inicio de sesión: {e}")
+            if login_errors > concurrency:
+                break
+    rss_after_login = current_rss_mb()
+
+    kinds, weights = list(mix), list(mix.values())
+    latencies = {kind: [] for kind in kinds}
+    errors = {kind: 0 for kind in kinds}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def drive(user):
+        while time.monotonic() < deadline:
+            kind = user.rng.choices(kinds, weights)[0]
+            started = time.monotonic()
+            try:
+                user.send(user.prompt(kind))
+                failed = False
+            except Exception:
+                failed = True
+            elapsed = time.monotonic() - started
+            with lock:
+                latencies[kind].append(elapsed)
+                errors[kind] += failed
+            time.sleep(user.rng.uniform(0, think_time))
+
+    threads = [threading.Thread(target=drive, args=(user,), daemon=True) for user in users[:concurrency]]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    rss_after = current_rss_mb()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    total_errors = sum(errors.values())
+    new_sessions = len(users) - sessions_before
+    return {
+        "concurrency": len(threads),
+        "requests": len(all_latencies),
+        "throughput_rps": len(all_latencies) / elapsed if elapsed else 0.0,
+        "p50_s": percentile(all_latencies, 0.5),
+        "p90_s": percentile(all_latencies, 0.9),
+        "p99_s": percentile(all_latencies, 0.99),
+        "error_rate": total_errors / len(all_latencies) if all_latencies else 0.0,
+        "rss_mb": rss_after,
+        "login_rss_per_session_mb": (rss_after_login - rss_before) / new_sessions if new_sessions else 0.0,
+        "rss_growth_per_session_mb": (rss_after - rss_before) / max(len(threads), 1),
+        "by_kind": {
+            kind: {"requests": len(values), "p50_s": percentile(values, 0.5), "p90_s": percentile(values, 0.9), "errors": errors[kind]}
+            for kind, values in latencies.items()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga con sesiones concurrentes contra proveedores simulados.")
+    parser.add_argument("--mode", choices=["chatbot", "app"], default="chatbot")
+    parser.add_argument("--levels", default="1,5,10,25", help="Niveles de concurrencia, separados por comas")
+    parser.add_argument("--duration", type=float, default=30, help="Segundos por nivel")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Pesos de cada tipo de mensaje")
+    parser.add_argument("--think-time", type=float, default=1.0, help="Pausa máxima entre mensajes de un usuario (s)")
+    parser.add_argument("--stub-latency", type=float, default=0.2, help="Latencia simulada de cada proveedor (s)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="Guardar los resultados en este archivo")
+    args = parser.parse_args()
+
+    server = start_stub_server(args.stub_latency)
+    stub_url = f"http://127.0.0.1:{server.server_address[1]}"
+    workdir = tempfile.mkdtemp(prefix="papuy-loadtest-")
+    configure_environment(stub_url, workdir)
+    mix = parse_mix(args.mix)
+    # Import the app's modules up front so the RSS baseline excludes them
+    import chatbot  # noqa: F401
+    if args.mode == "app":
+        import streamlit.testing.v1  # noqa: F401
+
+    users, results = [], []
+    print(f"{'usuarios':>8} {'req':>6} {'req/s':>7} {'p50':>7} {'p90':>7} {'p99':>7} {'errores':>8} {'RSS MB':>8} {'MB/sesión':>10}")
+    for level in (int(value) for value in args.levels.split(",")):
+        result = run_level(level, args.duration, args.mode, stub_url, mix, args.think_time, args.seed, users)
+        results.append(result)
+        print(f"{result['concurrency']:>8} {result['requests']:>6} {result['throughput_rps']:>7.2f} "
+              f"{result['p50_s']:>6.2f}s {result['p90_s']:>6.2f}s {result['p99_s']:>6.2f}s "
+              f"{result['error_rate']:>7.1%} {result['rss_mb']:>8.1f} {result['rss_growth_per_session_mb']:>10.2f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
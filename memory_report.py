@@ -0,0 +1,237 @@
+"""Per-session memory footprint and allocation reports.
+
+The app registers every Streamlit session with the tracker; the sidebar view
+(PAPUY_MEMORY_VIEW=1) lists the largest sessions, the shared cache size by
+namespace and, with PAPUY_TRACEMALLOC_FRAMES > 0, the top allocation sites.
+"""
+import gc
+import os
+import secrets
+import sys
+import threading
+import time
+import tracemalloc
+import types
+import weakref
+import xml.etree.ElementTree as ET
+from collections import Counter, deque
+from metrics import get_metrics
+from settings import get_int_setting
+from shared_state import InProcessBackend, get_state_backend
+
+# Code, modules and threads are shared by every session; never charge them to one
+_SKIP_TYPES = (
+    type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+    types.CodeType, types.FrameType, weakref.ref, threading.Thread, type(threading.Lock()),
+)
+
+
+def deep_sizeof(obj, seen=None, max_objects=500000):
+    """Approximate bytes retained by ``obj``: shallow sizes of everything reachable through
+    containers and instance attributes, each object counted once
+
+    Objects whose ids are in ``seen`` are skipped (and reached ones are added), so
+    passing one set to several calls splits shared objects between the parts.
+    """
+    seen = set() if seen is None else seen
+    stack = [obj]
+    total = 0
+    while stack and len(seen) < max_objects:
+        current = stack.pop()
+        if id(current) in seen or isinstance(current, _SKIP_TYPES):
+            continue
+        seen.add(id(current))
+        try:
+            total += sys.getsizeof(current)
+        except TypeError:
+            continue
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset, deque)):
+            stack.extend(current)
+        elif isinstance(current, ET.Element):
+            # C elements hide their children and attributes from getsizeof
+            stack.extend(current)
+            stack.extend((current.attrib, current.text, current.tail))
+        else:
+            attributes = getattr(current, "__dict__", None)
+            if attributes is not None:
+                stack.append(attributes)
+            for slot in getattr(type(current), "__slots__", ()):
+                stack.append(getattr(current, slot, None))
+    return total
+
+
+def process_rss():
+    """Resident set size of this process in bytes (peak RSS where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class SessionHandle:
+    """Kept in a session's own state: when the session ends the handle is collected and drops out of the tracker"""
+
+    def __init__(self, owner=None):
+        self.id = secrets.token_hex(4)
+        self.owner = owner
+        self.created = time.time()
+        self.last_seen = self.created
+        self.parts = {}
+
+    def update(self, **parts):
+        self.parts = parts
+        self.last_seen = time.time()
+
+
+class SessionTracker:
+    def __init__(self, backend=None, metrics=None):
+        self.backend = backend or get_state_backend()
+        self.metrics = metrics or get_metrics()
+        self._handles = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._baseline = None
+
+    def register(self, owner=None):
+        handle = SessionHandle(owner)
+        with self._lock:
+            self._handles.add(handle)
+        return handle
+
+    def sessions(self):
+        with self._lock:
+            return list(self._handles)
+
+    @staticmethod
+    def _chatbot_parts(chatbot):
+        """Per-session pieces of a chatbot and the process-wide objects to exclude from them
+
+        Besides the shared services, the models reach the pooled httpx clients (and
+        through them the credential pools); those are shared by every session too.
+        """
+        shared = set(chatbot.SHARED_ATTRIBUTES)
+        parts = {
+            "history": chatbot.messages,
+            "paper_index": chatbot.paper_index,
+            "models": chatbot.models,
+        }
+        parts["other"] = {
+            name: value for name, value in vars(chatbot).items()
+            if name not in shared and name not in ("messages", "paper_index", "models")
+        }
+        shared_objects = [getattr(chatbot, name) for name in shared]
+        for model in chatbot.models.values():
+            shared_objects.extend(getattr(model, name, None) for name in ("http_client", "http_async_client"))
+        return parts, [obj for obj in shared_objects if obj is not None]
+
+    def footprint(self, handle, seen=None):
+        """Estimated bytes per part of one session"""
+        seen = set() if seen is None else seen
+        parts = {}
+        for name, value in handle.parts.items():
+            if value is None:
+                continue
+            if name == "chatbot":
+                chatbot_parts, shared = self._chatbot_parts(value)
+                seen.update(id(obj) for obj in shared)
+                seen.add(id(value))
+                for part, part_value in chatbot_parts.items():
+                    parts[f"chatbot.{part}"] = deep_sizeof(part_value, seen)
+            else:
+                parts[name] = deep_sizeof(value, seen)
+        return parts
+
+    def report(self, limit=10):
+        """The ``limit`` largest sessions, biggest first"""
+        rows = []
+        for handle in self.sessions():
+            # A fresh set per session, so each one is charged for everything it holds
+            parts = self.footprint(handle)
+            rows.append({
+                "session": handle.id,
+                "owner": handle.owner,
+                "idle_seconds": time.time() - handle.last_seen,
+                "parts": parts,
+                "total": sum(parts.values()),
+            })
+        rows.sort(key=lambda row: row["total"], reverse=True)
+        total = sum(row["total"] for row in rows)
+        self.metrics.set_gauge("sessions_active", len(rows))
+        self.metrics.set_gauge("session_memory_bytes", total, stat="total")
+        self.metrics.set_gauge("session_memory_bytes", rows[0]["total"] if rows else 0, stat="max")
+        self.metrics.set_gauge("process_rss_bytes", process_rss())
+        return rows[:limit]
+
+    def orphaned_chatbots(self):
+        """Live PapuyChatbot instances no session holds: usually a leak"""
+        from chatbot import PapuyChatbot
+        held = {id(handle.parts.get("chatbot")) for handle in self.sessions()}
+        gc.collect()
+        return sum(1 for obj in gc.get_objects() if isinstance(obj, PapuyChatbot) and id(obj) not in held)
+
+    def cache_report(self):
+        """Shared-state bytes by key namespace, largest first; None when the backend is out of process"""
+        if not isinstance(self.backend, InProcessBackend):
+            return None
+        sizes = Counter()
+        for key, value in self.backend.items():
+            parts = key.split(":")
+            namespace = ":".join(parts[:2]) if parts[0] == "cache" else parts[0]
+            sizes[namespace] += sys.getsizeof(key) + deep_sizeof(value)
+        return sizes.most_common()
+
+    def set_baseline(self):
+        """Remember the current allocations; later reports show growth since then"""
+        if tracemalloc.is_tracing():
+            self._baseline = tracemalloc.take_snapshot()
+
+    def top_allocations(self, limit=15):
+        """Top allocation sites as dicts (size, count and, after set_baseline, growth); [] when not tracing"""
+        if not tracemalloc.is_tracing():
+            return []
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ])
+        if self._baseline is not None:
+            stats = snapshot.compare_to(self._baseline, "lineno")
+        else:
+            stats = snapshot.statistics("lineno")
+        return [
+            {
+                "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                "size": stat.size,
+                "size_diff": getattr(stat, "size_diff", None),
+                "count": stat.count,
+            }
+            for stat in stats[:limit]
+        ]
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_session_tracker():
+    """Process-wide tracker; starts tracemalloc when PAPUY_TRACEMALLOC_FRAMES is set"""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            frames = get_int_setting("PAPUY_TRACEMALLOC_FRAMES", 0)
+            if frames > 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            _tracker = SessionTracker()
+        return _tracker
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
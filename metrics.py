@@ -0,0 +1,67 @@
+import threading
+from collections import deque
+
+
+class Metrics:
+    """In-process counters, gauges and latency summaries, keyed by name and labels"""
+
+    def __init__(self, window=500):
+        self.window = window
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._summaries = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def incr(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = {"count": 0, "sum": 0.0, "recent": deque(maxlen=self.window)}
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["recent"].append(value)
+
+    def snapshot(self):
+        """Rows of {metric, labels, type, value}; summaries add count, p50 and p90"""
+        rows = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                rows.append({"metric": name, "labels": dict(labels), "type": "counter", "value": value})
+            for (name, labels), value in sorted(self._gauges.items()):
+                rows.append({"metric": name, "labels": dict(labels), "type": "gauge", "value": value})
+            for (name, labels), summary in sorted(self._summaries.items()):
+                recent = sorted(summary["recent"])
+                rows.append({
+                    "metric": name, "labels": dict(labels), "type": "summary",
+                    "value": summary["sum"] / summary["count"],
+                    "count": summary["count"],
+                    "p50": recent[len(recent) // 2],
+                    "p90": recent[min(int(0.9 * len(recent)), len(recent) - 1)],
+                })
+        return rows
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+        return _metrics
@@ -0,0 +1,110 @@
+import re
+from collections import OrderedDict
+from urllib.parse import urlparse, urlencode, parse_qsl
+
+DOI_RE = re.compile(r"\b(10\.\d{4,9}/[^\s\"<>()\[\]]+)", re.IGNORECASE)
+PMID_URL_RE = re.compile(r"(?:pubmed\.ncbi\.nlm\.nih\.gov/|ncbi\.nlm\.nih\.gov/pubmed/)(\d+)")
+PMID_RE = re.compile(r"^\s*(?:pmid:?\s*)?(\d{1,9})\s*$", re.IGNORECASE)
+TRACKING_PARAMS = re.compile(r"^(?:utm_\w+|fbclid|gclid|ref|source)$", re.IGNORECASE)
+
+
+def canonical_url(url):
+    """Normalize a URL so trivially different links to the same page compare equal"""
+    parsed = urlparse(url.strip())
+    if not parsed.netloc:
+        return None
+    host = parsed.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    query = urlencode(sorted((key, value) for key, value in parse_qsl(parsed.query) if not TRACKING_PARAMS.match(key)))
+    path = parsed.path.rstrip("/") or "/"
+    return f"{host}{path}" + (f"?{query}" if query else "")
+
+
+def extract_doi(text):
+    match = DOI_RE.search(text or "")
+    return match.group(1).rstrip(".,;").lower() if match else None
+
+
+def extract_pmid(text):
+    text = text or ""
+    match = PMID_URL_RE.search(text) or PMID_RE.match(text)
+    return match.group(1) if match else None
+
+
+def paper_keys(paper):
+    keys = []
+    for url in (paper.get('url'), paper.get('pdf_link')):
+        canonical = canonical_url(url) if url else None
+        if canonical:
+            keys.append(f"url:{canonical}")
+    doi = paper.get('doi') or extract_doi(paper.get('url'))
+    if doi:
+        keys.append(f"doi:{doi.lower()}")
+    pmid = paper.get('pmid') or extract_pmid(paper.get('url'))
+    if pmid:
+        keys.append(f"pmid:{pmid}")
+    return keys
+
+
+def query_keys(text):
+    keys = []
+    canonical = canonical_url(text)
+    if canonical:
+        keys.append(f"url:{canonical}")
+    doi = extract_doi(text)
+    if doi:
+        keys.append(f"doi:{doi}")
+    pmid = extract_pmid(text)
+    if pmid:
+        keys.append(f"pmid:{pmid}")
+    return keys
+
+
+class PaperIndex:
+    """Papers seen in a session, keyed by canonical URL, DOI and PMID (LRU-bounded)"""
+
+    def __init__(self, max_papers=500):
+        self.max_papers = max_papers
+        self._papers = OrderedDict()  # id(paper) -> paper
+        self._keys = {}  # key -> id(paper)
+
+    def __len__(self):
+        return len(self._papers)
+
+    def add(self, paper):
+        existing = None
+        for key in paper_keys(paper):
+            if key in self._keys:
+                existing = self._papers[self._keys[key]]
+                break
+        if existing is not None:
+            # Keep the richest record: fill fields the earlier result lacked (e.g. pdf_link)
+            for field, value in paper.items():
+                if value and not existing.get(field):
+                    existing[field] = value
+            paper = existing
+        paper_id = id(paper)
+        self._papers[paper_id] = paper
+        self._papers.move_to_end(paper_id)
+        for key in paper_keys(paper):
+            self._keys[key] = paper_id
+        while len(self._papers) > self.max_papers:
+            evicted_id, evicted = self._papers.popitem(last=False)
+            for key in paper_keys(evicted):
+                if self._keys.get(key) == evicted_id:
+                    del self._keys[key]
+        return paper
+
+    def add_all(self, papers):
+        for paper in papers:
+            self.add(paper)
+
+    def lookup(self, text):
+        """Find a paper by URL, DOI or PMID mentioned in ``text``"""
+        for key in query_keys(text):
+            paper_id = self._keys.get(key)
+            if paper_id is not None:
+                self._papers.move_to_end(paper_id)
+                return self._papers[paper_id]
+        return None
@@ -0,0 +1,116 @@
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from cancellation import check_cancelled, result_or_cancel
+from settings import get_int_setting
+
+
+class PdfTooLarge(Exception):
+    pass
+
+
+def is_pdf_response(response):
+    return "pdf" in response.headers.get("Content-Type", "").lower()
+
+
+def save_pdf(response, max_bytes):
+    """Stream a PDF response to a temporary file; returns (path, sha256 hex digest)"""
+    length = response.headers.get("Content-Length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise PdfTooLarge(f"El PDF supera el límite de {max_bytes // (1024 * 1024)} MB")
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(suffix=".pdf", prefix="papuy-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                check_cancelled()
+                size += len(chunk)
+                # Content-Length can be missing or wrong, so the cap is enforced on the bytes read
+                if size > max_bytes:
+                    raise PdfTooLarge(f"El PDF supera el límite de {max_bytes // (1024 * 1024)} MB")
+                digest.update(chunk)
+                f.write(chunk)
+        with open(path, "rb") as f:
+            if not f.read(1024).lstrip().startswith(b"%PDF"):
+                raise ValueError("El enlace no devolvió un PDF")
+    except BaseException:
+        os.remove(path)
+        raise
+    finally:
+        response.close()
+    return path, digest.hexdigest()
+
+
+def _count_pages(path):
+    from pypdf import PdfReader
+    return len(PdfReader(path).pages)
+
+
+def _extract_pages(path, start, end):
+    # Runs in a worker process: each one opens the file itself, nothing large is pickled
+    from pypdf import PdfReader
+    reader = PdfReader(path)
+    pages = []
+    for page in reader.pages[start:end]:
+        try:
+            pages.append(page.extract_text() or "")
+        except Exception:
+            pages.append("")  # One malformed page should not lose the whole paper
+    return pages
+
+
+class PdfExtractor:
+    """Extracts PDF text page ranges in worker processes, off the server's GIL"""
+
+    def __init__(self, max_workers=2, pages_per_task=8, timeout=120):
+        self.max_workers = max_workers
+        self.pages_per_task = pages_per_task
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a process that runs Streamlit's threads is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def extract(self, path):
+        pool = self._pool()
+        page_count = result_or_cancel(pool.submit(_count_pages, path), timeout=self.timeout)
+        futures = [
+            pool.submit(_extract_pages, path, start, min(start + self.pages_per_task, page_count))
+            for start in range(0, page_count, self.pages_per_task)
+        ]
+        try:
+            pages = [page for future in futures for page in result_or_cancel(future, timeout=self.timeout)]
+        finally:
+            # Queued page ranges of an abandoned or failed extraction never start
+            for future in futures:
+                future.cancel()
+        return "\n\n".join(page.strip() for page in pages if page.strip())
+
+
+_extractor = None
+_extractor_lock = threading.Lock()
+
+
+def get_pdf_extractor():
+    """Process-wide extractor, so all sessions share one bounded worker pool"""
+    global _extractor
+    with _extractor_lock:
+        if _extractor is None:
+            _extractor = PdfExtractor(
+                max_workers=get_int_setting("PAPUY_PDF_WORKERS", 2),
+                pages_per_task=get_int_setting("PAPUY_PDF_PAGES_PER_TASK", 8),
+                timeout=get_int_setting("PAPUY_PDF_TIMEOUT", 120)
+            )
+        return _extractor
+
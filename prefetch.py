@@ -0,0 +1,78 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from settings import get_int_setting
+
+
+class Prefetcher:
+    """Low-priority background pool for speculative work
+
+    Tasks yield to user requests: a task starts only once no ``foreground``
+    request is running. At most ``max_workers`` tasks run at once, tasks are
+    deduplicated by key, and they are dropped when ``max_queue`` are pending or
+    when no idle moment came within ``max_defer`` seconds of submission (the
+    user has moved on by then). The cache warmer yields the same way.
+    """
+
+    def __init__(self, max_workers=2, max_queue=32, max_defer=60):
+        self.max_queue = max_queue
+        self.max_defer = max_defer
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="papuy-prefetch")
+        self._condition = threading.Condition()
+        self._foreground = 0
+        self._pending = set()
+
+    @contextmanager
+    def foreground(self):
+        """Mark a user-facing request as running; prefetch tasks yield until it ends"""
+        with self._condition:
+            self._foreground += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._foreground -= 1
+                self._condition.notify_all()
+
+    def wait_for_idle(self, timeout=None):
+        """Block until no foreground request is running; returns False if ``timeout`` passed first"""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._foreground, timeout)
+
+    def submit(self, key, task):
+        with self._condition:
+            if key in self._pending or len(self._pending) >= self.max_queue:
+                return False
+            self._pending.add(key)
+        self._executor.submit(self._run, key, task, time.monotonic())
+        return True
+
+    def _run(self, key, task, submitted_at):
+        try:
+            remaining = self.max_defer - (time.monotonic() - submitted_at)
+            if remaining <= 0 or not self.wait_for_idle(timeout=remaining):
+                return
+            task()
+        except Exception:
+            # Speculative work: a failure just means the follow-up request fetches cold
+            pass
+        finally:
+            with self._condition:
+                self._pending.discard(key)
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher():
+    """Process-wide prefetcher, so the worker count is bounded across all sessions"""
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = Prefetcher(
+                max_workers=get_int_setting("PAPUY_PREFETCH_WORKERS", 2),
+                max_queue=get_int_setting("PAPUY_PREFETCH_QUEUE", 32)
+            )
+        return _prefetcher
@@ -0,0 +1,168 @@
+import re
+from langchain_core.messages import AIMessage
+from metrics import get_metrics
+from section_segmenter import SegmentedArticle, Section
+from summarizer import estimate_tokens
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_WHITESPACE = re.compile(r"\s+")
+# Numeric reference markers: [12], [3, 4], [5–9]
+_CITATION_MARKER = re.compile(r"\s*\[\d+(?:\s*[,–-]\s*\d+)*\]")
+# Sentences from publisher pages and PDFs that say nothing about the study
+_BOILERPLATE_SENTENCE = re.compile(
+    r"(?:©|\(c\)\s*\d{4}|copyright\b|all rights reserved|open access article|creative commons|licensee\b"
+    r"|published by (?:elsevier|springer|wiley)|cookies?\b|download (?:pdf|citation)|view (?:article|pdf)"
+    r"|sign in|subscribe|share this article|article metrics|google scholar|crossref)",
+    re.IGNORECASE
+)
+# Declaration paragraphs, dropped whole when short
+_DECLARATION = re.compile(
+    r"^\s*(?:conflicts? of interest|competing interests?|declaration of interest|funding|financiación"
+    r"|acknowledge?ments?|agradecimientos|author contributions?|contribuciones de los autores"
+    r"|data availability|ethics (?:approval|statement)|conflicto de intereses)\b",
+    re.IGNORECASE
+)
+MAX_DECLARATION_WORDS = 120
+MIN_DEDUPE_CHARS = 30
+
+
+def _sentence_key(sentence):
+    return _WHITESPACE.sub(" ", sentence).strip().lower()
+
+
+def truncate_tokens(text, budget):
+    """Keep whole sentences while they fit ``budget`` tokens (a lone oversized sentence is cut)"""
+    if not budget or estimate_tokens(text) <= budget:
+        return text
+    kept, size = [], 0
+    for sentence in _SENTENCE_END.split(text):
+        sentence_tokens = estimate_tokens(sentence)
+        if size + sentence_tokens > budget:
+            if not kept:
+                kept.append(sentence[:budget * 4])
+            break
+        kept.append(sentence)
+        size += sentence_tokens
+    return " ".join(kept) + " […]"
+
+
+def clean_text(text, seen=None):
+    """Drop boilerplate, reference markers and sentences already in ``seen``, paragraph by paragraph"""
+    seen = set() if seen is None else seen
+    paragraphs = []
+    for paragraph in text.split("\n\n"):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if _DECLARATION.match(paragraph) and len(paragraph.split()) <= MAX_DECLARATION_WORDS:
+            continue
+        sentences = []
+        for sentence in _SENTENCE_END.split(_CITATION_MARKER.sub("", paragraph)):
+            if _BOILERPLATE_SENTENCE.search(sentence):
+                continue
+            key = _sentence_key(sentence)
+            if len(key) >= MIN_DEDUPE_CHARS:
+                # Pages often repeat the abstract or a highlights box verbatim
+                if key in seen:
+                    continue
+                seen.add(key)
+            sentences.append(sentence)
+        if sentences:
+            paragraphs.append(" ".join(sentences))
+    return "\n\n".join(paragraphs)
+
+
+class PromptCompactor:
+    """Shrinks what is sent to the LLM and counts the tokens it saves per stage
+
+    ``prompt_compaction_tokens_total{stage, kind=before|after}`` in the metrics
+    registry shows the saving of each stage.
+    """
+
+    def __init__(self, enabled=True, title_tokens=60, abstract_tokens=300, section_tokens=1500,
+                 history_tokens=1500, metrics=None):
+        self.enabled = enabled
+        self.title_tokens = title_tokens
+        self.abstract_tokens = abstract_tokens
+        self.section_tokens = section_tokens
+        self.history_tokens = history_tokens
+        self.metrics = metrics or get_metrics()
+
+    def _record(self, stage, before, after):
+        self.metrics.incr("prompt_compaction_tokens_total", before, stage=stage, kind="before")
+        self.metrics.incr("prompt_compaction_tokens_total", after, stage=stage, kind="after")
+
+    def compact_text(self, text, budget, stage, seen=None):
+        if not self.enabled or not text:
+            return text
+        compacted = truncate_tokens(clean_text(text, seen), budget)
+        self._record(stage, estimate_tokens(text), estimate_tokens(compacted))
+        return compacted
+
+    def paper_fields(self, paper, stage="justify"):
+        """(title, abstract) for a prompt: one language only, preferring the Spanish copy"""
+        title = paper.get('title_es') or paper['title']
+        abstract = paper.get('abstract_es') or paper['abstract']
+        if not self.enabled:
+            return title, abstract
+        return truncate_tokens(title, self.title_tokens), self.compact_text(abstract, self.abstract_tokens, stage)
+
+    def compact_article(self, article):
+        """Cleaned and per-section budgeted copy of a SegmentedArticle (references are already excluded)"""
+        if not self.enabled:
+            return article
+        seen = set()
+        parts, sections, length = [], [], 0
+        headings = {section.name: section.heading for section in article.sections}
+        for name, text in article.section_texts():
+            body = self.compact_text(text, self.section_tokens, "summary", seen)
+            if not body:
+                continue
+            if parts:
+                parts.append("\n\n")
+                length += 2
+            sections.append(Section(name, headings.get(name, name), length, length + len(body)))
+            parts.append(body)
+            length += len(body)
+        if not sections:
+            return SegmentedArticle(self.compact_text(article.text, self.section_tokens, "summary", seen))
+        return SegmentedArticle("".join(parts), sections)
+
+    def compact_search_turn(self, query, papers, response):
+        """Chat-history stand-in for a search response: the list of papers, not the whole page"""
+        if not self.enabled:
+            return response
+        lines = [f"Mostré a la usuaria estos artículos para la búsqueda \"{query}\":"]
+        for i, paper in enumerate(papers, 1):
+            title = truncate_tokens(paper.get('title_es') or paper['title'], self.title_tokens)
+            abstract = truncate_tokens(clean_text(paper.get('abstract_es') or paper['abstract']), self.abstract_tokens // 3)
+            first_author = (paper.get('authors') or ['Sin autor'])[0].split(',')[0]
+            lines.append(f"{i}. {title} ({first_author} et al., {paper['year']}) {paper['url']}")
+            lines.append(f"   {abstract}")
+        context = "\n".join(lines)
+        self._record("search_turn", estimate_tokens(response), estimate_tokens(context))
+        return context
+
+    def compact_turn(self, response):
+        """History stand-in for a long assistant turn, or None when it already fits the history budget"""
+        if not self.enabled or not self.history_tokens or estimate_tokens(response) <= self.history_tokens:
+            return None
+        content = truncate_tokens(response, self.history_tokens)
+        self._record("history", estimate_tokens(response), estimate_tokens(content))
+        return content
+
+    def compact_history(self, messages):
+        """Chat history with long assistant turns cut to the history budget
+
+        Runs on every chain call, so it records no metrics: turns are compacted
+        (and counted) once by ``compact_turn`` when recorded. This only catches
+        turns stored before that, still in a loaded history window.
+        """
+        if not self.enabled or not self.history_tokens:
+            return messages
+        compacted = []
+        for message in messages:
+            if isinstance(message, AIMessage) and estimate_tokens(message.content) > self.history_tokens:
+                message = AIMessage(content=truncate_tokens(message.content, self.history_tokens))
+            compacted.append(message)
+        return compacted
@@ -0,0 +1,396 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from cancellation import current_token
+from credentials import get_credential_pool
+from health import ProviderHealth
+from metrics import get_metrics
+from pubmed_mirror import get_pubmed_mirror
+from pubmed_parser import parse_efetch
+from settings import get_setting, get_int_setting, get_float_setting
+
+
+class Provider:
+    """A literature source. ``search`` returns untranslated paper dicts.
+
+    Paper dicts use the keys the chatbot already renders: title, authors,
+    year, url, abstract, source, and optionally cited_by, pdf_link, doi,
+    pmid, journal, volume, issue and pages.
+    """
+
+    name = None
+
+    def __init__(self, timeout=10):
+        self.timeout = timeout
+
+    def search(self, query, limit=3, language="en"):
+        raise NotImplementedError
+
+
+PROVIDERS = {}
+
+
+def register_provider(cls):
+    """Class decorator making a provider selectable by name in PAPUY_PROVIDERS"""
+    PROVIDERS[cls.name] = cls
+    return cls
+
+
+@register_provider
+class ScholarProvider(Provider):
+    name = "scholar"
+
+    def __init__(self, timeout=10):
+        super().__init__(timeout)
+        self.credentials = get_credential_pool("serpapi")
+        self.url = get_setting("SERPAPI_URL", "https://serpapi.com/search.json")
+
+    def search(self, query, limit=3, language="en"):
+        params = {
+            "engine": "google_scholar",
+            "q": query,
+            "num": limit,
+            "hl": language  # Set language parameter
+        }
+        response = self.credentials.call(
+            lambda key: requests.get(self.url, params={**params, "api_key": key}, timeout=self.timeout)
+        )
+        response.raise_for_status()
+        data = response.json()
+        # SerpAPI reports an empty result page as an error too; that is a successful search
+        if "error" in data and "hasn't returned any results" not in data["error"]:
+            raise RuntimeError(f"Error en la búsqueda de Google Scholar: {data['error']}")
+
+        papers = []
+        for result in data.get("organic_results", []):
+            papers.append({
+                'title': result.get('title', 'Sin título'),
+                'authors': [author.get('name', '') for author in result.get('publication_info', {}).get('authors', [])],
+                'year': result.get('publication_info', {}).get('summary', '').split('-')[-1].strip() if result.get('publication_info', {}).get('summary') else 'Sin año',
+                'url': result.get('link', 'URL no disponible'),
+                'abstract': result.get('snippet', 'Resumen no disponible'),
+                'source': 'Google Scholar',
+                'cited_by': result.get('inline_links', {}).get('cited_by', {}).get('total', 0),
+                'pdf_link': next((resource.get('link') for resource in result.get('resources', [])
+                                  if resource.get('file_format') == 'PDF'), None)
+            })
+        return papers
+
+
+@register_provider
+class PubMedProvider(Provider):
+    name = "pubmed"
+
+    def __init__(self, timeout=10):
+        super().__init__(timeout)
+        self.credentials = get_credential_pool("ncbi")
+        self.base_url = get_setting("NCBI_EUTILS_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils")
+
+    def _get(self, endpoint, params):
+        def send(key):
+            # Without any configured key NCBI still answers, at its lower anonymous rate
+            return requests.get(
+                f"{self.base_url}/{endpoint}", params={**params, "api_key": key} if key else params, timeout=self.timeout
+            )
+        return self.credentials.call(send)
+
+    def search(self, query, limit=3, language="en"):
+        params = {"db": "pubmed", "term": query, "retmode": "json", "retmax": str(limit)}
+        response = self._get("esearch.fcgi", params)
+        response.raise_for_status()
+        search_data = response.json()
+        if "esearchresult" not in search_data or not search_data["esearchresult"].get("idlist"):
+            return []
+
+        params = {"db": "pubmed", "id": ",".join(search_data["esearchresult"]["idlist"]), "retmode": "xml"}
+        response = self._get("efetch.fcgi", params)
+        response.raise_for_status()
+        return parse_efetch(response.content)
+
+
+@register_provider
+class PubMedMirrorProvider(Provider):
+    """PubMed searched in the local FTS5 mirror built by pubmed_mirror.py"""
+
+    name = "pubmed_local"
+
+    def search(self, query, limit=3, language="en"):
+        return get_pubmed_mirror().search(query, limit)
+
+
+@register_provider
+class EuropePMCProvider(Provider):
+    name = "europepmc"
+
+    def __init__(self, timeout=10):
+        super().__init__(timeout)
+        self.url = get_setting("EUROPEPMC_URL", "https://www.ebi.ac.uk/europepmc/webservices/rest/search")
+
+    def search(self, query, limit=3, language="en"):
+        params = {"query": query, "format": "json", "pageSize": limit, "resultType": "core"}
+        response = requests.get(self.url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        papers = []
+        for result in data.get("resultList", {}).get("result", []):
+            pmid = result.get("pmid")
+            doi = result.get("doi")
+            journal_info = result.get("journalInfo", {})
+            pdf_link = next((url.get("url") for url in result.get("fullTextUrlList", {}).get("fullTextUrl", [])
+                             if url.get("documentStyle") == "pdf" and url.get("availability") in ("Open access", "Free")), None)
+            papers.append({
+                'title': result.get('title', 'Sin título'),
+                'authors': [f"{author.get('lastName')}, {author.get('firstName')}" if author.get('lastName') and author.get('firstName') else author.get('fullName', '')
+                            for author in result.get("authorList", {}).get("author", [])],
+                'year': result.get('pubYear', 'Sin año'),
+                'url': f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/" if pmid else f"https://europepmc.org/article/{result.get('source')}/{result.get('id')}",
+                'abstract': result.get('abstractText', 'Resumen no disponible'),
+                'source': 'Europe PMC',
+                'cited_by': result.get('citedByCount', 0),
+                'pdf_link': pdf_link,
+                'doi': doi,
+                'pmid': pmid,
+                'journal': journal_info.get("journal", {}).get("title", ''),
+                'volume': journal_info.get("volume", ''),
+                'issue': journal_info.get("issue", ''),
+                'pages': result.get("pageInfo", '')
+            })
+        return papers
+
+
+@register_provider
+class CrossrefProvider(Provider):
+    name = "crossref"
+
+    def __init__(self, timeout=10):
+        super().__init__(timeout)
+        self.url = get_setting("CROSSREF_URL", "https://api.crossref.org/works")
+        # Crossref routes requests that identify a contact to its faster "polite" pool
+        self.mailto = get_setting("CROSSREF_MAILTO")
+
+    def search(self, query, limit=3, language="en"):
+        params = {"query": query, "rows": limit}
+        if self.mailto:
+            params["mailto"] = self.mailto
+        response = requests.get(self.url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        papers = []
+        for item in data.get("message", {}).get("items", []):
+            date_parts = (item.get("issued") or {}).get("date-parts") or [[None]]
+            doi = item.get("DOI")
+            papers.append({
+                'title': (item.get('title') or ['Sin título'])[0],
+                'authors': [f"{author.get('family')}, {author.get('given')}" if author.get('given') else author.get('family', '')
+                            for author in item.get("author", [])],
+                'year': str(date_parts[0][0]) if date_parts[0][0] else 'Sin año',
+                'url': f"https://doi.org/{doi}" if doi else item.get('URL', 'URL no disponible'),
+                # Crossref abstracts are JATS fragments; tags are harmless in the prompt and rendering
+                'abstract': item.get('abstract', 'Resumen no disponible'),
+                'source': 'Crossref',
+                'cited_by': item.get('is-referenced-by-count', 0),
+                'doi': doi,
+                'journal': (item.get('container-title') or [''])[0],
+                'volume': item.get('volume', ''),
+                'issue': item.get('issue', ''),
+                'pages': item.get('page', '')
+            })
+        return papers
+
+
+@register_provider
+class SemanticScholarProvider(Provider):
+    name = "semanticscholar"
+
+    FIELDS = "title,abstract,authors,year,externalIds,url,citationCount,openAccessPdf,venue,journal"
+
+    def __init__(self, timeout=10):
+        super().__init__(timeout)
+        self.url = get_setting("SEMANTIC_SCHOLAR_URL", "https://api.semanticscholar.org/graph/v1/paper/search")
+        self.credentials = get_credential_pool("semanticscholar")
+
+    def search(self, query, limit=3, language="en"):
+        params = {"query": query, "limit": limit, "fields": self.FIELDS}
+        response = self.credentials.call(lambda key: requests.get(
+            self.url, params=params, headers={"x-api-key": key} if key else {}, timeout=self.timeout
+        ))
+        response.raise_for_status()
+        data = response.json()
+        papers = []
+        for item in data.get("data", []):
+            external_ids = item.get("externalIds") or {}
+            journal = item.get("journal") or {}
+            papers.append({
+                'title': item.get('title') or 'Sin título',
+                'authors': [author.get('name', '') for author in item.get('authors', [])],
+                'year': str(item['year']) if item.get('year') else 'Sin año',
+                'url': item.get('url', 'URL no disponible'),
+                'abstract': item.get('abstract') or 'Resumen no disponible',
+                'source': 'Semantic Scholar',
+                'cited_by': item.get('citationCount', 0),
+                'pdf_link': (item.get('openAccessPdf') or {}).get('url'),
+                'doi': external_ids.get('DOI'),
+                'pmid': external_ids.get('PubMed'),
+                'journal': journal.get('name') or item.get('venue', ''),
+                'volume': journal.get('volume', ''),
+                'pages': (journal.get('pages') or '').strip()
+            })
+        return papers
+
+
+class SearchEngine:
+    """Queries the enabled providers in parallel with hedged requests
+
+    If a provider has not answered by its p90 latency, a duplicate request is
+    fired and whichever attempt finishes first wins. With ``first_k`` the
+    search returns as soon as that many papers have arrived. Providers whose
+    circuit breaker is open are skipped without waiting; once their cooldown
+    passes, the query is also sent to them in the background as a probe.
+    """
+
+    def __init__(self, providers, max_workers=16, hedge_min_delay=0.5, hedge_default_delay=3.0,
+                 min_samples=10, timeout=20.0, max_attempts=2, breaker_options=None, metrics=None):
+        self.providers = {provider.name: provider for provider in providers}
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_default_delay = hedge_default_delay
+        self.min_samples = min_samples
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.metrics = metrics or get_metrics()
+        self.health = {
+            name: ProviderHealth(name, metrics=self.metrics, **(breaker_options or {}))
+            for name in self.providers
+        }
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="papuy-search")
+
+    def hedge_delay(self, name):
+        health = self.health[name]
+        if health.successes() < self.min_samples:
+            return self.hedge_default_delay
+        return max(health.percentile(0.9), self.hedge_min_delay)
+
+    def _call(self, provider, query, limit, language):
+        started = time.monotonic()
+        try:
+            papers = provider.search(query, limit, language)
+        except Exception:
+            self.health[provider.name].record(False)
+            raise
+        self.health[provider.name].record(True, time.monotonic() - started)
+        return papers
+
+    def status(self):
+        return [health.status() for health in self.health.values()]
+
+    def search(self, query, language="en", limit=3, first_k=None, providers=None):
+        """Return (papers, errors) with papers in provider order; errors maps provider name to message"""
+        names = [name for name in (providers or self.providers) if name in self.providers]
+        token = current_token()
+        cancelled = [token.as_future()] if token is not None else []
+        started = time.monotonic()
+        deadline = started + self.timeout
+
+        results, errors = {}, {}
+        active = []
+        for name in names:
+            health = self.health[name]
+            if health.allow_request():
+                active.append(name)
+                continue
+            if health.try_probe():
+                self._executor.submit(self._call, self.providers[name], query, limit, language)
+            errors[name] = "Proveedor no disponible temporalmente"
+            self.metrics.incr("provider_skipped_total", provider=name)
+
+        pending = {}
+        attempts = {}
+        hedge_at = {}
+        for name in active:
+            future = self._executor.submit(self._call, self.providers[name], query, limit, language)
+            pending[future] = name
+            attempts[name] = 1
+            hedge_at[name] = started + self.hedge_delay(name)
+
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            next_event = min([deadline] + [at for name, at in hedge_at.items() if name not in results])
+            done, _ = wait(list(pending) + cancelled, timeout=max(next_event - now, 0), return_when=FIRST_COMPLETED)
+            if token is not None and token.cancelled:
+                for future in pending:
+                    future.cancel()
+                token.check()
+
+            for future in done:
+                name = pending.pop(future)
+                if name in results:
+                    continue  # Lost the hedge race
+                try:
+                    results[name] = future.result()
+                    errors.pop(name, None)
+                    hedge_at.pop(name, None)
+                except Exception as e:
+                    errors[name] = str(e)
+                    if name not in pending.values():
+                        hedge_at.pop(name, None)
+            # Stop waiting on the losing attempts; running ones finish in the background
+            for future, name in list(pending.items()):
+                if name in results:
+                    future.cancel()
+                    del pending[future]
+
+            if first_k and sum(len(papers) for papers in results.values()) >= first_k:
+                break
+
+            now = time.monotonic()
+            for name, at in list(hedge_at.items()):
+                if name in results or at > now:
+                    continue
+                if attempts[name] < self.max_attempts:
+                    future = self._executor.submit(self._call, self.providers[name], query, limit, language)
+                    pending[future] = name
+                    attempts[name] += 1
+                hedge_at.pop(name)
+
+        for name in names:
+            if name not in results and name not in errors:
+                errors[name] = "Tiempo de espera agotado"
+        papers = [paper for name in names for paper in results.get(name, [])]
+        return papers, errors
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def build_search_engine():
+    """A new engine with its own provider instances, configured from the settings"""
+    timeout = get_float_setting("PAPUY_PROVIDER_TIMEOUT", 10.0)
+    names = [name.strip() for name in get_setting("PAPUY_PROVIDERS", "scholar,pubmed").split(",") if name.strip()]
+    unknown = [name for name in names if name not in PROVIDERS]
+    if unknown:
+        raise ValueError(f"Proveedores desconocidos: {', '.join(unknown)}")
+    return SearchEngine(
+        [PROVIDERS[name](timeout=timeout) for name in names],
+        max_workers=get_int_setting("PAPUY_SEARCH_WORKERS", 16),
+        hedge_min_delay=get_float_setting("PAPUY_HEDGE_MIN_DELAY", 0.5),
+        hedge_default_delay=get_float_setting("PAPUY_HEDGE_DEFAULT_DELAY", 3.0),
+        timeout=get_float_setting("PAPUY_SEARCH_TIMEOUT", 20.0),
+        breaker_options={
+            "window_seconds": get_float_setting("PAPUY_BREAKER_WINDOW", 60.0),
+            "error_threshold": get_float_setting("PAPUY_BREAKER_ERROR_RATE", 0.5),
+            "max_consecutive_failures": get_int_setting("PAPUY_BREAKER_FAILURES", 3),
+            "cooldown": get_float_setting("PAPUY_BREAKER_COOLDOWN", 30.0),
+        }
+    )
+
+
+def get_search_engine():
+    """Process-wide engine, so latency statistics and breakers are shared by every session"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = build_search_engine()
+        return _engine
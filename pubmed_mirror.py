@@ -0,0 +1,167 @@
+"""Local PubMed mirror: SQLite FTS5 index built from the PubMed baseline/update XML dumps.
+
+Usage:
+    python pubmed_mirror.py ingest pubmed/baseline/*.xml.gz pubmed/updatefiles/*.xml.gz
+    python pubmed_mirror.py search "metformin gestational diabetes"
+
+Files are applied in name order and recorded, so re-running ingest over a
+directory only applies the new update files. Set PUBMED_MIRROR_PATH and add
+``pubmed_local`` to PAPUY_PROVIDERS to search the mirror instead of NCBI.
+"""
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+import xml.etree.ElementTree as ET
+import zlib
+from pubmed_parser import parse_pubmed_article
+from reranker import tokenize
+from settings import get_setting
+
+
+def iter_pubmed_xml(path):
+    """Stream ("upsert", paper) and ("delete", pmid) events from a baseline/update file"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        context = ET.iterparse(f, events=("start", "end"))
+        _, root = next(context)
+        for event, elem in context:
+            if event != "end":
+                continue
+            if elem.tag == "PubmedArticle":
+                yield "upsert", parse_pubmed_article(elem)
+                root.clear()  # Keep memory flat: drop every parsed article
+            elif elem.tag == "DeleteCitation":
+                for pmid in elem.iterfind("PMID"):
+                    yield "delete", pmid.text
+                root.clear()
+
+
+class PubMedMirror:
+    """Articles stored as zlib-compressed JSON, indexed by a contentless FTS5 table"""
+
+    def __init__(self, path="pubmed_mirror.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS articles (pmid INTEGER PRIMARY KEY, record BLOB NOT NULL);
+            CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5(
+                title, abstract, content='', tokenize='unicode61 remove_diacritics 2'
+            );
+            CREATE TABLE IF NOT EXISTS ingested_files (
+                name TEXT PRIMARY KEY, upserted INTEGER, deleted INTEGER, ingested_at REAL
+            );
+        """)
+        self._conn.commit()
+
+    def _remove(self, pmid):
+        row = self._conn.execute("SELECT record FROM articles WHERE pmid = ?", (pmid,)).fetchone()
+        if row is None:
+            return False
+        old = json.loads(zlib.decompress(row[0]))
+        # A contentless index can only forget a row given the exact values it indexed
+        self._conn.execute(
+            "INSERT INTO articles_fts (articles_fts, rowid, title, abstract) VALUES ('delete', ?, ?, ?)",
+            (pmid, old['title'], old['abstract'])
+        )
+        self._conn.execute("DELETE FROM articles WHERE pmid = ?", (pmid,))
+        return True
+
+    def ingest_file(self, path, force=False):
+        """Apply one baseline/update file; returns (upserted, deleted), or None if already applied"""
+        name = os.path.basename(path)
+        with self._lock:
+            if not force and self._conn.execute("SELECT 1 FROM ingested_files WHERE name = ?", (name,)).fetchone():
+                return None
+            upserted = deleted = 0
+            with self._conn:
+                for action, item in iter_pubmed_xml(path):
+                    if action == "delete":
+                        deleted += self._remove(int(item))
+                        continue
+                    pmid = int(item['pmid'])
+                    self._remove(pmid)
+                    record = zlib.compress(json.dumps(item, ensure_ascii=False, separators=(",", ":")).encode())
+                    self._conn.execute("INSERT INTO articles (pmid, record) VALUES (?, ?)", (pmid, record))
+                    self._conn.execute(
+                        "INSERT INTO articles_fts (rowid, title, abstract) VALUES (?, ?, ?)",
+                        (pmid, item['title'], item['abstract'])
+                    )
+                    upserted += 1
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO ingested_files (name, upserted, deleted, ingested_at) VALUES (?, ?, ?, ?)",
+                    (name, upserted, deleted, time.time())
+                )
+            return upserted, deleted
+
+    def optimize(self):
+        with self._lock:
+            self._conn.execute("INSERT INTO articles_fts (articles_fts) VALUES ('optimize')")
+            self._conn.commit()
+
+    def _match(self, terms, operator, limit):
+        expression = f" {operator} ".join(f'"{term}"' for term in terms)
+        # Title matches weigh more than abstract matches
+        return self._conn.execute(
+            "SELECT articles.record FROM articles_fts JOIN articles ON articles.pmid = articles_fts.rowid "
+            "WHERE articles_fts MATCH ? ORDER BY bm25(articles_fts, 5.0, 1.0) LIMIT ?",
+            (expression, limit)
+        ).fetchall()
+
+    def search(self, query, limit=3):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        with self._lock:
+            rows = self._match(terms, "AND", limit)
+            if not rows and len(terms) > 1:
+                rows = self._match(terms, "OR", limit)
+        return [json.loads(zlib.decompress(record)) for record, in rows]
+
+
+_mirror = None
+_mirror_lock = threading.Lock()
+
+
+def get_pubmed_mirror():
+    global _mirror
+    with _mirror_lock:
+        if _mirror is None:
+            _mirror = PubMedMirror(get_setting("PUBMED_MIRROR_PATH", "pubmed_mirror.db"))
+        return _mirror
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Réplica local de PubMed a partir de los archivos baseline/update.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ingest = subparsers.add_parser("ingest", help="Carga archivos XML (.xml o .xml.gz) de PubMed")
+    ingest.add_argument("files", nargs="+")
+    ingest.add_argument("--force", action="store_true", help="Vuelve a aplicar archivos ya cargados")
+    search = subparsers.add_parser("search", help="Busca en la réplica local")
+    search.add_argument("query")
+    search.add_argument("--limit", type=int, default=5)
+    args = parser.parse_args()
+
+    mirror = get_pubmed_mirror()
+    if args.command == "ingest":
+        # Baseline and update files are numbered, so name order is application order
+        for path in sorted(args.files, key=os.path.basename):
+            started = time.monotonic()
+            result = mirror.ingest_file(path, force=args.force)
+            if result is None:
+                print(f"{os.path.basename(path)}: ya aplicado")
+            else:
+                print(f"{os.path.basename(path)}: {result[0]} artículos, {result[1]} eliminados ({time.monotonic() - started:.1f}s)")
+        mirror.optimize()
+    else:
+        for paper in mirror.search(args.query, args.limit):
+            print(f"{paper['pmid']}  {paper['year']}  {paper['title']}")
+
+
+if __name__ == "__main__":
+    main()
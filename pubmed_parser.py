@@ -0,0 +1,236 @@
+"""PubMed XML parsing: one walk over each <PubmedArticle> fills the full citation record.
+
+Usage:
+    python pubmed_parser.py bench --articles 2000 --repeat 5
+    python pubmed_parser.py bench --file efetch.xml
+
+The benchmark compares the parser with the previous per-field XPath lookups
+on a synthetic efetch payload (or a saved one) and reports field coverage.
+"""
+import argparse
+import random
+import time
+import xml.etree.ElementTree as ET
+
+
+def _text(elem):
+    # itertext keeps the words inside inline markup such as <i> or <sup>
+    return "".join(elem.itertext()).strip() if elem is not None else ""
+
+
+def _parse_journal(journal, record):
+    for child in journal:
+        if child.tag == "Title":
+            record['journal'] = child.text
+        elif child.tag == "ISOAbbreviation":
+            record['journal_abbreviation'] = child.text
+        elif child.tag == "JournalIssue":
+            for field in child:
+                if field.tag == "Volume":
+                    record['volume'] = field.text
+                elif field.tag == "Issue":
+                    record['issue'] = field.text
+                elif field.tag == "PubDate":
+                    for part in field:
+                        if part.tag == "Year":
+                            record['year'] = part.text
+                        elif part.tag == "MedlineDate" and record['year'] is None:
+                            record['year'] = (part.text or "")[:4] or None
+
+
+def _parse_authors(author_list):
+    authors = []
+    for author in author_list:
+        last_name = fore_name = collective = None
+        for field in author:
+            if field.tag == "LastName":
+                last_name = field.text
+            elif field.tag == "ForeName":
+                fore_name = field.text
+            elif field.tag == "CollectiveName":
+                collective = _text(field)
+        if last_name and fore_name:
+            authors.append(f"{last_name}, {fore_name}")
+        elif collective:
+            authors.append(collective)
+    return authors
+
+
+def _parse_article_info(info, record):
+    article_date_year = start_page = end_page = None
+    for child in info:
+        tag = child.tag
+        if tag == "Journal":
+            _parse_journal(child, record)
+        elif tag == "ArticleTitle":
+            record['title'] = _text(child)
+        elif tag == "Pagination":
+            for field in child:
+                if field.tag == "MedlinePgn":
+                    record['pages'] = field.text
+                elif field.tag == "StartPage":
+                    start_page = field.text
+                elif field.tag == "EndPage":
+                    end_page = field.text
+        elif tag == "ELocationID":
+            if child.get("EIdType") == "doi" and not record['doi']:
+                record['doi'] = _text(child)
+        elif tag == "Abstract":
+            # Structured abstracts keep every labelled section, not just the first
+            sections = []
+            for part in child:
+                if part.tag == "AbstractText":
+                    label = part.get("Label")
+                    sections.append(f"{label}: {_text(part)}" if label else _text(part))
+            record['abstract'] = "\n".join(section for section in sections if section)
+        elif tag == "AuthorList":
+            record['authors'] = _parse_authors(child)
+        elif tag == "ArticleDate":
+            article_date_year = child.findtext("Year")
+    if record['year'] is None:
+        record['year'] = article_date_year
+    if not record['pages'] and start_page:
+        record['pages'] = f"{start_page}-{end_page}" if end_page else start_page
+
+
+def parse_pubmed_article(article):
+    """Paper dict from a <PubmedArticle> element, in the provider output format"""
+    record = {
+        'title': None, 'authors': [], 'year': None, 'abstract': None, 'source': 'PubMed',
+        'pmid': None, 'doi': None, 'pmcid': None, 'journal': None, 'journal_abbreviation': None,
+        'volume': None, 'issue': None, 'pages': None, 'mesh_terms': []
+    }
+    for section in article:
+        if section.tag == "MedlineCitation":
+            for child in section:
+                if child.tag == "PMID":
+                    record['pmid'] = child.text
+                elif child.tag == "Article":
+                    _parse_article_info(child, record)
+                elif child.tag == "MeshHeadingList":
+                    record['mesh_terms'] = [
+                        descriptor.text for heading in child for descriptor in heading
+                        if descriptor.tag == "DescriptorName"
+                    ]
+        elif section.tag == "PubmedData":
+            for child in section:
+                if child.tag != "ArticleIdList":
+                    continue
+                for article_id in child:
+                    id_type = article_id.get("IdType")
+                    if id_type == "doi" and not record['doi']:
+                        record['doi'] = (article_id.text or "").strip() or None
+                    elif id_type == "pmc":
+                        record['pmcid'] = article_id.text
+    record['title'] = record['title'] or 'Sin título'
+    record['year'] = record['year'] or 'Sin año'
+    record['abstract'] = record['abstract'] or 'Resumen no disponible'
+    record['url'] = f"https://pubmed.ncbi.nlm.nih.gov/{record['pmid']}/"
+    return record
+
+
+def parse_efetch(content):
+    """Papers from an efetch ``retmode=xml`` response body"""
+    return [parse_pubmed_article(article) for article in ET.fromstring(content).iter("PubmedArticle")]
+
+
+def _legacy_parse(content):
+    # The per-field XPath lookups the provider used before, kept for the benchmark
+    papers = []
+    for article in ET.fromstring(content).findall(".//PubmedArticle"):
+        title = article.find(".//ArticleTitle")
+        authors = article.findall(".//Author")
+        year = article.find(".//PubDate/Year")
+        abstract = article.find(".//Abstract/AbstractText")
+        pmid = article.find('.//PMID').text
+        papers.append({
+            'title': title.text if title is not None else 'Sin título',
+            'authors': [f"{author.find('LastName').text}, {author.find('ForeName').text}"
+                        for author in authors if author.find('LastName') is not None and author.find('ForeName') is not None],
+            'year': year.text if year is not None else 'Sin año',
+            'url': f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/",
+            'abstract': abstract.text if abstract is not None else 'Resumen no disponible',
+            'source': 'PubMed',
+            'pmid': pmid
+        })
+    return papers
+
+
+def build_sample_payload(articles, seed=0):
+    """Synthetic efetch XML shaped like real records (structured abstracts, MeSH, many authors)"""
+    rng = random.Random(seed)
+    words = "patients trial cohort outcome risk therapy diabetes insulin cardiac mortality dose placebo".split()
+    parts = ["<?xml version='1.0' encoding='UTF-8'?><PubmedArticleSet>"]
+    for index in range(articles):
+        pmid = 30000000 + index
+        sentence = lambda count: " ".join(rng.choice(words) for _ in range(count))
+        authors = "".join(
+            f"<Author ValidYN='Y'><LastName>Author{a}</LastName><ForeName>Name</ForeName><Initials>N</Initials>"
+            f"<AffiliationInfo><Affiliation>{sentence(12)}</Affiliation></AffiliationInfo></Author>"
+            for a in range(rng.randint(3, 12))
+        )
+        sections = "".join(
+            f"<AbstractText Label='{label}' NlmCategory='{label}'>{sentence(40)}</AbstractText>"
+            for label in ("BACKGROUND", "METHODS", "RESULTS", "CONCLUSIONS")
+        )
+        mesh = "".join(
+            f"<MeshHeading><DescriptorName UI='D{m:06d}' MajorTopicYN='N'>{sentence(2)}</DescriptorName>"
+            f"<QualifierName UI='Q000000' MajorTopicYN='N'>therapy</QualifierName></MeshHeading>"
+            for m in range(rng.randint(5, 15))
+        )
+        parts.append(
+            f"<PubmedArticle><MedlineCitation Status='MEDLINE' Owner='NLM'><PMID Version='1'>{pmid}</PMID>"
+            f"<DateCompleted><Year>2021</Year><Month>01</Month><Day>02</Day></DateCompleted>"
+            f"<Article PubModel='Print'><Journal><ISSN IssnType='Print'>0000-0000</ISSN>"
+            f"<JournalIssue CitedMedium='Print'><Volume>{rng.randint(1, 400)}</Volume><Issue>{rng.randint(1, 12)}</Issue>"
+            f"<PubDate><Year>{rng.randint(1990, 2024)}</Year><Month>Jan</Month></PubDate></JournalIssue>"
+            f"<Title>Journal of {sentence(2)}</Title><ISOAbbreviation>J {sentence(1)}</ISOAbbreviation></Journal>"
+            f"<ArticleTitle>{sentence(14)}</ArticleTitle><Pagination><MedlinePgn>{index}-{index + 9}</MedlinePgn></Pagination>"
+            f"<ELocationID EIdType='doi' ValidYN='Y'>10.1000/test.{pmid}</ELocationID>"
+            f"<Abstract>{sections}<CopyrightInformation>(c) 2021</CopyrightInformation></Abstract>"
+            f"<AuthorList CompleteYN='Y'>{authors}</AuthorList><Language>eng</Language></Article>"
+            f"<MeshHeadingList>{mesh}</MeshHeadingList></MedlineCitation>"
+            f"<PubmedData><ArticleIdList><ArticleId IdType='pubmed'>{pmid}</ArticleId>"
+            f"<ArticleId IdType='doi'>10.1000/test.{pmid}</ArticleId><ArticleId IdType='pmc'>PMC{pmid}</ArticleId>"
+            f"</ArticleIdList></PubmedData></PubmedArticle>"
+        )
+    parts.append("</PubmedArticleSet>")
+    return "".join(parts).encode()
+
+
+def _time(parse, content, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        papers = parse(content)
+        best = min(best, time.perf_counter() - started)
+    return best, papers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Herramientas del parser de PubMed.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser("bench", help="Compara el parser con la versión anterior")
+    bench.add_argument("--file", help="Respuesta efetch guardada (XML); por defecto se genera una sintética")
+    bench.add_argument("--articles", type=int, default=2000, help="Artículos de la respuesta sintética")
+    bench.add_argument("--repeat", type=int, default=5, help="Repeticiones (se reporta la mejor)")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, "rb") as f:
+            content = f.read()
+    else:
+        content = build_sample_payload(args.articles)
+    print(f"Respuesta: {len(content) / (1024 * 1024):.1f} MB")
+    fields = ("journal", "volume", "issue", "pages", "doi", "pmcid", "mesh_terms")
+    for name, parse in (("anterior", _legacy_parse), ("nuevo", parse_efetch)):
+        seconds, papers = _time(parse, content, args.repeat)
+        per_article = seconds / max(len(papers), 1) * 1e6
+        coverage = ", ".join(f"{field} {sum(1 for paper in papers if paper.get(field))}" for field in fields)
+        abstract_chars = sum(len(paper['abstract']) for paper in papers) // max(len(papers), 1)
+        print(f"{name:>8}: {seconds * 1000:.0f} ms ({per_article:.0f} µs/artículo), "
+              f"resumen medio {abstract_chars} caracteres; {coverage}")
+
+
+if __name__ == "__main__":
+    main()
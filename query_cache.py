@@ -0,0 +1,286 @@
+import hashlib
+import inspect
+import json
+import re
+import time
+from collections import Counter, namedtuple
+from datetime import date, timedelta
+import numpy as np
+from reranker import STOPWORDS, fold_accents
+from paper_index import canonical_url
+from shared_state import cache_key, get_state_backend, get_json, set_json
+
+CacheHit = namedtuple("CacheHit", ["query", "score", "papers", "response"])
+
+NUM_PERMUTATIONS = 64
+_PRIME = 4294967311  # smallest prime above 2**32
+_rng = np.random.default_rng(20240501)
+# a < 2**31 keeps a * hash + b inside uint64
+_PERM_A = _rng.integers(1, 2 ** 31, NUM_PERMUTATIONS, dtype=np.uint64)
+_PERM_B = _rng.integers(0, 2 ** 32, NUM_PERMUTATIONS, dtype=np.uint64)
+
+_TOKEN_RE = re.compile(r"\w+")
+# Words that change the phrasing of a search but not what is searched
+QUERY_STOPWORDS = STOPWORDS | {"articulos", "articulo", "papers", "estudios", "buscar", "sobre", "acerca", "english"}
+# Words that make a search broader or more recent without changing its subject: two
+# queries may differ in these and still share results, but never in any other word
+# ("... en niños" and "... en adultos mayores" need different papers)
+QUERY_FILLERS = {
+    "evidencia", "evidence", "reciente", "recent", "actual", "actualizado", "actualizacion", "update",
+    "informacion", "information", "investigacion", "research", "literatura", "literature", "revision", "review",
+    "cientifico", "cientifica", "scientific", "publicado", "publicada", "published", "ultimo", "ultima", "latest",
+}
+_VOWELS = "aeiou"
+# Singular nouns ending in -s that are not plurals: virus, sepsis, diagnosis, stress
+_SINGULAR_S_ENDINGS = ("us", "is", "ss")
+
+
+def _fold_once(token):
+    if len(token) <= 4:
+        return token
+    if token.endswith("ies"):
+        return token[:-3] + "y"  # therapies -> therapy
+    if token.endswith("s") and not token.endswith(_SINGULAR_S_ENDINGS):
+        return token[:-1]
+    # A final -e after a consonant comes and goes with the plural: paciente(s), enfermedad(es), disease(s)
+    if token.endswith("e") and token[-2] not in _VOWELS:
+        return token[:-1]
+    return token
+
+
+def fold_inflection(token):
+    """Shared form of a word's Spanish/English singular and plural; stems are kept whole
+
+    Only inflection is folded: prefix stemming would merge unrelated clinical
+    terms (anticoagulantes/anticonceptivos, hipertensión/hipertrofia). Rules are
+    applied until nothing changes, so a folded word folds to itself
+    (viruses -> viruse -> virus, and virus stays virus).
+    """
+    folded = _fold_once(token)
+    while folded != token:
+        token, folded = folded, _fold_once(folded)
+    return token
+
+
+def normalize_query(query):
+    """Accent-folded, stopword-free, inflection-folded token set of a search query"""
+    tokens = set()
+    for token in _TOKEN_RE.findall(fold_accents(query.lower())):
+        if token in QUERY_STOPWORDS or (len(token) < 2 and not token.isdigit()):
+            continue
+        tokens.add(fold_inflection(token))
+    return tokens
+
+
+_FOLDED_FILLERS = {fold_inflection(word) for word in QUERY_FILLERS}
+
+
+def minhash(tokens):
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(token.encode(), digest_size=4).digest(), "big") for token in tokens] or [0],
+        dtype=np.uint64
+    )
+    return ((_PERM_A[:, None] * hashes[None, :] + _PERM_B[:, None]) % _PRIME).min(axis=1)
+
+
+class QueryCache:
+    """Reuse assembled search results for near-duplicate queries
+
+    Entries are matched by MinHash over normalized query tokens, then confirmed
+    with the exact Jaccard similarity, which is reported as the match score.
+    The tokens two queries do not share must all be ``QUERY_FILLERS``: a single
+    differing clinical term (a population, a drug) is a different search.
+    Results fetched in English (with translations) also answer Spanish searches.
+    Entries built by another ``version`` of the pipeline are never returned.
+    """
+
+    INDEX_KEY = "query-cache:index"
+
+    def __init__(self, backend=None, threshold=0.8, ttl=86400, max_entries=1000, version=""):
+        self.backend = backend or get_state_backend()
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version = version
+
+    def _entry_key(self, tokens, language):
+        digest = hashlib.sha256(" ".join(sorted(tokens)).encode()).hexdigest()
+        return f"query-cache:entry:{self.version}:{language}:{digest}"
+
+    def _matches(self, tokens, candidate_tokens):
+        """Jaccard score of two token sets, or None if they differ in more than filler words"""
+        if not (tokens ^ candidate_tokens) <= _FOLDED_FILLERS:
+            return None
+        score = len(tokens & candidate_tokens) / len(tokens | candidate_tokens)
+        return score if score >= self.threshold else None
+
+    def lookup(self, query, language):
+        """The best cached hit for ``query``, or None; a shared-state outage counts as a miss"""
+        try:
+            return self._lookup(query, language)
+        except Exception:
+            return None  # A cache outage must never break the request path
+
+    def _lookup(self, query, language):
+        tokens = normalize_query(query)
+        if not tokens:
+            return None
+        languages = ["en"] if language == "en" else [language, "en"]
+
+        # Exact normalized match first: a single key read
+        for candidate_language in languages:
+            entry = get_json(self._entry_key(tokens, candidate_language), self.backend)
+            if entry:
+                return CacheHit(entry["query"], 1.0, entry["papers"], entry["response"])
+
+        index = [json.loads(item) for item in self.backend.lrange(self.INDEX_KEY, -self.max_entries, -1)]
+        index = [
+            item for item in index
+            if item["language"] in languages and item["expires_at"] > time.time() and item.get("version", "") == self.version
+        ]
+        if not index:
+            return None
+        signatures = np.array([item["signature"] for item in index], dtype=np.uint64)
+        estimates = (signatures == minhash(tokens)[None, :]).mean(axis=1)
+
+        best = None
+        # MinHash is an estimate; confirm candidates near the threshold with the exact Jaccard
+        for position in np.argsort(-estimates):
+            if estimates[position] < self.threshold - 0.15:
+                break
+            score = self._matches(tokens, set(index[position]["tokens"]))
+            if score is not None and (best is None or score > best[0]):
+                best = (score, index[position])
+        if best is None:
+            return None
+        entry = get_json(best[1]["key"], self.backend)
+        if not entry:
+            return None
+        # Confirm against the stored query's own tokens, not only the index copy
+        score = self._matches(tokens, normalize_query(entry["query"]))
+        if score is None:
+            return None
+        return CacheHit(entry["query"], score, entry["papers"], entry["response"])
+
+    def fresh_until(self, query, language):
+        """Expiry timestamp of the exact entry for this query, or 0 if there is none"""
+        key = self._entry_key(normalize_query(query), language)
+        items = [json.loads(item) for item in self.backend.lrange(self.INDEX_KEY, -self.max_entries, -1)]
+        return max([item["expires_at"] for item in items if item["key"] == key] or [0])
+
+    def store(self, query, language, papers, response):
+        tokens = normalize_query(query)
+        if not tokens:
+            return
+        key = self._entry_key(tokens, language)
+        item = {
+            "key": key,
+            "language": language,
+            "version": self.version,
+            "tokens": sorted(tokens),
+            "signature": [int(value) for value in minhash(tokens)],
+            "expires_at": time.time() + self.ttl,
+        }
+        try:
+            set_json(key, {"query": query, "papers": papers, "response": response}, self.ttl, self.backend)
+            self.backend.rpush(self.INDEX_KEY, json.dumps(item).encode())
+            self.backend.ltrim(self.INDEX_KEY, -self.max_entries, -1)
+        except Exception:
+            pass  # The response is already built; never fail a search over caching it
+
+
+def source_version(*parts):
+    """Short digest of functions' or modules' source code and plain strings"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((part if isinstance(part, str) else inspect.getsource(part)).encode())
+        digest.update(b"\x1f")
+    return digest.hexdigest()[:12]
+
+
+def normalize_argument(text):
+    """Cache form of a command argument: the canonical URL for links, else collapsed whitespace"""
+    text = " ".join(text.split())
+    return (text.startswith("http") and canonical_url(text)) or text
+
+
+class ResponseCache:
+    """Whole rendered responses of deterministic commands, shared across sessions
+
+    Keys combine the command, its normalized argument and the command's
+    pipeline version, so editing the code that renders a response orphans its
+    old entries. Each command has its own TTL; commands without one are not cached.
+    """
+
+    def __init__(self, versions, ttls, backend=None, metrics=None):
+        self.versions = versions
+        self.ttls = ttls
+        self.backend = backend or get_state_backend()
+        self.metrics = metrics
+
+    def _key(self, command, argument):
+        return cache_key("response", command, self.versions.get(command, ""), normalize_argument(argument))
+
+    def get(self, command, argument):
+        """The stored {"response"} or None"""
+        if not self.ttls.get(command):
+            return None
+        try:
+            entry = get_json(self._key(command, argument), self.backend)
+        except Exception:
+            entry = None  # A cache outage must never break the request path
+        if self.metrics:
+            self.metrics.incr("response_cache_total", command=command, outcome="hit" if entry else "miss")
+        return entry
+
+    def store(self, command, argument, response):
+        if not self.ttls.get(command):
+            return
+        try:
+            set_json(self._key(command, argument), {"response": response}, self.ttls[command], self.backend)
+        except Exception:
+            pass
+
+
+class QueryPopularity:
+    """Daily logs of searched queries in the shared state, aggregated by normalized query"""
+
+    def __init__(self, backend=None, days=7, max_per_day=20000):
+        self.backend = backend or get_state_backend()
+        self.days = days
+        self.max_per_day = max_per_day
+
+    @staticmethod
+    def _day_key(day):
+        return f"popularity:{day.isoformat()}"
+
+    def record(self, query, language):
+        if not normalize_query(query):
+            return
+        key = self._day_key(date.today())
+        try:
+            self.backend.rpush(key, json.dumps({"query": query, "language": language}).encode())
+            self.backend.ltrim(key, -self.max_per_day, -1)
+            self.backend.expire(key, (self.days + 1) * 86400)
+        except Exception:
+            pass  # Popularity only steers the cache warmer; never fail a search over it
+
+    def top(self, n):
+        """The ``n`` most searched (query, language, count) of the last ``days`` days
+
+        Phrasings with the same normalized tokens count together; the most
+        common phrasing represents the group.
+        """
+        counts = Counter()
+        phrasings = {}
+        today = date.today()
+        for offset in range(self.days):
+            for raw in self.backend.lrange(self._day_key(today - timedelta(days=offset)), 0, -1):
+                item = json.loads(raw)
+                group = (" ".join(sorted(normalize_query(item["query"]))), item["language"])
+                counts[group] += 1
+                phrasings.setdefault(group, Counter())[item["query"]] += 1
+        return [
+            (phrasings[group].most_common(1)[0][0], group[1], count)
+            for group, count in counts.most_common(n)
+        ]
@@ -0,0 +1,94 @@
+import re
+import unicodedata
+from collections import Counter, namedtuple
+from datetime import date
+import numpy as np
+
+RankedPaper = namedtuple("RankedPaper", ["paper", "score", "relevance", "recency", "citations"])
+
+DEFAULT_WEIGHTS = {"relevance": 0.6, "recency": 0.2, "citations": 0.2}
+
+STOPWORDS = {
+    # Spanish
+    "de", "la", "el", "en", "y", "los", "las", "del", "un", "una", "por", "para", "con", "sin", "sobre",
+    "que", "se", "al", "lo", "su", "sus", "es", "son", "como", "o", "u", "e", "entre", "mas", "ingles",
+    # English
+    "the", "of", "and", "in", "on", "for", "to", "a", "an", "with", "without", "by", "from", "at", "or",
+    "is", "are", "as", "its", "their", "vs", "versus",
+}
+
+_TOKEN_RE = re.compile(r"\w+")
+_YEAR_RE = re.compile(r"(?:19|20)\d{2}")
+
+
+def fold_accents(text):
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return [token for token in _TOKEN_RE.findall(fold_accents(text.lower())) if len(token) > 1 and token not in STOPWORDS]
+
+
+def parse_year(value):
+    match = _YEAR_RE.search(str(value or ""))
+    return int(match.group(0)) if match else None
+
+
+def _paper_tokens(paper):
+    # Titles count twice: a query term in the title says more than one in the abstract
+    title = f"{paper.get('title', '')} {paper.get('title_es', '')}"
+    abstract = f"{paper.get('abstract', '')} {paper.get('abstract_es', '')}"
+    return tokenize(title) * 2 + tokenize(abstract)
+
+
+def bm25_scores(query, papers, k1=1.5, b=0.75):
+    """BM25 of every paper against the query, computed over the whole result set at once"""
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms or not papers:
+        return np.zeros(len(papers))
+    index = {term: i for i, term in enumerate(terms)}
+    tf = np.zeros((len(papers), len(terms)))
+    lengths = np.zeros(len(papers))
+    for row, paper in enumerate(papers):
+        tokens = _paper_tokens(paper)
+        lengths[row] = len(tokens)
+        for token, count in Counter(tokens).items():
+            column = index.get(token)
+            if column is not None:
+                tf[row, column] = count
+    df = (tf > 0).sum(axis=0)
+    idf = np.log(1 + (len(papers) - df + 0.5) / (df + 0.5))
+    avgdl = lengths.mean() or 1.0
+    norm = k1 * (1 - b + b * lengths / avgdl)
+    return ((tf * (k1 + 1)) / (tf + norm[:, None]) * idf).sum(axis=1)
+
+
+def rank_papers(query, papers, weights=None, half_life=5.0):
+    """Rank papers by text relevance, recency and citations; returns RankedPaper list, best first"""
+    if not papers:
+        return []
+    weights = weights or DEFAULT_WEIGHTS
+
+    relevance = bm25_scores(query, papers)
+    if relevance.max() > 0:
+        relevance = relevance / relevance.max()
+
+    current_year = date.today().year
+    years = np.array([parse_year(paper.get('year')) or np.nan for paper in papers], dtype=float)
+    # Halve the recency score every ``half_life`` years; unknown years score 0
+    recency = np.nan_to_num(np.power(0.5, np.clip(current_year - years, 0, None) / half_life))
+
+    cited = np.array([float(paper.get('cited_by') or 0) for paper in papers])
+    citations = np.log1p(cited)
+    if citations.max() > 0:
+        citations = citations / citations.max()
+
+    scores = (weights["relevance"] * relevance
+              + weights["recency"] * recency
+              + weights["citations"] * citations)
+    # Stable sort keeps provider order for ties, so rankings are deterministic
+    order = np.argsort(-scores, kind="stable")
+    return [
+        RankedPaper(papers[i], float(scores[i]), float(relevance[i]), float(recency[i]), float(citations[i]))
+        for i in order
+    ]
@@ -0,0 +1,167 @@
+import re
+from collections import namedtuple
+from bs4 import NavigableString, Tag, Comment
+
+# A section is a span of SegmentedArticle.text; body text runs from start to end
+Section = namedtuple("Section", ["name", "heading", "start", "end"])
+
+# Canonical section names (kept in Spanish, as shown to the user) and their
+# English/Spanish IMRaD heading variants
+SECTION_PATTERNS = {
+    "resumen": r"abstract|summary|resumen",
+    "introducción": r"introduction|background|introducci[oó]n|antecedentes|marco te[oó]rico",
+    "métodos": r"(?:materials?|patients?|subjects?)\s+and\s+methods|methods?|methodology|study\s+design"
+               r"|materiales?\s+y\s+m[eé]todos|pacientes\s+y\s+m[eé]todos|m[eé]todos?|metodolog[ií]a",
+    "resultados": r"results|findings|resultados|hallazgos",
+    "discusión": r"discussion|discusi[oó]n",
+    "conclusión": r"conclusions?|concluding\s+remarks|conclusi[oó]n(?:es)?",
+    "referencias": r"references|bibliography|literature\s+cited|referencias|bibliograf[ií]a",
+}
+SECTION_ORDER = list(SECTION_PATTERNS)
+CONTENT_SECTIONS = [name for name in SECTION_ORDER if name != "referencias"]
+
+_GROUPS = {f"s{i}": name for i, name in enumerate(SECTION_ORDER)}
+_ALTERNATION = "|".join(f"(?P<{group}>{SECTION_PATTERNS[name]})" for group, name in _GROUPS.items())
+# Optional numbering ("2.", "II.", "3.1") before the heading word
+_NUMBERING = r"(?:(?:\d+(?:\.\d+)*|[IVX]+)\.?\s*)?"
+HEADING_RE = re.compile(rf"^\s*{_NUMBERING}(?:{_ALTERNATION})\b", re.IGNORECASE)
+# Plain text: a heading on its own line, or "Methods:" at a sentence start when whitespace was collapsed
+TEXT_HEADING_RE = re.compile(
+    rf"(?:^[ \t]*|(?<=[.!?]\s)){_NUMBERING}(?:{_ALTERNATION})(?:[ \t]*:?[ \t]*$|\s*:)",
+    re.IGNORECASE | re.MULTILINE
+)
+_WHITESPACE = re.compile(r"\s+")
+
+MAX_HEADING_LENGTH = 80
+HEADING_TAGS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4}
+SKIP_TAGS = {"script", "style", "noscript", "nav", "footer", "header", "aside", "form", "button", "svg"}
+BLOCK_TAGS = {
+    "p", "div", "section", "article", "main", "li", "ul", "ol", "table", "tr", "br", "blockquote",
+    "figure", "figcaption", "h5", "h6", "sec", "abstract", "title", "caption", "dl", "dt", "dd",
+}
+
+
+def match_heading(heading):
+    """Return the canonical section name for a heading, or None"""
+    if not heading or len(heading) > MAX_HEADING_LENGTH:
+        return None
+    match = HEADING_RE.match(heading)
+    return _GROUPS[match.lastgroup] if match else None
+
+
+class SegmentedArticle:
+    """Article text plus section offsets; section bodies are sliced on demand"""
+
+    def __init__(self, text, sections=None):
+        self.text = text
+        self.sections = sections or []
+
+    def __bool__(self):
+        return bool(self.sections)
+
+    def section_spans(self, name):
+        return [(section.start, section.end) for section in self.sections if section.name == name]
+
+    def section_text(self, name):
+        return "\n\n".join(self.text[start:end].strip() for start, end in self.section_spans(name))
+
+    def section_texts(self, include_references=False):
+        """Yield (name, text) for every section found, in IMRaD order"""
+        names = SECTION_ORDER if include_references else CONTENT_SECTIONS
+        found = {section.name for section in self.sections}
+        for name in names:
+            if name in found:
+                text = self.section_text(name)
+                if text:
+                    yield name, text
+
+    def to_dict(self):
+        return {"text": self.text, "sections": [list(section) for section in self.sections]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["text"], [Section(*section) for section in data.get("sections", [])])
+
+
+def segment_html(root):
+    """Flatten parsed HTML/PMC XML into paragraphs and locate sections in one pass
+
+    Headings come from h1–h4 tags and JATS ``<sec><title>`` elements. A
+    section ends at the next recognised heading or at an unrecognised heading
+    of the same or higher level (e.g. "Acknowledgements" after "Discussion").
+    """
+    parts = []
+    length = 0
+    pending_break = False
+    sections = []
+    current = None  # [name, heading, start, level]
+
+    def close(end):
+        sections.append(Section(current[0], current[1], current[2], end))
+
+    stack = [(root, False)]
+    while stack:
+        node, exiting = stack.pop()
+        if exiting:
+            pending_break = True
+            continue
+        if isinstance(node, NavigableString):
+            if isinstance(node, Comment):
+                continue
+            chunk = _WHITESPACE.sub(" ", str(node))
+            if not chunk.strip():
+                continue
+            if pending_break and parts:
+                parts.append("\n\n")
+                length += 2
+                chunk = chunk.lstrip()
+            elif not parts:
+                chunk = chunk.lstrip()
+            pending_break = False
+            parts.append(chunk)
+            length += len(chunk)
+            continue
+        if not isinstance(node, Tag) or node.name in SKIP_TAGS:
+            continue
+
+        is_sec_title = node.name == "title" and node.parent is not None and node.parent.name == "sec"
+        if node.name in HEADING_TAGS or is_sec_title:
+            heading = _WHITESPACE.sub(" ", node.get_text(" ")).strip()
+            if not heading:
+                continue
+            level = HEADING_TAGS.get(node.name) or len(node.find_parents("sec"))
+            name = match_heading(heading)
+            if current and (name or level <= current[3]):
+                close(length)
+                current = None
+            if parts:
+                parts.append("\n\n")
+                length += 2
+            parts.append(heading)
+            length += len(heading)
+            pending_break = True
+            if name:
+                current = [name, heading, length, level]
+            continue
+
+        if node.name in BLOCK_TAGS:
+            pending_break = True
+            stack.append((node, True))
+        stack.extend((child, False) for child in reversed(node.contents))
+
+    if current:
+        close(length)
+    return SegmentedArticle("".join(parts), sections)
+
+
+def segment_text(text):
+    """Locate sections in plain text (cached pages, PDF text) with a single regex scan"""
+    sections = []
+    current = None
+    for match in TEXT_HEADING_RE.finditer(text):
+        if current:
+            sections.append(Section(current[0], current[1], current[2], match.start()))
+        current = (_GROUPS[match.lastgroup], match.group(0).strip(), match.end())
+    if current:
+        sections.append(Section(current[0], current[1], current[2], len(text)))
+    return SegmentedArticle(text, sections)
@@ -0,0 +1,63 @@
+import os
+import sys
+from dotenv import load_dotenv
+load_dotenv()
+
+# Where Streamlit looks for secrets.toml
+SECRETS_PATHS = [
+    os.path.join(os.path.expanduser("~"), ".streamlit", "secrets.toml"),
+    os.path.join(os.getcwd(), ".streamlit", "secrets.toml"),
+]
+
+
+def _streamlit_secrets():
+    # CLI tools without a secrets.toml never import Streamlit
+    if "streamlit" not in sys.modules and not any(os.path.exists(path) for path in SECRETS_PATHS):
+        return None
+    import streamlit as st
+    return st.secrets
+
+
+def get_setting(name, default=None):
+    """Read a setting from Streamlit secrets, falling back to environment variables"""
+    try:
+        secrets = _streamlit_secrets()
+        value = secrets.get(name) if secrets is not None else None
+    except Exception:
+        # Unreadable secrets.toml (CLI tools, tests): only the environment is available
+        value = None
+    if value is None:
+        value = os.getenv(name)
+    return default if value in (None, "") else value
+
+
+def get_int_setting(name, default):
+    try:
+        return int(get_setting(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def get_float_setting(name, default):
+    try:
+        return float(get_setting(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_mapping(value):
+    """``"a=x,b=y"`` setting value as a dict"""
+    mapping = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            key, _, val = item.partition("=")
+            mapping[key.strip()] = val.strip()
+    return mapping
+
+
+def get_list_setting(name, default=None):
+    """A list setting: a TOML array in secrets or a comma-separated string"""
+    value = get_setting(name, default)
+    if isinstance(value, str):
+        value = value.split(",")
+    return [str(item).strip() for item in value or [] if str(item).strip()]
@@ -0,0 +1,405 @@
+import contextvars
+import hashlib
+import json
+import socket
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlparse, unquote
+from settings import get_setting, get_int_setting
+
+
+class StateBackend:
+    """Key-value interface shared by every replica: caches, sessions and job status
+
+    Values are bytes. Keys expire after ``ttl`` seconds when one is given.
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def incr(self, key, amount=1):
+        raise NotImplementedError
+
+    def expire(self, key, ttl):
+        raise NotImplementedError
+
+    def ttl(self, key):
+        """Seconds until ``key`` expires; None if it has no expiry or does not exist"""
+        raise NotImplementedError
+
+    def rpush(self, key, *values):
+        """Append values to a list and return its new length"""
+        raise NotImplementedError
+
+    def lrange(self, key, start, stop):
+        """Return list items between ``start`` and ``stop`` (inclusive, negatives count from the end)"""
+        raise NotImplementedError
+
+    def llen(self, key):
+        raise NotImplementedError
+
+    def ltrim(self, key, start, stop):
+        """Keep only list items between ``start`` and ``stop`` (same indexing as lrange)"""
+        raise NotImplementedError
+
+    def hset(self, key, mapping):
+        raise NotImplementedError
+
+    def hgetall(self, key):
+        raise NotImplementedError
+
+
+class InProcessBackend(StateBackend):
+    """Single-process backend with LRU eviction; state is lost when the process exits"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._expires = {}
+        self._lock = threading.RLock()
+
+    def _live(self, key):
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        if key in self._data:
+            self._data.move_to_end(key)
+            return True
+        return False
+
+    def _store(self, key, value, ttl=None):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if ttl:
+            self._expires[key] = time.time() + ttl
+        else:
+            self._expires.pop(key, None)
+        while len(self._data) > self.max_entries:
+            evicted, _ = self._data.popitem(last=False)
+            self._expires.pop(evicted, None)
+
+    def get(self, key):
+        with self._lock:
+            return self._data[key] if self._live(key) else None
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            value = int(self._data[key]) + amount if self._live(key) else amount
+            self._data[key] = str(value).encode()
+            self._data.move_to_end(key)
+            return value
+
+    def expire(self, key, ttl):
+        with self._lock:
+            if self._live(key):
+                self._expires[key] = time.time() + ttl
+
+    def ttl(self, key):
+        with self._lock:
+            if not self._live(key) or key not in self._expires:
+                return None
+            return self._expires[key] - time.time()
+
+    def rpush(self, key, *values):
+        with self._lock:
+            items = self._data[key] if self._live(key) else []
+            items.extend(values)
+            self._data[key] = items
+            self._data.move_to_end(key)
+            return len(items)
+
+    def lrange(self, key, start, stop):
+        with self._lock:
+            if not self._live(key):
+                return []
+            items = self._data[key]
+            start = start + len(items) if start < 0 else start
+            stop = stop + len(items) if stop < 0 else stop
+            return items[max(start, 0):stop + 1]
+
+    def llen(self, key):
+        with self._lock:
+            return len(self._data[key]) if self._live(key) else 0
+
+    def ltrim(self, key, start, stop):
+        with self._lock:
+            if self._live(key):
+                self._data[key] = self.lrange(key, start, stop)
+
+    def hset(self, key, mapping):
+        with self._lock:
+            fields = self._data[key] if self._live(key) else {}
+            fields.update(mapping)
+            self._data[key] = fields
+            self._data.move_to_end(key)
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._data[key]) if self._live(key) else {}
+
+    def items(self):
+        """Snapshot of the live (key, value) pairs, for memory reports"""
+        with self._lock:
+            now = time.time()
+            return [
+                (key, value) for key, value in self._data.items()
+                if self._expires.get(key) is None or self._expires[key] > now
+            ]
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisBackend(StateBackend):
+    """Minimal RESP client, so any Redis-compatible server (Redis, Valkey, KeyDB) can share state"""
+
+    def __init__(self, host="localhost", port=6379, db=0, password=None, timeout=5):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        # One connection per thread: Streamlit sessions and worker pools run concurrently
+        self._local = threading.local()
+
+    @classmethod
+    def from_url(cls, url):
+        parsed = urlparse(url) if isinstance(url, str) else url
+        db = parsed.path.lstrip("/")
+        return cls(
+            host=parsed.hostname or "localhost",
+            port=parsed.port or 6379,
+            db=int(db) if db else 0,
+            password=unquote(parsed.password) if parsed.password else None
+        )
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._local.sock = sock
+        self._local.reader = sock.makefile("rb")
+        if self.password:
+            self._send("AUTH", self.password)
+        if self.db:
+            self._send("SELECT", self.db)
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            try:
+                self._local.reader.close()
+                sock.close()
+            except OSError:
+                pass
+        self._local.sock = None
+
+    def _send(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        self._local.sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._local.reader.readline()
+        if not line:
+            raise ConnectionError("Conexión cerrada por el servidor de estado")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload
+        if kind == b"-":
+            raise RedisError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length == -1:
+                return None
+            data = self._local.reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length == -1:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RedisError(f"Respuesta inesperada: {line!r}")
+
+    def execute(self, *args):
+        # Retry once on a dropped connection (server restart, idle timeout)
+        for attempt in range(2):
+            if getattr(self._local, "sock", None) is None:
+                self._connect()
+            try:
+                return self._send(*args)
+            except ConnectionError:
+                self._close()
+                if attempt:
+                    raise
+            except OSError:
+                # Timeouts are not retried: the command may already have been applied
+                self._close()
+                raise
+
+    def get(self, key):
+        return self.execute("GET", key)
+
+    def set(self, key, value, ttl=None):
+        if ttl:
+            self.execute("SET", key, value, "EX", int(ttl))
+        else:
+            self.execute("SET", key, value)
+
+    def delete(self, key):
+        self.execute("DEL", key)
+
+    def incr(self, key, amount=1):
+        return self.execute("INCRBY", key, amount)
+
+    def expire(self, key, ttl):
+        self.execute("EXPIRE", key, int(ttl))
+
+    def ttl(self, key):
+        seconds = self.execute("TTL", key)
+        # -2: no such key, -1: no expiry
+        return seconds if seconds is not None and seconds >= 0 else None
+
+    def rpush(self, key, *values):
+        return self.execute("RPUSH", key, *values)
+
+    def lrange(self, key, start, stop):
+        return self.execute("LRANGE", key, start, stop) or []
+
+    def llen(self, key):
+        return self.execute("LLEN", key)
+
+    def ltrim(self, key, start, stop):
+        self.execute("LTRIM", key, start, stop)
+
+    def hset(self, key, mapping):
+        if not mapping:
+            return
+        args = []
+        for field, value in mapping.items():
+            args.extend([field, value])
+        self.execute("HSET", key, *args)
+
+    def hgetall(self, key):
+        items = self.execute("HGETALL", key) or []
+        return {items[i].decode(): items[i + 1] for i in range(0, len(items), 2)}
+
+
+STATE_BACKENDS = {
+    "memory": lambda url: InProcessBackend(get_int_setting("SHARED_STATE_MAX_ENTRIES", 10000)),
+    "redis": RedisBackend.from_url,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def register_state_backend(scheme, factory):
+    """Register a factory taking the parsed state URL and returning a StateBackend"""
+    STATE_BACKENDS[scheme] = factory
+
+
+def get_state_backend():
+    """Return the process-wide backend configured by SHARED_STATE_URL (in-process by default)"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            url = urlparse(get_setting("SHARED_STATE_URL", "memory://"))
+            if url.scheme not in STATE_BACKENDS:
+                raise ValueError(f"Backend de estado compartido no soportado: {url.scheme}")
+            _backend = STATE_BACKENDS[url.scheme](url)
+        return _backend
+
+
+def cache_key(namespace, *parts):
+    digest = hashlib.sha256("\x1f".join(str(part) for part in parts).encode()).hexdigest()
+    return f"cache:{namespace}:{digest}"
+
+
+def get_json(key, backend=None):
+    value = (backend or get_state_backend()).get(key)
+    return json.loads(value) if value is not None else None
+
+
+def set_json(key, value, ttl=None, backend=None):
+    (backend or get_state_backend()).set(key, json.dumps(value, ensure_ascii=False).encode(), ttl)
+
+
+_refresh_within = contextvars.ContextVar("papuy_refresh_within", default=None)
+
+
+@contextmanager
+def refresh_ahead(seconds):
+    """Within this block, ``cached`` recomputes entries that expire in less than ``seconds``"""
+    reset = _refresh_within.set(seconds)
+    try:
+        yield
+    finally:
+        _refresh_within.reset(reset)
+
+
+def cached(namespace, parts, compute, ttl=None, backend=None):
+    """Return the cached JSON value for ``parts`` or compute, store and return it
+
+    ``compute`` results that are error strings (the repo's error convention) are
+    not cached. Under ``refresh_ahead`` an entry close to expiry is recomputed
+    (the window is capped at half of ``ttl``, so a fresh entry is never refreshed);
+    if that fails, the cached value is still returned.
+    """
+    key = cache_key(namespace, *parts)
+    value = None
+    try:
+        value = get_json(key, backend)
+        window = _refresh_within.get()
+        if window and ttl:
+            window = min(window, ttl // 2)
+        if value is not None:
+            remaining = (backend or get_state_backend()).ttl(key) if window else None
+            if remaining is None or remaining >= window:
+                return value
+    except Exception:
+        # A cache outage must never break the request path
+        pass
+    stale, value = value, compute()
+    if isinstance(value, str) and value.startswith("Error"):
+        return stale if stale is not None else value
+    try:
+        set_json(key, value, ttl, backend)
+    except Exception:
+        pass
+    return value
+
+
+def set_job_status(job_id, ttl=86400, backend=None, **fields):
+    """Record the status of a background job so any replica can report it"""
+    backend = backend or get_state_backend()
+    key = f"job:{job_id}"
+    backend.hset(key, {field: json.dumps(value, ensure_ascii=False) for field, value in fields.items()})
+    backend.expire(key, ttl)
+
+
+def get_job_status(job_id, backend=None):
+    fields = (backend or get_state_backend()).hgetall(f"job:{job_id}")
+    return {field: json.loads(value) for field, value in fields.items()}
@@ -0,0 +1,143 @@
+import re
+from collections import namedtuple
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from cancellation import run_cancellable
+from section_segmenter import SegmentedArticle
+
+# A chunk holds whole paragraphs of one or more consecutive sections
+Chunk = namedtuple("Chunk", ["sections", "text"])
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+MAP_PROMPT = """Eres un asistente de investigación médica. Lee el siguiente fragmento de un artículo científico (secciones: {sections}) y extrae en español, de forma concisa, la información que aporte sobre:
+- Objetivo del estudio
+- Metodología (diseño, población, intervenciones, análisis)
+- Resultados principales (con cifras y significancia estadística cuando existan)
+- Conclusiones
+- Limitaciones
+
+Omite los apartados sobre los que el fragmento no diga nada. No inventes información.
+
+Fragmento:
+{text}"""
+
+COLLAPSE_PROMPT = """Combina las siguientes notas parciales de un mismo artículo médico en un único conjunto de notas en español, eliminando repeticiones y conservando cifras y hallazgos concretos:
+
+{text}"""
+
+REDUCE_PROMPT = """A partir de las siguientes notas sobre un artículo médico, redacta en español un resumen estructurado con exactamente estas secciones en formato markdown:
+
+### 🎯 Objetivo del Estudio
+### 🔬 Metodología
+### 📈 Resultados Principales
+### 💡 Conclusiones
+### ⚠️ Limitaciones
+
+Termina con un párrafo breve sobre la relevancia clínica del estudio. Si las notas no mencionan limitaciones, indícalo. No inventes información.
+
+Notas:
+{text}"""
+
+
+def estimate_tokens(text):
+    # ~4 characters per token for English/Spanish prose; avoids a tokenizer download
+    return len(text) // 4 + 1
+
+
+class ChunkedSummarizer:
+    """Map-reduce summarization so whole papers fit the model's context window
+
+    Chunks are summarized concurrently (map), the partial notes are merged in
+    rounds until they fit one request (collapse) and then turned into the
+    structured summary (reduce).
+    """
+
+    def __init__(self, llm, max_chunk_tokens=3000, max_concurrency=4):
+        self.max_chunk_tokens = max_chunk_tokens
+        self.max_concurrency = max_concurrency
+        parser = StrOutputParser()
+        self.map_chain = ChatPromptTemplate.from_template(MAP_PROMPT) | llm | parser
+        self.collapse_chain = ChatPromptTemplate.from_template(COLLAPSE_PROMPT) | llm | parser
+        self.reduce_chain = ChatPromptTemplate.from_template(REDUCE_PROMPT) | llm | parser
+
+    def _split_long(self, paragraph):
+        """Split a paragraph larger than the chunk budget on sentence boundaries"""
+        pieces, current = [], ""
+        for sentence in _SENTENCE_END.split(paragraph):
+            if current and estimate_tokens(current) + estimate_tokens(sentence) > self.max_chunk_tokens:
+                pieces.append(current)
+                current = ""
+            # A single sentence over budget is cut at the character limit
+            while estimate_tokens(sentence) > self.max_chunk_tokens:
+                cut = self.max_chunk_tokens * 4
+                pieces.append(sentence[:cut])
+                sentence = sentence[cut:]
+            current = f"{current} {sentence}".strip()
+        if current:
+            pieces.append(current)
+        return pieces
+
+    def chunk(self, article):
+        """Pack section paragraphs into token-bounded chunks, never splitting a paragraph needlessly"""
+        if isinstance(article, str):
+            article = SegmentedArticle(article)
+        blocks = list(article.section_texts()) or [("texto", article.text)]
+
+        chunks = []
+        sections, parts, size = [], [], 0
+
+        def flush():
+            nonlocal sections, parts, size
+            if parts:
+                chunks.append(Chunk(sections, "\n\n".join(parts)))
+            sections, parts, size = [], [], 0
+
+        for name, text in blocks:
+            header = f"{name.upper()}:"
+            for paragraph in (p.strip() for p in text.split("\n\n")):
+                if not paragraph:
+                    continue
+                for piece in self._split_long(paragraph):
+                    piece_tokens = estimate_tokens(piece)
+                    if size + piece_tokens > self.max_chunk_tokens:
+                        flush()
+                    if not sections or sections[-1] != name:
+                        sections.append(name)
+                        parts.append(header)
+                    parts.append(piece)
+                    size += piece_tokens
+        flush()
+        return chunks
+
+    def _batch(self, chain, inputs):
+        return run_cancellable(chain.batch, inputs, config={"max_concurrency": self.max_concurrency})
+
+    def summarize(self, article):
+        chunks = self.chunk(article)
+        if not chunks:
+            return "No se encontró texto para resumir."
+        if len(chunks) == 1:
+            return run_cancellable(self.reduce_chain.invoke, {"text": chunks[0].text})
+
+        notes = self._batch(self.map_chain, [
+            {"sections": ", ".join(chunk.sections), "text": chunk.text} for chunk in chunks
+        ])
+
+        # Collapse the notes in concurrent rounds until they fit a single request
+        while estimate_tokens("\n\n".join(notes)) > self.max_chunk_tokens and len(notes) > 1:
+            groups, group, size = [], [], 0
+            for note in notes:
+                note_tokens = estimate_tokens(note)
+                if group and size + note_tokens > self.max_chunk_tokens:
+                    groups.append(group)
+                    group, size = [], 0
+                group.append(note)
+                size += note_tokens
+            groups.append(group)
+            if len(groups) == len(notes):
+                # Every note already fills a request on its own; pair them up to make progress
+                groups = [notes[i:i + 2] for i in range(0, len(notes), 2)]
+            notes = self._batch(self.collapse_chain, [{"text": "\n\n---\n\n".join(group)} for group in groups])
+
+        return run_cancellable(self.reduce_chain.invoke, {"text": "\n\n---\n\n".join(notes)})